@@ -0,0 +1,65 @@
+"""
+Per-write latency of persistent (committed once) output tasks versus tasks that are started and stopped around
+every write.
+
+Run it against a simulated device (e.g. a PCIe-6321 simulated in NI MAX) so it doesn't toggle rig hardware:
+
+    python daq_write_benchmark.py --writes 2000
+
+or against the in-process simulated backend with its USB latency model:
+
+    NIDAQ_BACKEND=simulated python daq_write_benchmark.py --usb-latency
+"""
+import argparse
+import time
+
+import numpy as np
+
+from visual_behavior import nidaqio, simulated_daqmx
+
+
+def time_writes(task, data, writes):
+    durations = np.empty(writes)
+    for i in range(writes):
+        t0 = time.perf_counter()
+        task.write(data)
+        durations[i] = time.perf_counter() - t0
+    return durations
+
+
+def report(label, durations):
+    us = durations * 1e6
+    print(f'{label:<24} mean {us.mean():9.1f} us   median {np.median(us):9.1f} us   '
+          f'p99 {np.percentile(us, 99):9.1f} us   max {us.max():9.1f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writes', help='number of writes per mode', type=int, default=1000)
+    parser.add_argument('--digital-line', help='digital output line', default='port1/line3')
+    parser.add_argument('--analog-channel', help='analog output channel', default='ao0')
+    parser.add_argument('--usb-latency', help='apply simulated_daqmx.USB_LATENCY on the simulated backend',
+                        action='store_true')
+    args = parser.parse_args()
+
+    if nidaqio.SIMULATED and args.usb_latency:
+        simulated_daqmx.reset(latency=simulated_daqmx.USB_LATENCY)
+
+    daq = nidaqio.NIDAQio()
+    digital = np.ones(10, dtype=np.uint8)
+    analog = np.zeros(1000)
+
+    for persistent in (False, True):
+        mode = 'persistent' if persistent else 'start/stop'
+        daq.create_digital_out_task('bench_do', args.digital_line, overwrite=True, persistent=persistent)
+        daq.create_analog_out_voltage_task('bench_ao', args.analog_channel, overwrite=True, persistent=persistent)
+
+        report(f'do {mode}', time_writes(daq.bench_do, digital, args.writes))
+        report(f'ao {mode}', time_writes(daq.bench_ao, analog, args.writes))
+
+        daq.bench_do.StopTask()
+        daq.bench_ao.StopTask()
+
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,8 @@ class StageUI(QMainWindow):
     col_moving = 3
     col_engaged = 4
     col_limit = 5
+    jog_keys = {QtCore.Qt.Key_A: 0, QtCore.Qt.Key_D: 0, QtCore.Qt.Key_W: 1, QtCore.Qt.Key_S: 1,
+                QtCore.Qt.Key_Q: 2, QtCore.Qt.Key_E: 2}
 
     def __init__(self):
         """
@@ -42,14 +44,21 @@ class StageUI(QMainWindow):
         self.admin_enabled = False
 
         self.hw_proxy = hardware_proxy.RemoteStageController()
+        self.step_size = self.config.phidget.step_size
+        self.load_x_translation = self.config.load_x_translation
+        self.hw_proxy.config_watcher.register('phidget.step_size', partial(self._set_config_value, 'step_size'))
+        self.hw_proxy.config_watcher.register('load_x_translation',
+                                              partial(self._set_config_value, 'load_x_translation'))
         self.stage = None
         self.daq = None
+        self._held_jogs = set()
 
         self.ui = uic.loadUi(self.module_path[0] + '/resources/remote_stage_controller.ui')
         self.setCentralWidget(self.ui)
 
         self.setup_ui()
         self.log('Stage Controller Ready')
+        self._status_version = None
         self.table_timer = QTimer()
         self.table_timer.timeout.connect(self.update_table)
 
@@ -67,6 +76,11 @@ class StageUI(QMainWindow):
         logging.info(message)
         self.ui.statusBar.showMessage(message)
 
+    def _set_config_value(self, name, old, new):
+        # applied from the configuration watcher's thread, so only log instead of touching the status bar
+        setattr(self, name, new)
+        logging.info(f'{name} changed from {old} to {new}')
+
     def setup_db(self):
         db = {}
         return db
@@ -167,8 +181,7 @@ class StageUI(QMainWindow):
         self.hw_proxy.clamp_signal(axis)
 
     def signal_emergency(self):
-        self.signal_retract_lickspout()
-        self.hw_proxy.stop_motion()
+        self.hw_proxy.emergency_stop()
 
     def signal_ignore_limits(self, state):
         if self.ui.cb_limits.isChecked():
@@ -179,26 +192,22 @@ class StageUI(QMainWindow):
             self.hw_proxy.ignore_limits(False)
 
     def update_table(self):
-        moving = self.stage.is_moving
-        engaged = self.stage.is_engaged
-        limits = self.stage.limits
-        position = self.stage.position
-        #self.ui.lbl_temperature.setText('Temp: ', signal_temp_value) 'need a refresh frequency'
-
-        # if any(motion):
-            # self.ui.lbl_encoder_position.setText('Position: ', signal_encoder_velocity)
-        # else:
-            # self.ui.lbl_encoder_position.setText('Position: ')
-
-        #if any(motion):
-            #self.ui.lbl_encoder_velocity.setText('Velocity: ', signal_encoder_velocity)
-         #else:
-            #self.ui.lbl_encoder_velocity.setText('Velocity: ')
-
-        # if any(motion):
-            # self.ui.lbl_encoder_acceleration.setText('Velocity: ', signal_encoder_velocity)
-        # else:
-            # self.ui.lbl_encoder_acceleration.setText('Velocity: ')
+        status = self.stage.status(since=self._status_version)
+        if status is None:
+            return
+        self._status_version = status.version
+        moving = status.is_moving
+        engaged = status.is_engaged
+        limits = status.limits
+        position = status.position
+        encoder_position, encoder_velocity, encoder_acceleration = status.encoder
+        if status.temperature is None:
+            self.ui.lbl_temperature.setText('Temp: -- V')
+        else:
+            self.ui.lbl_temperature.setText(f'Temp: {status.temperature:.2f} V')
+        self.ui.lbl_encoder_position.setText(f'Position: {encoder_position:.1f}')
+        self.ui.lbl_encoder_velocity.setText(f'Velocity: {encoder_velocity:.1f}')
+        self.ui.lbl_encoder_acceleration.setText(f'Acceleration: {encoder_acceleration:.1f}')
 
         if any(moving):
             self.ui.lbl_status.setText('Status: Stage Moving')
@@ -222,7 +231,8 @@ class StageUI(QMainWindow):
 
     def axis_step(self, axis, sign=1):
         """
-        Step the axis by a value defined by sb_step.
+        Jog the axis by a value defined by le_step_size.  Steps sent while the axis is still moving extend the
+        running jog.
         If the axis has hit it's limit switch, send the analog signal to release the break before sending a move_stage
         :param axis:
         :param sign:
@@ -235,10 +245,8 @@ class StageUI(QMainWindow):
         if self.ui.le_step_size.text() != '':
             step = float(self.ui.le_step_size.text())
         else:
-            step = self.config.phidget.step_size
-        position = self.stage.position
-        position[axis] += step * sign
-        self.stage.append_move(position)
+            step = self.step_size
+        self.stage.jog(axis, step * sign)
 
     def register_coordinates(self, name):
         """
@@ -258,7 +266,7 @@ class StageUI(QMainWindow):
             x-translation o working'''
 
             if name == 'working':
-                coords[0] += self.config.load_x_translation
+                coords[0] += self.load_x_translation
                 self.log(f'setting load to {coords}')
                 self.coordinates['load'] = coords
                 self.db[f'{self.hw_proxy.serial}_load'] = yaml.dump(coords)
@@ -285,7 +293,7 @@ class StageUI(QMainWindow):
             self.log(f'Error: {key} has not been registered.')
 
     def signal_stop(self):
-        self.how_proxy.stop_motion()
+        self.hw_proxy.stop_motion()
 
     def signal_home_stage(self):
         self.hw_proxy.home_stage()
@@ -302,11 +310,6 @@ class StageUI(QMainWindow):
     def signal_water_sol_2(self):
         self.hw_proxy.signal_water_sol_2()
 
-    def signal_temp_value(self):
-        self.hw_proxy.signal_temp()
-
-    def signal_encoder_movement(self):
-        self.hw_proxy.signal_encoder_movement()
 
     def signal_move_to(self):
         try:
@@ -322,6 +325,7 @@ class StageUI(QMainWindow):
         host = 'localhost'
 
         self.stage = self.hw_proxy
+        self.hw_proxy.start_hardware()
         # self.daq = self.hw_proxy.daq
         # self.load_stage_coordinates()
         self.log(f'Connected to stage: {self.hw_proxy.stage_serial}')
@@ -353,6 +357,8 @@ class StageUI(QMainWindow):
         :return:
         """
         modifiers = QApplication.keyboardModifiers()
+        if event.isAutoRepeat() and event.key() in self.jog_keys:
+            self._held_jogs.add(self.jog_keys[event.key()])
         if event.key() == QtCore.Qt.Key_A:
             self.axis_step(0, -1)
         if event.key() == QtCore.Qt.Key_Space:
@@ -385,6 +391,21 @@ class StageUI(QMainWindow):
         elif event.key() == QtCore.Qt.Key_E:
             self.axis_step(2, 1)
 
+    def keyReleaseEvent(self, event):
+        """
+        Releasing a held jog key stops its axis.  Auto-repeat releases are ignored so a held key keeps jogging, and
+        a tap released before the key repeats is left to finish its full step.
+        :param event:
+        :return:
+        """
+        if event.isAutoRepeat() or event.key() not in self.jog_keys:
+            return
+        axis = self.jog_keys[event.key()]
+        if axis in self._held_jogs:
+            self._held_jogs.discard(axis)
+            if self.stage:
+                self.stage.stop_jog(axis)
+
     def authenticate_admin(self):
         """
 
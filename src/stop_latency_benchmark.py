@@ -0,0 +1,75 @@
+"""
+Worst-case stop latency of the stage under load.
+
+A SimulatedStage runs its queue paced against the wall clock while background threads keep appending moves and jogs.
+Every stepper call blocks for --latency seconds like a USB round trip, so dispatches hold the motion lock for several
+round trips.  stop_motion is called at random moments and two latencies are recorded for each call:
+
+    disengage   call until every axis has been told to disengage (stop_motion's return value)
+    return      call until stop_motion returns, after the queue has been dropped
+
+    python stop_latency_benchmark.py --stops 200 --latency 0.001
+"""
+import argparse
+import random
+import threading
+import time
+
+import numpy as np
+
+from visual_behavior.stage import SimulatedStage
+
+
+def report(label, durations):
+    ms = np.asarray(durations) * 1e3
+    print(f'{label:<10} mean {ms.mean():8.3f} ms   median {np.median(ms):8.3f} ms   '
+          f'p99 {np.percentile(ms, 99):8.3f} ms   max {ms.max():8.3f} ms')
+
+
+def load(stage, running):
+    while running.is_set():
+        stage.append_move([random.uniform(-50, 50) for _ in range(3)])
+        stage.jog(random.randrange(3), random.uniform(-5, 5))
+        time.sleep(0.001)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stops', help='number of stop_motion calls', type=int, default=100)
+    parser.add_argument('--latency', help='seconds each stepper call blocks for', type=float, default=0.001)
+    parser.add_argument('--speed', help='simulation speed as a multiple of real time', type=float, default=10.0)
+    parser.add_argument('--load-threads', help='threads queueing moves and jogs', type=int, default=2)
+    args = parser.parse_args()
+
+    stage = SimulatedStage(latency=args.latency, speed=args.speed)
+    stage._queue_active = True
+    queue_thread = threading.Thread(target=stage.process_queue)
+    queue_thread.start()
+
+    running = threading.Event()
+    running.set()
+    threads = [threading.Thread(target=load, args=(stage, running)) for _ in range(args.load_threads)]
+    for thread in threads:
+        thread.start()
+
+    disengage = []
+    returned = []
+    try:
+        for _ in range(args.stops):
+            time.sleep(random.uniform(0.005, 0.05))
+            t0 = time.perf_counter()
+            disengage.append(stage.stop_motion())
+            returned.append(time.perf_counter() - t0)
+    finally:
+        running.clear()
+        for thread in threads:
+            thread.join()
+        stage.stop_queue()
+        queue_thread.join()
+
+    report('disengage', disengage)
+    report('return', returned)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import copy
 import datetime
+import hashlib
 import logging.config
 import os
+import pickle
 import shutil
 import sys
+import threading
+import time
 from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
 
 import yaml
 
@@ -18,9 +24,10 @@ if sys.version_info.major == 2:
         pass
 
 from .exceptions import InitializationError, InvalidCoordinatesError
-from .stage import Stage, PhidgetStage, MockStage
+from .stage import Stage, PhidgetStage, SimulatedStage
+from . import log_queue
 
-def init_log(log_config_file=None, override_local=False):
+def init_log(log_config_file=None, override_local=False, queue_size=10000):
     """
     Standard log initialization boiler plate that attempts to find a configuration file
     from the log_config_file variable, then the LOG_CONFIG_FILE environment variable. If
@@ -31,6 +38,9 @@ def init_log(log_config_file=None, override_local=False):
 
     :param log_config_file: The filename of a yaml based log configuration file.
     :param override_local: If True (default) cloud configurations that are different are downloaded and cached locally.
+    :param queue_size: default 10000.  The configured handlers run on a listener thread behind a queue of this many
+    records, so logging never waits for a slow handler; see log_queue.  If 0 or None, handlers run on the logging
+    thread.
     """
     if log_config_file is None:
         log_config_file = 'log_config_v1.yml'
@@ -43,32 +53,140 @@ def init_log(log_config_file=None, override_local=False):
 
     config['handlers']['file_handler']['filename'] = sys.argv[0] + '.log'
     config['handlers']['debug_file_handler']['filename'] = sys.argv[0] + '_debug.log'
+    # flush records queued for the handlers dictConfig is about to close
+    log_queue.stop_queue_handlers()
     logging.config.dictConfig(config)
+    if queue_size:
+        for name, logger_config in [(None, config.get('root', {}))] + list(config.get('loggers', {}).items()):
+            if logger_config.get('handlers'):
+                log_queue.queue_handlers(name, queue_size)
 
 
-def parse_config(configuration_file):
+# parsed configurations by path, each with the (mtime, size) stamp of the file it was parsed from
+_config_cache = {}
+_config_cache_lock = threading.Lock()
+CONFIG_CACHE_DIR = os.getenv('VISUAL_BEHAVIOR_CONFIG_CACHE',
+                             os.path.join(os.path.expanduser('~'), '.visual_behavior', 'config_cache'))
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _compiled_path(path):
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(CONFIG_CACHE_DIR, '{}.{}.pickle'.format(os.path.basename(path), digest[:16]))
+
+
+def _load_compiled(path, stamp):
+    try:
+        with open(_compiled_path(path), 'rb') as f:
+            compiled = pickle.load(f)
+    except Exception:
+        return None
+    if compiled.get('path') != os.path.abspath(path) or compiled.get('stamp') != stamp:
+        return None
+    return compiled
+
+
+def _save_compiled(path, stamp, config):
+    compiled_path = _compiled_path(path)
+    temporary = '{}.{}.tmp'.format(compiled_path, os.getpid())
+    try:
+        os.makedirs(CONFIG_CACHE_DIR, exist_ok=True)
+        with open(temporary, 'wb') as f:
+            pickle.dump({'path': os.path.abspath(path), 'stamp': stamp, 'config': config}, f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, compiled_path)
+    except OSError as err:
+        logging.debug('could not write configuration cache {}: {}'.format(compiled_path, err))
+
+
+def clear_config_cache():
     """
-    FileExists and YAML checking boilerplate
-    :param configuration_file:
+    Forget every parsed configuration held in memory.  The on-disk cache is revalidated on the next parse anyway.
     :return:
     """
-    try:
-        with open(configuration_file) as f:
-            return yaml.safe_load(f)
-    except FileNotFoundError as err:
-        logging.info('configuration not found: {}: {}'.format(configuration_file, err))
+    with _config_cache_lock:
+        _config_cache.clear()
+
+
+class _CachedConfig(object):
+    __slots__ = ('stamp', 'config', 'frozen')
+
+    def __init__(self, stamp, config, frozen=None):
+        self.stamp = stamp
+        self.config = config
+        self.frozen = frozen
+
+
+def _cached_config(configuration_file, stamp=None):
+    # cache entry of a configuration file, parsing it if it is new or has changed.  None if the file does not exist.
+    stamp = stamp or _file_stamp(configuration_file)
+    if stamp is None:
+        logging.info('configuration not found: {}'.format(configuration_file))
         return None
 
+    with _config_cache_lock:
+        cached = _config_cache.get(configuration_file)
+    if cached is None or cached.stamp != stamp:
+        compiled = _load_compiled(configuration_file, stamp)
+        if compiled is not None:
+            config = compiled['config']
+        else:
+            try:
+                with open(configuration_file) as f:
+                    config = yaml.safe_load(f)
+            except FileNotFoundError as err:
+                logging.info('configuration not found: {}: {}'.format(configuration_file, err))
+                return None
+            _save_compiled(configuration_file, stamp, config)
+        # sections that did not change keep their frozen objects
+        shared = _shared_nodes(cached.frozen) if cached is not None and cached.frozen is not None else {}
+        cached = _CachedConfig(stamp, config, freeze_config(config, shared) if isinstance(config, dict) else None)
+        with _config_cache_lock:
+            _config_cache[configuration_file] = cached
+    return cached
+
+
+def parse_config(configuration_file, stamp=None):
+    """
+    FileExists and YAML checking boilerplate.
+
+    Parsed files are cached in memory and compiled to CONFIG_CACHE_DIR, keyed by path and validated by modification
+    time and size.  A file that has not changed is neither read nor parsed again, in this process or the next.
+
+    :param configuration_file:
+    :param stamp: default None.  (mtime, size) of the file if the caller already has it, to save a stat.
+    :return: a fresh copy of the parsed configuration, or None if the file does not exist
+    """
+    cached = _cached_config(configuration_file, stamp)
+    # callers are free to modify what they get
+    return copy.deepcopy(cached.config) if cached is not None else None
+
+
+def _local_path(configuration_file):
+    return '{}/{}'.format(LOCAL_CONFIG_DIR or '{}/resources'.format(__path__[0]), configuration_file)
+
+
+def _remote_path(configuration_file):
+    return '{}/{}'.format(os.getenv("MPE_CONFIGURATION_PATH", "//allen/aibs/mpe/Rigs/configuration"),
+                          configuration_file)
+
 
 def cache_remote_config(configuration_file):
     """
-    Creates a back up of the local configuration and copies the remote configuration into the project path
+    Creates a back up of the local configuration and copies the remote configuration into the project path.  The copy
+    goes to a temporary file that then replaces the local configuration, so readers never see a partial file.
     :param configuration_file:
     :return:
     """
-    local_path = '{}/resources/{}'.format(__path__[0], configuration_file)
-    remote_path = '{}/{}'.format(os.getenv("MPE_CONFIGURATION_PATH", "//allen/aibs/mpe/Rigs/configuration"),
-                                 configuration_file)
+    local_path = _local_path(configuration_file)
+    remote_path = _remote_path(configuration_file)
 
     logging.info('caching remote configuration')
     if os.path.exists(local_path):
@@ -77,49 +195,254 @@ def cache_remote_config(configuration_file):
         logging.info('Copying previous configuration to {}'.format(backup_file))
         shutil.copyfile(local_path, backup_file)
 
-    shutil.copyfile(remote_path, local_path)
+    temporary = '{}.{}.tmp'.format(local_path, os.getpid())
+    shutil.copyfile(remote_path, temporary)
+    os.replace(temporary, local_path)
+
 
+# local configuration directory.  None for the package's resources directory.
+LOCAL_CONFIG_DIR = None
+# seconds source_project_configuration waits for the remote share when there is no local configuration, and the
+# deadline after which a refresh that has not finished is abandoned and the next request starts a new one
+REMOTE_CONFIG_TIMEOUT = float(os.getenv('MPE_CONFIGURATION_TIMEOUT', '5.0'))
+# seconds a refresh started by source_project_configuration is reused for, so loading a configuration repeatedly does
+# not go to the share every time
+REMOTE_CONFIG_MAX_AGE = 60.0
+# configuration file to (monotonic start time, Future) of its latest refresh
+_refreshes = {}
+_config_subscribers = []
 
-def source_project_configuration(configuration_file, override_local=True, as_dict=False):
+
+def subscribe_config(callback):
+    """
+    Called as callback(configuration_file, config) from a background thread whenever a newer remote configuration has
+    been cached locally.  config is the new shared configuration, see freeze_config.
+    :param callback:
+    :return:
+    """
+    with _config_cache_lock:
+        _config_subscribers.append(callback)
+
+
+def unsubscribe_config(callback):
+    with _config_cache_lock:
+        _config_subscribers.remove(callback)
+
+
+def _fetch_remote_config(configuration_file):
+    # runs on the refresh thread; every access to the remote share happens here
+    remote_path = _remote_path(configuration_file)
+    local_path = _local_path(configuration_file)
+    remote_stamp = _file_stamp(remote_path)
+    remote = _cached_config(remote_path, remote_stamp) if remote_stamp else None
+    if not (remote and remote.config):
+        return False
+    local_stamp = _file_stamp(local_path)
+    if local_stamp and remote_stamp[0] <= local_stamp[0]:
+        return False
+
+    cache_remote_config(configuration_file)
+    local = _cached_config(local_path)
+    with _config_cache_lock:
+        subscribers = list(_config_subscribers)
+    for callback in subscribers:
+        try:
+            callback(configuration_file, local.frozen)
+        except Exception:
+            logging.exception('configuration subscriber failed')
+    return True
+
+
+def _refresh(configuration_file, future):
+    try:
+        result = _fetch_remote_config(configuration_file)
+    except Exception as err:
+        logging.warning('could not refresh configuration {}: {}'.format(configuration_file, err))
+        _settle(future, exception=err)
+    else:
+        _settle(future, result)
+
+
+def _settle(future, result=None, exception=None):
+    # a refresh abandoned at its deadline has already failed, and a late result from its thread is dropped
+    with _config_cache_lock:
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+
+def refresh_remote_config(configuration_file, max_age=0.0):
+    """
+    Fetch the remote configuration on a background thread and cache it locally if it is newer than the local one.  A
+    hung file share only ever blocks that thread, which is a daemon so it cannot hold up exit either.
+    :param configuration_file:
+    :param max_age: default 0.0.  Seconds a finished refresh is reused for instead of starting a new one.
+    :return: concurrent.futures.Future of True if a newer configuration was cached.  A refresh of the same file in
+    progress is shared until it is REMOTE_CONFIG_TIMEOUT seconds old.  After that it fails with a TimeoutError, its
+    thread is left to the share, and a new refresh is started.
+    """
+    now = time.monotonic()
+    with _config_cache_lock:
+        started, future = _refreshes.get(configuration_file, (None, None))
+        if future is not None:
+            if not future.done() and now - started < REMOTE_CONFIG_TIMEOUT:
+                return future
+            if future.done() and now - started < max_age:
+                return future
+            if not future.done():
+                logging.warning('refresh of configuration {} did not finish in {} s.  Starting a new one.'.format(
+                    configuration_file, REMOTE_CONFIG_TIMEOUT))
+                future.set_exception(FuturesTimeoutError(
+                    'remote configuration {} did not arrive in time'.format(configuration_file)))
+        future = Future()
+        _refreshes[configuration_file] = (now, future)
+    threading.Thread(target=_refresh, args=(configuration_file, future), name='config-refresh', daemon=True).start()
+    return future
+
+
+def source_project_configuration(configuration_file, override_local=True, as_dict=False, timeout=None):
     """
     Find a project configuration file on the network, compare it to the local configuration and cache it.
+
+    The local configuration is returned right away.  If override_local, the remote configuration is fetched in the
+    background and cached locally if it is newer; see refresh_remote_config and subscribe_config.  A refresh started in
+    the last REMOTE_CONFIG_MAX_AGE seconds is reused rather than repeated.  Only without a local configuration does the
+    call wait for the remote one, and no longer than timeout.
+
     :param configuration_file:  Name of the configuration file
     :param override_local:  Default==True.  If true, overwrite the local configuration with the remote configuration /
     if the remote configuration is newer.  The old local configuration is copied to <configuration_file.yml.old>
-    :param as_dict If true (default=false), configuration will return a dictionary instead of namedtuple.  This can be
-    useful when a y aml configuration contains keywords like 'class' that would break namedtuple
-    :return: A dict corresponding to the programs configuration file
+    :param as_dict If true (default=false), configuration will return a fresh dictionary instead of namedtuple.  Keys
+    like 'class' that are not valid attribute names are also reachable on the namedtuple through get().
+    :param timeout: default None.  Seconds to wait for the remote share if there is no local configuration.  If None,
+    REMOTE_CONFIG_TIMEOUT.
+    :return: The shared, immutable configuration (see freeze_config), or a dict the caller may modify if as_dict
 
     """
-    local_path = '{}/resources/{}'.format(__path__[0], configuration_file)
-    remote_path = '{}/{}'.format(os.getenv("MPE_CONFIGURATION_PATH", "//allen/aibs/mpe/Rigs/configuration"),
-                                 configuration_file)
-
-    local_config = parse_config(local_path)
-    remote_config = parse_config(remote_path)
+    local_path = _local_path(configuration_file)
+    local = _cached_config(local_path)
+    if local and local.config:
+        logging.info('using local configuration: {}'.format(local_path))
+        if override_local:
+            refresh_remote_config(configuration_file, max_age=REMOTE_CONFIG_MAX_AGE)
+        return _configuration(local, as_dict)
 
-    if not local_config and not remote_config:
+    logging.info('using remote configuration: {}'.format(_remote_path(configuration_file)))
+    try:
+        refresh_remote_config(configuration_file).result(REMOTE_CONFIG_TIMEOUT if timeout is None else timeout)
+    except FuturesTimeoutError:
+        logging.warning('remote configuration {} did not arrive in time'.format(configuration_file))
+    except Exception:
+        pass
+    local = _cached_config(local_path)
+    if not (local and local.config):
         raise FileNotFoundError('no valid configurations found.')
+    return _configuration(local, as_dict)
 
-    if not remote_config or not override_local:
-        logging.info('using local configuration: {}'.format(local_path))
-        return dict_to_namedtuple(local_config) if not as_dict else local_config
 
-    logging.info('using remote configuration: {}'.format(remote_path))
-    if not local_config:
-        cache_remote_config(configuration_file)
-        return dict_to_namedtuple(remote_config) if not as_dict else remote_config
+def _configuration(cached, as_dict):
+    # the shared frozen configuration, or a fresh dict the caller may modify
+    return copy.deepcopy(cached.config) if as_dict else cached.frozen
 
-    local_modify_time = os.path.getmtime(local_path)
-    remote_modify_time = os.path.getmtime(remote_path)
-    if remote_modify_time > local_modify_time:
-        cache_remote_config(configuration_file)
 
-    return dict_to_namedtuple(remote_config) if not as_dict else remote_config
+# configuration types by key tuple, so loading a configuration never creates a type it has seen before
+_config_types = {}
+_CONFIG_METHODS = ('get', 'as_dict')
 
 
-def dict_to_namedtuple(dictionary):
-    for key, value in dictionary.items():
+def _config_type(keys):
+    config_type = _config_types.get(keys)
+    if config_type is None:
+        clashes = [key for key in keys if key in _CONFIG_METHODS]
+        if clashes:
+            logging.warning('configuration keys {} shadow configuration methods and are only reachable through '
+                            'get()'.format(clashes))
+        # keys that are not identifiers, or that clash with get and as_dict, get positional field names like _0, but
+        # stay reachable through get()
+        base = namedtuple('dotDict', ['_' if key in _CONFIG_METHODS else str(key) for key in keys], rename=True)
+        config_type = type('dotDict', (base,), {'__slots__': (), '_keys': keys,
+                                                '_index': {key: i for i, key in enumerate(keys)},
+                                                'get': _config_get, 'as_dict': _config_as_dict})
+        config_type = _config_types.setdefault(keys, config_type)
+    return config_type
+
+
+def _config_get(self, key, default=None):
+    """
+    Value of a key, including keys that are not valid attribute names.
+    :param key:
+    :param default:
+    :return:
+    """
+    index = self._index.get(key)
+    return default if index is None else self[index]
+
+
+def _config_as_dict(self):
+    """
+    A fresh nested dict with the original keys.
+    :return:
+    """
+    return {key: _thaw(value) for key, value in zip(self._keys, self)}
+
+
+def _thaw(value):
+    if hasattr(value, 'as_dict'):
+        return value.as_dict()
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+def _node_key(node):
+    # namedtuples of different types compare equal as plain tuples, as do 1, 1.0 and True
+    return type(node), node, tuple(type(value) for value in node)
+
+
+def _shared_nodes(frozen):
+    nodes = {}
+    pending = [frozen]
+    while pending:
+        node = pending.pop()
+        nodes[_node_key(node)] = node
+        pending.extend(value for value in node if isinstance(value, tuple) and hasattr(value, '_keys'))
+    return nodes
+
+
+def freeze_config(dictionary, shared=None):
+    """
+    Immutable attribute-access view of a configuration dict.  Nested dicts become namedtuples, one type per key set
+    shared by every configuration, and lists become tuples.  The dict is not modified.
+    :param dictionary:
+    :param shared: default None.  dict of frozen sections by _node_key to reuse when an equal section comes up, so a
+    reloaded configuration shares its unchanged sections with the previous one.
+    :return: namedtuple with get(key, default) and as_dict() methods.  Keys named get or as_dict do not become
+    attributes; they are only reachable through get().
+    """
+    shared = {} if shared is None else shared
+
+    def freeze(value):
         if isinstance(value, dict):
-            dictionary[key] = dict_to_namedtuple(value)
-    return namedtuple('dotDict', dictionary.keys())(**dictionary)
+            node = _config_type(tuple(value))(*(freeze(item) for item in value.values()))
+            try:
+                return shared.setdefault(_node_key(node), node)
+            except TypeError:
+                # an unhashable value such as a set
+                return node
+        if isinstance(value, list):
+            return tuple(freeze(item) for item in value)
+        return value
+
+    return freeze(dictionary)
+
+
+def dict_to_namedtuple(dictionary):
+    """
+    See freeze_config.  The dictionary is no longer modified.
+    :param dictionary:
+    :return:
+    """
+    return freeze_config(dictionary)
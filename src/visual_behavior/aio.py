@@ -0,0 +1,143 @@
+"""
+asyncio front end for the stage and the NIDAQ tasks.
+
+The hardware libraries are callback based.  These wrappers turn their callbacks into awaitables and async iterators
+through loop.call_soon_threadsafe, so coroutines wait on events instead of polling or sleeping.
+"""
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class AsyncStage(object):
+    def __init__(self, stage):
+        """
+        Awaitable moves for a PhidgetStage.  Attributes not defined here are passed through to the stage.
+        :param stage: PhidgetStage or SimulatedStage
+        """
+        self._stage = stage
+
+    def __getattr__(self, name):
+        return getattr(self._stage, name)
+
+    async def move_to(self, coordinates, epoch=None):
+        """
+        Move immediately and wait for every axis to arrive.
+        :param coordinates:
+        :param epoch: default None.  See PhidgetStage.move_to.
+        :return: stage.StageState on arrival.  Raises asyncio.CancelledError if the move is stopped or superseded.
+        """
+        arrival = Future()
+        self._stage.move_to(coordinates, arrival=arrival, epoch=epoch)
+        return await asyncio.wrap_future(arrival)
+
+    async def append_move(self, coordinates):
+        """
+        Queue a move and wait for it to arrive.
+        :param coordinates:
+        :return: stage.StageState on arrival.  Raises asyncio.CancelledError if the queue is stopped first.
+        """
+        return await asyncio.wrap_future(self._stage.append_move(coordinates))
+
+    async def wait_settled(self):
+        """
+        Wait until no axis is moving and the queue is empty.
+        :return: stage.StageState
+        """
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+
+        def listener():
+            loop.call_soon_threadsafe(wake.set)
+
+        self._stage.add_motion_listener(listener)
+        try:
+            while any(self._stage.is_moving) or not self._stage._queue.empty():
+                await wake.wait()
+                wake.clear()
+        finally:
+            self._stage.remove_motion_listener(listener)
+        return self._stage.state()
+
+
+class AsyncDAQ(object):
+    def __init__(self, daq, executor=None):
+        """
+        Awaitable reads and writes and async event streams for the tasks of a NIDAQio.
+
+        Driver calls block, so reads and writes run on an executor.  The default executor has a single worker, which
+        keeps calls to the device in submission order and never runs two at once.
+
+        :param daq: NIDAQio
+        :param executor: default None.  concurrent.futures.Executor for driver calls.
+        """
+        self._daq = daq
+        self._executor = executor if executor is not None else ThreadPoolExecutor(1, thread_name_prefix='nidaq')
+
+    def __getattr__(self, name):
+        return getattr(self._daq, name)
+
+    async def call(self, function, *args):
+        """
+        Run any blocking driver call on the executor.
+        :param function:
+        :param args:
+        :return: the function's return value
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def read(self, name):
+        return await self.call(getattr(self._daq, name).read)
+
+    async def write(self, name, data):
+        return await self.call(getattr(self._daq, name).write, data)
+
+    async def read_lines(self, name):
+        return await self.call(getattr(self._daq, name).read_lines)
+
+    async def changes(self, name):
+        """
+        Async iterator over the (value, timestamp) edges of a digital input task created with
+        sample_mode='change_detection'.  Edges are queued from the moment iteration starts until the iterator is closed.
+        :param name: task name
+        :return:
+        """
+        task = getattr(self._daq, name)
+        loop = asyncio.get_running_loop()
+        edges = asyncio.Queue()
+
+        def callback(value, timestamp):
+            loop.call_soon_threadsafe(edges.put_nowait, (value, timestamp))
+
+        task.add_change_callback(callback)
+        try:
+            while True:
+                yield await edges.get()
+        finally:
+            task.remove_change_callback(callback)
+
+    async def blocks(self, name, maxsize=100):
+        """
+        Async iterator over the sample blocks of a streaming task.  Each block is a copy.  If the consumer falls more
+        than maxsize blocks behind, the oldest blocks are dropped.
+        :param name: task name
+        :param maxsize: number of blocks buffered
+        :return:
+        """
+        task = getattr(self._daq, name)
+        loop = asyncio.get_running_loop()
+        blocks = asyncio.Queue(maxsize)
+
+        def put(block):
+            if blocks.full():
+                blocks.get_nowait()
+            blocks.put_nowait(block)
+
+        def callback(block):
+            loop.call_soon_threadsafe(put, block.copy())
+
+        task.add_block_callback(callback)
+        try:
+            while True:
+                yield await blocks.get()
+        finally:
+            task.remove_block_callback(callback)
@@ -0,0 +1,232 @@
+"""
+Hot reload of a project configuration.
+
+ConfigWatcher watches the local copy of a configuration file, through watchdog (inotify on Linux) when it is installed
+and by polling its modification time otherwise, and refreshes the local copy from the remote share in the background.
+When the file changes it is diffed against the configuration in use.  Subsystems register the sections they can apply
+live; every changed section has to be claimed by one, and every claiming validator has to accept the change, or the
+whole reload is rejected and the running configuration stays as it is.  If applying a section fails, the sections
+applied so far are rolled back and the reload is rejected the same way.
+
+Unchanged sections of a reloaded configuration are the same objects as before (see freeze_config), so the diff skips
+them without looking inside and a reload costs in proportion to what changed.
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import visual_behavior
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# path is the tuple of keys leading to the changed value
+ConfigChange = namedtuple('ConfigChange', ['path', 'old', 'new'])
+
+
+def _is_section(value):
+    return isinstance(value, tuple) and hasattr(value, '_keys')
+
+
+def lookup(config, path):
+    """
+    Value at a path of keys, or None if any key is missing.
+    :param config: frozen configuration
+    :param path: tuple of keys
+    :return:
+    """
+    for key in path:
+        if not _is_section(config):
+            return None
+        config = config.get(key)
+    return config
+
+
+def diff_config(old, new, path=()):
+    """
+    Every value that differs between two frozen configurations.  Sections that are the same object are skipped.
+    :param old:
+    :param new:
+    :param path: default ().  Path of old and new in the whole configuration.
+    :return: list of ConfigChange, one per changed value.  A section whose keys changed is one change.
+    """
+    if old is new:
+        return []
+    if _is_section(old) and _is_section(new) and type(old) is type(new):
+        changes = []
+        for key, old_value, new_value in zip(old._keys, old, new):
+            changes.extend(diff_config(old_value, new_value, path + (key,)))
+        return changes
+    if type(old) is type(new) and old == new:
+        return []
+    return [ConfigChange(path, old, new)]
+
+
+class _FileChanged(FileSystemEventHandler):
+    def __init__(self, path, changed):
+        self._path = os.path.abspath(path)
+        self._changed = changed
+
+    def on_any_event(self, event):
+        paths = (getattr(event, 'src_path', None), getattr(event, 'dest_path', None))
+        if any(path and os.path.abspath(path) == self._path for path in paths):
+            self._changed.set()
+
+
+class ConfigWatcher(object):
+    def __init__(self, configuration_file, config=None, poll_interval=1.0, remote_interval=60.0, settle=0.1):
+        """
+        :param configuration_file: name of the configuration file, as for source_project_configuration
+        :param config: default None.  Configuration in use.  If None, the local configuration.
+        :param poll_interval: seconds between modification time checks.  With watchdog it only bounds how late a
+        missed event is noticed.
+        :param remote_interval: seconds between background refreshes from the remote share.  None never refreshes.
+        :param settle: seconds to wait after a file event before reading, so a file being written is read once
+        """
+        self.configuration_file = configuration_file
+        self.path = visual_behavior._local_path(configuration_file)
+        self.config = config if config is not None else self._load()
+        self.poll_interval = poll_interval
+        self.remote_interval = remote_interval
+        self.settle = settle
+        self.rejected = None
+        self._stamp = visual_behavior._file_stamp(self.path)
+        self._handlers = []
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._running = False
+        self._thread = None
+        self._observer = None
+
+    def _load(self):
+        return visual_behavior.source_project_configuration(self.configuration_file, override_local=False)
+
+    def register(self, section, apply, validate=None):
+        """
+        Claim a section of the configuration.
+        :param section: dotted path such as 'phidget.step_size', or a tuple of keys
+        :param apply: called as apply(old, new) with the old and new value of the section when it changed
+        :param validate: default None.  Called as validate(old, new) before anything is applied.  Returns None to
+        accept the change or a reason to reject the whole reload.
+        :return:
+        """
+        path = tuple(section.split('.')) if isinstance(section, str) else tuple(section)
+        with self._lock:
+            self._handlers.append((path, apply, validate))
+
+    def unregister(self, apply):
+        with self._lock:
+            self._handlers = [handler for handler in self._handlers if handler[1] is not apply]
+
+    def reload(self):
+        """
+        Read the file if it changed and apply the changes.  Called by the watcher thread; call it directly to reload
+        right away.
+        :return: list of the applied ConfigChange, empty if nothing changed or the reload was rejected
+        """
+        with self._lock:
+            stamp = visual_behavior._file_stamp(self.path)
+            if stamp is None or stamp == self._stamp:
+                return []
+            self._stamp = stamp
+            try:
+                new = self._load()
+            except Exception as err:
+                logging.warning(f'Could not reload {self.path}: {err}')
+                return []
+            old = self.config
+            changes = diff_config(old, new)
+            if not changes:
+                return []
+
+            handlers = [(path, apply, validate) for path, apply, validate in self._handlers
+                        if any(change.path[:len(path)] == path for change in changes)]
+            reasons = [f'{".".join(map(str, change.path))} cannot be changed while running'
+                       for change in changes
+                       if not any(change.path[:len(path)] == path for path, _, _ in handlers)]
+            for path, apply, validate in handlers:
+                if validate is None:
+                    continue
+                try:
+                    reason = validate(lookup(old, path), lookup(new, path))
+                except Exception as err:
+                    reason = f'{".".join(path)}: {err}'
+                if reason:
+                    reasons.append(reason)
+            if reasons:
+                self.rejected = (changes, reasons)
+                logging.warning(f'Rejected configuration change to {self.path}: {"; ".join(reasons)}.  '
+                                f'Restart to apply it.')
+                return []
+
+            for index, (path, apply, validate) in enumerate(handlers):
+                try:
+                    apply(lookup(old, path), lookup(new, path))
+                except Exception as err:
+                    logging.exception(f'Applying configuration section {".".join(path)} failed.  Rolling back.')
+                    self._roll_back(handlers[:index + 1], old, new)
+                    self.rejected = (changes, [f'{".".join(path)}: {err}'])
+                    return []
+            self.config = new
+            self.rejected = None
+            logging.info(f'Applied configuration change to '
+                         f'{", ".join(".".join(map(str, change.path)) for change in changes)}')
+            return changes
+
+    @staticmethod
+    def _roll_back(handlers, old, new):
+        # re-apply the old sections, last applied first, including the one that failed part way
+        for path, apply, _ in reversed(handlers):
+            try:
+                apply(lookup(new, path), lookup(old, path))
+            except Exception:
+                logging.exception(f'Rolling back configuration section {".".join(path)} failed.')
+
+    def _watch(self):
+        last_refresh = time.monotonic()
+        while self._running:
+            if self._changed.wait(self.poll_interval):
+                self._changed.clear()
+                self._changed.wait(self.settle)
+                self._changed.clear()
+            if not self._running:
+                break
+            self.reload()
+            if self.remote_interval is not None and time.monotonic() - last_refresh >= self.remote_interval:
+                last_refresh = time.monotonic()
+                # lands in the local file, which is picked up like any other change
+                visual_behavior.refresh_remote_config(self.configuration_file)
+
+    def start(self):
+        """
+        Watch the file on a background thread.  Registered apply functions run on that thread.
+        :return:
+        """
+        if self._running:
+            return
+        self._running = True
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_FileChanged(self.path, self._changed), os.path.dirname(os.path.abspath(self.path)))
+            self._observer.start()
+        else:
+            logging.info(f'watchdog is not installed.  Polling {self.path} every {self.poll_interval} s.')
+        self._thread = threading.Thread(target=self._watch, name='config-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._changed.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,103 @@
+from collections import namedtuple
+
+import numpy as np
+
+from .ring_buffer import RingBuffer
+
+EncoderState = namedtuple('EncoderState', ['position', 'velocity', 'acceleration'])
+
+
+class MovingAverage(object):
+    def __init__(self, width):
+        """
+        Streaming boxcar filter.  Blocks are filtered with one cumulative sum; the last width - 1 inputs are carried to
+        the next block so the output is continuous across block boundaries.
+        :param width: number of samples averaged
+        """
+        if width < 1:
+            raise ValueError(f'Invalid width: {width}.  Width must be at least 1.')
+        self.width = int(width)
+        self._history = None
+
+    def __call__(self, block):
+        if self._history is None:
+            self._history = np.full(self.width - 1, block[0], dtype=np.float64)
+        padded = np.concatenate((self._history, block))
+        totals = np.cumsum(padded)
+        totals[self.width:] = totals[self.width:] - totals[:-self.width]
+        self._history = padded[len(padded) - self.width + 1:]
+        return totals[self.width - 1:] / self.width
+
+
+class EncoderDecoder(object):
+    def __init__(self, sample_rate, smoothing=0.01, decimation=100, history=6000):
+        """
+        Turns blocks of raw analog encoder voltages into position, velocity and acceleration.
+
+        The signal voltage is a fraction of the reference voltage per revolution.  Each block is converted to an angle
+        and unwrapped across revolutions in one vectorized pass.  Velocity and acceleration are smoothed finite
+        differences.  Every decimation-th sample is published to state and history for the UI.
+
+        :param sample_rate: rate of the analog input in Hz
+        :param smoothing: length in seconds of the moving average applied before each derivative
+        :param decimation: number of input samples per published sample
+        :param history: number of published samples kept
+        """
+        self.sample_rate = float(sample_rate)
+        self.decimation = int(decimation)
+        width = max(1, int(round(smoothing * self.sample_rate)))
+        self._velocity_filter = MovingAverage(width)
+        self._acceleration_filter = MovingAverage(width)
+        self._last_angle = None
+        self._last_position = None
+        self._last_velocity = None
+        self._phase = 0
+        self.state = EncoderState(0.0, 0.0, 0.0)
+        self.history = RingBuffer(history, dtype=np.float64, channels=3)
+
+    def _derivative(self, block, last):
+        if last is None:
+            last = block[0]
+        return np.diff(block, prepend=last) * self.sample_rate
+
+    def decode(self, reference, signal):
+        """
+        Decode one block of samples.
+        :param reference: encoder reference voltages
+        :param signal: encoder signal voltages
+        :return: position (degrees), velocity (degrees / s) and acceleration (degrees / s^2) arrays for the block
+        """
+        reference = np.asarray(reference, dtype=np.float64)
+        signal = np.asarray(signal, dtype=np.float64)
+        if not len(signal):
+            empty = np.empty(0)
+            return empty, empty, empty
+
+        turns = signal / np.where(np.abs(reference) > 1e-6, reference, 1e-6)
+        angle = 2 * np.pi * turns
+        if self._last_angle is not None:
+            angle = np.unwrap(np.concatenate(([self._last_angle], angle)))[1:]
+        else:
+            angle = np.unwrap(angle)
+        self._last_angle = angle[-1]
+
+        position = np.degrees(angle)
+        smoothed = self._velocity_filter(position)
+        velocity = self._derivative(smoothed, self._last_position)
+        self._last_position = smoothed[-1]
+        smoothed = self._acceleration_filter(velocity)
+        acceleration = self._derivative(smoothed, self._last_velocity)
+        self._last_velocity = smoothed[-1]
+
+        self._publish(position, velocity, acceleration)
+        return position, velocity, acceleration
+
+    def _publish(self, position, velocity, acceleration):
+        # keep the decimation phase across blocks so publishing is evenly spaced regardless of block size
+        indices = np.arange((-self._phase) % self.decimation, len(position), self.decimation)
+        self._phase = (self._phase + len(position)) % self.decimation
+        if not len(indices):
+            return
+        self.history.extend(np.column_stack((position[indices], velocity[indices], acceleration[indices])))
+        last = indices[-1]
+        self.state = EncoderState(float(position[last]), float(velocity[last]), float(acceleration[last]))
@@ -1,6 +1,13 @@
 class InitializationError(Exception):
-    def __init__(self):
+    def __init__(self, details=None):
+        """
+        :param details: default None.  dict of axis label to the reason that axis failed
+        """
+        self.details = details or {}
         self.message = 'Error occurred during initialization. Stage not connected.'
+        if self.details:
+            self.message += ' ' + '; '.join(f'{axis}: {reason}' for axis, reason in sorted(self.details.items()))
+        super().__init__(self.message)
 
 
 class ValueOutOfRange(Exception):
@@ -19,3 +26,6 @@ class StageNotConnectedError(Exception):
 class DatabaseNotFoundError(Exception):
     pass
 
+
+class HomingError(Exception):
+    pass
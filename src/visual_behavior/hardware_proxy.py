@@ -1,50 +1,205 @@
-from visual_behavior import stage, nidaqio, source_project_configuration
+from visual_behavior import stage, nidaqio, encoder, aio, scheduler, homing, config_watcher
 import logging
 import asyncio
 import numpy as np
 import threading
 import time
+from collections import deque, namedtuple
+from concurrent.futures import Future
+from functools import partial
+
+# one flat snapshot of everything a client displays.  encoder is (position, velocity, acceleration).  temperature is
+# None until the first analog input block arrives, or while analog input is not streaming.
+StageStatus = namedtuple('StageStatus', ['version', 'timestamp', 'position', 'velocity', 'is_moving', 'is_engaged',
+                                         'limits', 'ignore_limits', 'temperature', 'encoder'])
+
+# one limit switch recovery, timed on the stage's clock.  distance is how far the axis travelled from the trip to the
+# release, None if unknown.
+LimitRecovery = namedtuple('LimitRecovery', ['axis', 'timestamp', 'duration', 'distance', 'attempts', 'released'])
+
 
 class RemoteStageController(object):
-    def __init__(self):
-        self.config = source_project_configuration('visual_behavior_v1.yml', override_local=False)
-        self._stage = self.setup_stage()
+    # columns of the analog_in task
+    AI_TEMP = 0
+    AI_ENCODER_REF = 1
+    AI_ENCODER_SIGNAL = 2
+
+    # control loop periods in seconds.  Limit edges and stage events wake their tasks early, so the limit and
+    # dispatch periods only bound the reaction time if an event is lost.
+    LIMIT_PERIOD = 0.01
+    DISPATCH_PERIOD = 0.01
+    RESYNC_PERIOD = 1.0
+    TELEMETRY_PERIOD = 0.1
+
+    # analog readings are rounded to the precision clients display, so sensor noise alone does not count as a change
+    TEMPERATURE_DECIMALS = 2
+    ENCODER_DECIMALS = 1
+
+    # limit back-off: distance searched for the release point when it is not known yet, and attempts before giving up
+    LIMIT_SEARCH_DISTANCE = 50.0
+    LIMIT_ATTEMPTS = 3
+
+    # nidaq settings each DAQ task is created from, see _create_daq_task.  Changing the analog_in timing or ring file
+    # resizes the encoder decoder and the ring buffer, so those only take effect on restart.
+    DAQ_TASKS = {'air_sol_1': ('air_solenoid_1',),
+                 'air_sol_2': ('air_solenoid_2',),
+                 'water_sol_1': ('water_solenoid_1',),
+                 'water_sol_2': ('water_solenoid_2',),
+                 'limits': ('limit_switch_x', 'limit_switch_y', 'limit_switch_z'),
+                 'clamp': ('clamp_0', 'clamp_1'),
+                 'analog_in': ('temp', 'encoder_ref', 'encoder_signal')}
+    DAQ_RESTART_KEYS = ('analog_in_sample_rate', 'analog_in_buffer_seconds', 'analog_in_ring_file')
+    # tasks in use while the stage moves, homes or backs off a limit: the limit switches, the brake, whose release
+    # pattern would stay on the old lines, and analog input, whose ring file is truncated when the task is recreated
+    DAQ_MOTION_TASKS = ('limits', 'clamp', 'analog_in')
+
+    def __init__(self, stage=None):
+        """
+        :param stage: default None.  Stage to control, e.g. a SimulatedStage to run against the simulated NIDAQ backend.
+        If None, the PhidgetStage described by the configuration is connected.
+        """
+        # changes to the configuration file are applied while running where they can be, see watch_config()
+        self.config_watcher = config_watcher.ConfigWatcher('visual_behavior_v1.yml')
+        self._stage = stage if stage is not None else self.setup_stage()
         self._daq = self.setup_daq()
 
-        self.async_loop = asyncio.get_event_loop()
+        # asyncio front ends, see run()
+        self.aio_stage = aio.AsyncStage(self._stage)
+        self.aio_daq = aio.AsyncDAQ(self._daq)
+        self._loop = None
+
+        # every periodic task and one-shot job runs on this one worker, see start_hardware().  It runs on the stage's
+        # clock, so a simulated stage and its control loop share virtual time.
+        self.scheduler = scheduler.Scheduler(clock=self._stage.clock)
+        self._status = None
+        self._status_checked = 0.0
+        self._status_lock = threading.Lock()
 
         # related to monitoring the  daq signals for limit switches
         self._monitor_limits = False
         self._limit_tripped = [ False ] * 3
-        self._limits = {0: self._daq.x_limit,
-                        1: self._daq.y_limit,
-                        2: self._daq.z_limit}
         self._limit_direction = self._limit_direction = [-1, -1, 1]
-        self._homing_mode = False
-        self._current_homing_axis = 0
 
         """
         This corresponds to the signaling the air solenoids that release the motor brake after the limit switch has been
         hit.  The number of samples is somewhat arbitrary - it isn't clear how many have to be sent to make the nidaq /
         arduino interface sensitive to the change.
-        
-        It's also possible there is a kind of race condition since the signals aren't simultaneous.  It looks like a 
-        very minimal risk thus far.
+
+        Both lines belong to one two channel task and each pattern is a packed (samples, 2) buffer, so ao0 and ao1
+        change in the same write and the brake never sees an intermediate state.
                  ao0 ao1
         default:  0   0
          x-axis (0):  0   1
          y-axis (1):  1   0
          z-axis (2):  1   1
         """
-        self.clamp_table = {2: [np.zeros(1000), np.ones(1000) * 5],
-                            1: [np.ones(1000) * 5, np.zeros(1000)],
-                            0: [np.ones(1000) * 5, np.ones(1000) * 5],
-                            'reset': [np.zeros(1000), np.zeros(1000)]}
+        self.clamp_table = {2: nidaqio.NIDAQAnalogTask.pack_channels((0, 5), 1000),
+                            1: nidaqio.NIDAQAnalogTask.pack_channels((5, 0), 1000),
+                            0: nidaqio.NIDAQAnalogTask.pack_channels((5, 5), 1000),
+                            'reset': nidaqio.NIDAQAnalogTask.pack_channels((0, 0), 1000)}
 
-        self.limit_lock = threading.Lock()
         self._ignore_limits = False
 
+        # set by the limits task on every edge; starts set so the first pass checks the current state
+        self._limit_event = threading.Event()
+        self._limit_event.set()
+        self._last_limit_check = 0.0
+        # axes waiting to be backed off their switch, handled one at a time by the _recover_limits job
+        self._recovery = deque()
+        self._recovering = False
+        self._switches = [False] * 3
+        # back-off: where each axis last tripped and how far it then had to travel until its switch released
+        self._trip_positions = [None] * 3
+        self._release_distance = [None] * 3
+        self._releases = [None] * 3
+        self.limit_margin = getattr(self.config.phidget, 'limit_back_off_margin', 1.0)
+        self.limit_recoveries = deque(maxlen=1000)
+        self._daq.limits.add_change_callback(self._limits_changed)
+
+        self.homing = homing.Homing(self._stage, self.scheduler, self._read_switches,
+                                    directions=self._limit_direction, brake=self._release_brake,
+                                    clock=self._stage.clock)
+
+        self._encoder = encoder.EncoderDecoder(self.config.nidaq.analog_in_sample_rate)
+        self._daq.analog_in.add_block_callback(self._decode_encoder)
+
+        # the watcher runs on its own thread; changes are applied on the scheduler's worker like every other change to
+        # controller state, so a remap never replaces a task under a running limit check or back-off
+        for section, apply, validate in (('phidget.default_velocity_mm_per_s', self._set_velocity_limit,
+                                          self._validate_positive),
+                                         ('phidget.default_acceleration_mm_per_s2', self._set_acceleration_limit,
+                                          self._validate_positive),
+                                         ('phidget.limit_back_off_margin', self._set_limit_margin,
+                                          self._validate_positive),
+                                         ('nidaq', self._remap_daq, self._validate_daq_remap)):
+            self.config_watcher.register(section, partial(self.scheduler.call, apply), validate)
 
+    @property
+    def config(self):
+        return self.config_watcher.config
+
+    def watch_config(self, value=True):
+        """
+        Start or stop applying changes to the configuration file while running.  Velocity and acceleration limits, the
+        limit back-off margin and the NIDAQ line mapping are applied live; any other change is rejected until restart.
+        :param value: default True
+        :return:
+        """
+        if value:
+            self.config_watcher.start()
+        else:
+            self.config_watcher.stop()
+
+    @staticmethod
+    def _validate_positive(old, new):
+        if isinstance(new, bool) or not isinstance(new, (int, float)) or new <= 0:
+            return f'{new!r} is not a positive number'
+
+    def _set_velocity_limit(self, old, new):
+        # axes pick the limits up the next time they are engaged
+        self._stage.velocity_limit = new
+
+    def _set_acceleration_limit(self, old, new):
+        self._stage.acceleration_limit = new
+
+    def _set_limit_margin(self, old, new):
+        self.limit_margin = new
+
+    def _changed_daq_tasks(self, old, new):
+        keys = {change.path[0] for change in config_watcher.diff_config(old, new)}
+        return keys, [name for name, task_keys in self.DAQ_TASKS.items() if keys.intersection(task_keys)]
+
+    def _validate_daq_remap(self, old, new):
+        keys, tasks = self._changed_daq_tasks(old, new)
+        restart = keys.intersection(self.DAQ_RESTART_KEYS)
+        if restart:
+            return f'nidaq.{", nidaq.".join(sorted(restart))} only take effect on restart'
+        fixed = keys - {key for task_keys in self.DAQ_TASKS.values() for key in task_keys}
+        if fixed:
+            return f'nidaq.{", nidaq.".join(sorted(fixed))} cannot be changed while running'
+        return self._remap_refused(tasks)
+
+    def _remap_refused(self, tasks):
+        busy = [name for name in tasks if name in self.DAQ_MOTION_TASKS]
+        if busy and (any(self._stage.is_moving) or self.homing.active or self._recovering):
+            return f'{", ".join(busy)} lines cannot be remapped while the stage is moving'
+
+    def _remap_daq(self, old, new):
+        keys, tasks = self._changed_daq_tasks(old, new)
+        # the stage may have started moving since the change was validated
+        refused = self._remap_refused(tasks)
+        if refused:
+            raise RuntimeError(refused)
+        for name in tasks:
+            logging.info(f'remapping NIDAQ task {name}')
+            self._create_daq_task(self._daq, name, new, overwrite=True)
+            if name == 'limits':
+                self._daq.limits.add_change_callback(self._limits_changed)
+                # the new lines may already be tripped
+                self._limit_event.set()
+                self.scheduler.wake('limits')
+            elif name == 'analog_in':
+                self._daq.analog_in.add_block_callback(self._decode_encoder)
 
     def ignore_limits(self, value):
         if value:
@@ -53,6 +208,11 @@ class RemoteStageController(object):
         else:
             self._ignore_limits = False
             logging.info('Respecting limit switch values.')
+            # re-check switches that tripped while they were ignored
+            self._limit_event.set()
+            self.scheduler.wake('limits')
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(lambda: self._loop.create_task(self._handle_limits_async()))
 
     @property
     def phidget_stage(self):
@@ -77,6 +237,12 @@ class RemoteStageController(object):
     def append_move(self, coordinates):
         self._stage.append_move(coordinates)
 
+    def jog(self, axis, delta):
+        self._stage.jog(axis, delta)
+
+    def stop_jog(self, axis):
+        self._stage.stop_jog(axis)
+
 
     @property
     def limits(self):
@@ -88,11 +254,24 @@ class RemoteStageController(object):
 
     def clamp_signal(self, axis):
         logging.info(f'Sending clamp signal for axis {axis}')
-        self._daq.clamp_0.write(self.clamp_table[axis][0])
-        self._daq.clamp_1.write(self.clamp_table[axis][1])
+        self._daq.clamp.write(self.clamp_table[axis])
 
     def stop_motion(self):
-        self._stage.stop_motion()
+        """
+        Priority lane.  Disengages every axis from the calling thread without waiting for the motion queue or the
+        control loop, drops queued moves and aborts homing and limit back-off.
+        :return: seconds from the call until every axis was disengaged
+        """
+        return self._stage.stop_motion()
+
+    def emergency_stop(self):
+        """
+        stop_motion, then retract the lickspout.
+        :return: seconds from the call until every axis was disengaged
+        """
+        latency = self.stop_motion()
+        self.retract_lickspout()
+        return latency
 
     def extend_lickspout(self):
         logging.info('extending lickspout')
@@ -115,130 +294,404 @@ class RemoteStageController(object):
     def setup_stage(self):
         stage_ = stage.PhidgetStage(x_channel=self.config.phidget.channels.x,
                                     y_channel=self.config.phidget.channels.y,
-                                    z_channel=self.config.phidget.channels.z)
-        stage_.initialize_axis(self.config.phidget.channels.x)
-        stage_.initialize_axis(self.config.phidget.channels.y)
-        stage_.initialize_axis(self.config.phidget.channels.z)
-        stage_.serial = stage_._axes[0].getDeviceSerialNumber()
+                                    z_channel=self.config.phidget.channels.z,
+                                    velocity_limit=self.config.phidget.default_velocity_mm_per_s,
+                                    acceleration=self.config.phidget.default_acceleration_mm_per_s2,
+                                    data_interval=getattr(self.config.phidget, 'data_interval_ms', 8) / 1000.0)
+        stage_.initialize_axes()
         logging.info(f'connected to stage {stage_.serial}')
         return stage_
 
     def setup_daq(self):
         daq = nidaqio.NIDAQio()
-        daq.create_digital_out_task('air_sol_1', self.config.nidaq.air_solenoid_1)
-        daq.create_digital_out_task('air_sol_2', self.config.nidaq.air_solenoid_2)
-        daq.create_digital_out_task('water_sol_1', self.config.nidaq.water_solenoid_1)
-        daq.create_digital_out_task('water_sol_2', self.config.nidaq.water_solenoid_2)
-        daq.create_digital_in_task('x_limit', self.config.nidaq.limit_switch_x)
-        daq.create_digital_in_task('y_limit', self.config.nidaq.limit_switch_y)
-        daq.create_digital_in_task('z_limit', self.config.nidaq.limit_switch_z)
-        daq.create_analog_out_voltage_task('clamp_0', self.config.nidaq.clamp_0)
-        daq.create_analog_out_voltage_task('clamp_1', self.config.nidaq.clamp_1)
-        daq.create_analog_in_voltage_task('temp', self.config.nidaq.temp)
-        daq.create_analog_in_voltage_task('encoder_ref', self.config.nidaq.encoder_ref)
-        daq.create_analog_in_voltage_task('encoder_signal', self.config.nidaq.encoder_signal)
+        for name in self.DAQ_TASKS:
+            self._create_daq_task(daq, name, self.config.nidaq)
 
         logging.info(f'connected to nidaq device {daq.device_name}')
         return daq
 
-    def start_hardware(self, executor=None):
+    @staticmethod
+    def _create_daq_task(daq, name, nidaq, overwrite=False):
         """
-        Async stuff
+        Create one of DAQ_TASKS.
+        :param daq: NIDAQio
+        :param name: task name
+        :param nidaq: nidaq section of the configuration
+        :param overwrite: default False.  If True, replace the task if it exists.
         :return:
         """
+        if name in ('air_sol_1', 'air_sol_2', 'water_sol_1', 'water_sol_2'):
+            line, = RemoteStageController.DAQ_TASKS[name]
+            daq.create_digital_out_task(name, getattr(nidaq, line), overwrite=overwrite, persistent=True)
+        elif name == 'limits':
+            # one task for all three switches so they are sampled together; read_lines() is ordered x, y, z
+            daq.create_digital_in_group('limits', [nidaq.limit_switch_x, nidaq.limit_switch_y, nidaq.limit_switch_z],
+                                        overwrite=overwrite, sample_mode='change_detection')
+        elif name == 'clamp':
+            daq.create_analog_out_voltage_task('clamp', [nidaq.clamp_0, nidaq.clamp_1], overwrite=overwrite,
+                                               persistent=True)
+        elif name == 'analog_in':
+            # the device has a single AI timing engine, so the analog inputs share one continuous task; columns follow
+            # AI_TEMP, AI_ENCODER_REF and AI_ENCODER_SIGNAL
+            sample_rate = nidaq.analog_in_sample_rate
+            daq.create_analog_in_voltage_task('analog_in', [nidaq.temp, nidaq.encoder_ref, nidaq.encoder_signal],
+                                              overwrite=overwrite,
+                                              sample_rate=sample_rate,
+                                              buffer_size=int(sample_rate * nidaq.analog_in_buffer_seconds),
+                                              samples_per_read=max(1, int(sample_rate / 100)),
+                                              filename=nidaq.analog_in_ring_file)
+        else:
+            raise ValueError(f'Unknown DAQ task {name}.')
 
-        self.monitor_thread = threading.Thread(target=self.monitor_limits)
-        self.stage_thread = threading.Thread(target=self._stage.process_queue)
-
+    def start_hardware(self):
+        """
+        Run limit polling, queue dispatch and telemetry as fixed-rate tasks on the scheduler's worker and start applying
+        configuration changes.  Per-task timing is available from scheduler.stats().
+        :return:
+        """
         self._monitor_limits = True
-        self.monitor_thread.start()
         self._stage._queue_active = True
-        self.stage_thread.start()
-        self._daq.temp = True
-        self._daq.encoder_ref = True
-
-
-    def monitor_limits(self):
+        self.scheduler.every(self.LIMIT_PERIOD, self.poll_limits, name='limits')
+        self.scheduler.every(self.DISPATCH_PERIOD, self._stage.dispatch_step, name='dispatch')
+        self.scheduler.every(self.RESYNC_PERIOD, partial(self._stage.dispatch_step, resync=True), name='resync')
+        self.scheduler.every(self.TELEMETRY_PERIOD, self.update_telemetry, name='telemetry')
+        self._stage.add_motion_listener(self._wake_dispatch)
+        self.scheduler.start()
+        self.watch_config()
+
+    def _wake_dispatch(self):
+        self.scheduler.wake('dispatch')
+
+    async def run(self):
         """
-
+        Coordinate the stage queue and limit monitoring from the running event loop instead of start_hardware's
+        threads.  Returns once stop_hardware() is called.
         :return:
         """
+        self._loop = asyncio.get_running_loop()
+        self._async_limit_lock = asyncio.Lock()
+        self._monitor_limits = True
+        self._stage._queue_active = True
+        monitor = self._loop.create_task(self.monitor_limits_async())
+        try:
+            await self._stage.run_queue()
+        finally:
+            monitor.cancel()
+            self._loop = None
+
+    def stop_hardware(self):
+        """
+        Stop the limit monitor and the stage queue started by start_hardware() or run().
+        :return:
+        """
+        self._monitor_limits = False
+        self._limit_event.set()
+        self.watch_config(False)
+        self._stage.stop_queue()
+        self.scheduler.stop()
+        for name in ('limits', 'dispatch', 'resync', 'telemetry'):
+            self.scheduler.cancel(name)
+        if self._wake_dispatch in self._stage._motion_listeners:
+            self._stage.remove_motion_listener(self._wake_dispatch)
+
+    async def limit_events(self):
+        """
+        Async iterator over limit switch edges.
+        :return: (at_limit, timestamp) pairs.  at_limit is a boolean array ordered x, y, z that is True where a switch
+        is tripped.
+        """
+        async for value, timestamp in self.aio_daq.changes('limits'):
+            # the switches pull their line low when tripped
+            yield ~self._daq.limits.decode(value), timestamp
 
-        while self._monitor_limits:
-            if self._ignore_limits:
-                continue
 
-            for axis, task in self._limits.items():
-                if not task.read() and not self._limit_tripped[axis]:
-                    logging.info(f'axis {axis} is at the limit switch')
-                    self._stage._axes[axis].setEngaged(False)
-                    self._limit_tripped[axis] = True
-                    t = threading.Thread(target = self.move_off_limit, args = (axis, 5))
-                    t.start()
+    def _read_switches(self):
+        # the switches pull their line low when tripped
+        return ~self._daq.limits.read_lines()
 
-            time.sleep(.1)
+    def _release_brake(self, axis):
+        self._daq.clamp.write(self.clamp_table['reset' if axis is None else axis])
 
-    def move_off_limit(self, axis, step_size):
-        self.limit_lock.acquire()
+    def _limits_changed(self, value, timestamp):
+        # the homing engine latches trip positions from the edge timestamp, before the limits task gets to run
+        switches = ~self._daq.limits.decode(value)
+        for axis in range(3):
+            if switches[axis] == self._switches[axis]:
+                continue
+            if switches[axis]:
+                self._trip_positions[axis] = self._stage.position_at(axis, timestamp)
+            else:
+                release = self._releases[axis]
+                if release is not None and not release.done():
+                    release.set_result(self._stage.position_at(axis, timestamp))
+            self.homing.limit_changed(axis, bool(switches[axis]), timestamp)
+        self._switches = [bool(switch) for switch in switches]
+        self._limit_event.set()
+        self.scheduler.wake('limits')
+
+    def update_telemetry(self):
+        """
+        Telemetry task.  Takes a new status snapshot and bumps its version if anything but the timestamp changed.
+        :return: StageStatus
+        """
+        state = self._stage.state()
+        encoder = self.encoder_movement()
+        temperature = self.temp_value()
+        fields = (tuple(state.position), tuple(state.velocity), tuple(state.is_moving), tuple(state.is_engaged),
+                  tuple(bool(limit) for limit in self._limit_tripped), self._ignore_limits,
+                  None if temperature is None else round(float(temperature), self.TEMPERATURE_DECIMALS),
+                  tuple(round(value, self.ENCODER_DECIMALS) for value in encoder))
+        with self._status_lock:
+            self._status_checked = time.perf_counter()
+            if self._status is None or tuple(self._status[2:]) != fields:
+                version = 1 if self._status is None else self._status.version + 1
+                self._status = StageStatus(version, time.time(), *fields)
+            return self._status
+
+    def status(self, since=None):
+        """
+        Snapshot of all axis and DAQ state in one call, for the UI and remote clients.  The telemetry task refreshes it
+        every TELEMETRY_PERIOD seconds; if the task is not running, a snapshot older than that is refreshed here.
+        :param since: default None.  Version the client already has.
+        :return: StageStatus, or None if the version is still since.  Versions increase by one with each change.
+        """
+        status = self._status
+        if status is None or time.perf_counter() - self._status_checked > self.TELEMETRY_PERIOD:
+            status = self.update_telemetry()
+        if since is not None and status.version == since:
+            return None
+        return status
+
+    def poll_limits(self):
+        """
+        Limit switch task.  The switches are read when the limits task reported an edge, when limits stop being
+        ignored, and once a second as a safety net.  Newly tripped axes are disengaged and queued for recovery.
+        :return:
+        """
+        now = self._stage.clock()
+        if not self._limit_event.is_set() and now - self._last_limit_check < 1.0:
+            return
+        self._limit_event.clear()
+        self._last_limit_check = now
+        if not self._monitor_limits or self._ignore_limits:
+            return
+
+        tripped = self._newly_tripped(self._read_switches())
+        if self.homing.active:
+            # homing backs its axes off the switches itself
+            return
+        self._recovery.extend(tripped)
+        if self._recovery and not self._recovering:
+            self._recovering = True
+            self.scheduler.once(self._recover_limits)
+
+    def _recover_limits(self):
+        # job: back axes off their switches one at a time so recoveries never fight over the stage
+        try:
+            while self._recovery:
+                yield from self.move_off_limit(self._recovery.popleft())
+        finally:
+            self._recovering = False
+
+    async def monitor_limits_async(self):
+        """
+        monitor_limits as a coroutine driven by limit_events().
+        :return:
+        """
+        await self._handle_limits_async()
+        async for at_limit, timestamp in self.limit_events():
+            if not self._monitor_limits:
+                break
+            await self._handle_limits_async(at_limit)
+
+    async def _handle_limits_async(self, at_limit=None):
+        if self._ignore_limits:
+            return
+        if at_limit is None:
+            at_limit = ~await self.aio_daq.read_lines('limits')
+        tripped = self._newly_tripped(at_limit)
+        if self.homing.active:
+            return
+        for axis in tripped:
+            self._loop.create_task(self.move_off_limit_async(axis))
+
+    def _newly_tripped(self, at_limit):
+        """
+        Disengage and flag every axis whose switch just tripped, and drop the moves queued behind them.  Axes of an
+        active homing run are left to it.
+        :param at_limit: boolean per axis, True where the switch is tripped
+        :return: list of the axes that tripped
+        """
+        tripped = []
+        for axis in range(3):
+            if at_limit[axis] and not self._limit_tripped[axis]:
+                if self.homing.active and axis in self.homing.axes:
+                    # homing drives its axes onto the switches and backs them off; disengaging here would cancel that
+                    continue
+                logging.info(f'axis {axis} is at the limit switch')
+                self._stage.disengage_now([axis])
+                self._limit_tripped[axis] = True
+                tripped.append(axis)
+        if tripped:
+            # in the same pass as the disengage, so dispatch never sends a queued move before the recovery starts
+            dropped = self._stage.clear_queue()
+            if dropped:
+                logging.warning(f'dropped {dropped} queued moves after axes {tripped} hit their limit switches')
+        return tripped
+
+    def move_off_limit(self, axis):
+        """
+        Scheduler job that backs an axis off its limit switch.  The axis moves away in one continuous move while the
+        limits task watches the line; the release edge latches the release position, and the axis is retargeted to
+        limit_margin past it.  The axis is deliberately not stopped at the release first: the retarget ends at the same
+        point, without a stop and restart right on the switch edge.  The travel from trip to release is remembered, so
+        later recoveries of the axis go straight to it instead of searching.  A search goes LIMIT_SEARCH_DISTANCE past
+        the trip and doubles the distance on each of the LIMIT_ATTEMPTS.  Every target lies away from the switch as
+        seen from the current position, and latched positions that cannot be right, e.g. extrapolated from a stale
+        position event, are replaced by the current position.  Each recovery is recorded in limit_recoveries.
+        :param axis:
+        :return: True if the switch released
+        """
+        epoch = self._stage.halt_epoch
+        start = self._stage.clock()
+        away = -self._limit_direction[axis]
         logging.info(f'attempting to move axis {axis} off limit switch')
-        self._daq.clamp_0.write(self.clamp_table[axis][0])
-        self._daq.clamp_1.write(self.clamp_table[axis][1])
-        self._stage._axes[axis].setEngaged(0)
+        self._daq.clamp.write(self.clamp_table[axis])
+        release = Future()
+        self._releases[axis] = release
+        current = self._stage.position[axis]
+        trip_position = self._trip_positions[axis]
+        # the axis coasts on toward the switch after the trip, so the trip lies between it and the search distance
+        if trip_position is None or not 0.0 <= (trip_position - current) * away <= self.LIMIT_SEARCH_DISTANCE:
+            if trip_position is not None:
+                logging.warning(f'Ignoring implausible trip position {trip_position} of axis {axis} at {current}.')
+            trip_position = current
         attempts = 0
-        while not self._limits[axis].read():
-            if self._stage._axes[axis].getIsMoving():
-                time.sleep(.1)
-            position = self._stage.position
-            position[axis] += (step_size * self._limit_direction[axis] * -1)
-            self._stage.move_to(position)
-            attempts += 1
-            if attempts >= 10:
-                logging.warning('Failed to move axis {} off limit in 10 tries.  Ignoring.')
-                break
-        self._daq.clamp_0.write(self.clamp_table['reset'][0])
-        self._daq.clamp_1.write(self.clamp_table['reset'][1])
-        if attempts < 10:
+        try:
+            while not release.done() and self._read_switches()[axis]:
+                if self._stage.halt_epoch != epoch or attempts >= self.LIMIT_ATTEMPTS:
+                    break
+                known = self._release_distance[axis]
+                distance = known + self.limit_margin if known is not None and not attempts else \
+                    self.LIMIT_SEARCH_DISTANCE * 2 ** attempts
+                target = self._stage.position
+                target[axis] += away * (max((trip_position - target[axis]) * away, 0.0) + distance)
+                arrival = Future()
+                self._stage.move_to(target, arrival=arrival, epoch=epoch)
+                attempts += 1
+                yield scheduler.first_done([release, arrival])
+
+            released = not self._read_switches()[axis]
+            if release.done():
+                # the switch released somewhere between the trip and where the axis is now
+                current = self._stage.position[axis]
+                release_position = min(max(release.result(), min(trip_position, current)), max(trip_position, current))
+                self._release_distance[axis] = abs(release_position - trip_position)
+                if self._stage.halt_epoch == epoch:
+                    target = self._stage.position
+                    target[axis] = release_position + away * self.limit_margin
+                    arrival = Future()
+                    self._stage.move_to(target, arrival=arrival, epoch=epoch)
+                    yield arrival
+        finally:
+            self._releases[axis] = None
+            self._daq.clamp.write(self.clamp_table['reset'])
+
+        if released:
             self._limit_tripped[axis] = False
-        self.limit_lock.release()
-        if self._homing_mode:
-            axis += 1
-            if axis > 2:
-                self._homing_mode = False
-                self.zero_stage()
-                logging.info('staged homed')
-            else:
-                self.drive_axes_home(axis)
+        elif self._stage.halt_epoch != epoch:
+            logging.warning(f'Stage stopped while moving axis {axis} off limit.')
+        else:
+            logging.warning(f'Failed to move axis {axis} off limit in {attempts} tries.  Ignoring.')
+        self.limit_recoveries.append(LimitRecovery(axis, start, self._stage.clock() - start,
+                                                   self._release_distance[axis], attempts, released))
+        return released
 
-    def drive_axis_home(self, axis):
-        logging.info(f'driving axis {axis} to home')
-        position = self._stage.position
-        position[axis] += (10000 * self._limit_direction[axis])
-        self._stage.append_move(position)
+    async def move_off_limit_async(self, axis):
+        """
+        move_off_limit as a coroutine.  The job's waits are awaited on the running loop.
+        :param axis:
+        :return: True if the switch released
+        """
+        async with self._async_limit_lock:
+            job = self.move_off_limit(axis)
+            future = None
+            while True:
+                try:
+                    future = job.send(future)
+                except StopIteration as stop:
+                    return stop.value
+                await asyncio.wait([asyncio.wrap_future(future)])
+
+    def limit_recovery_stats(self):
+        """
+        Summary of limit_recoveries per axis.
+        :return: dict of axis to a dict with count, failures, mean and max duration in seconds and the travel from
+        trip to release
+        """
+        stats = {}
+        for axis in range(3):
+            recoveries = [recovery for recovery in self.limit_recoveries if recovery.axis == axis]
+            if not recoveries:
+                continue
+            durations = [recovery.duration for recovery in recoveries]
+            stats[axis] = {'count': len(recoveries),
+                           'failures': sum(not recovery.released for recovery in recoveries),
+                           'mean_duration': sum(durations) / len(durations),
+                           'max_duration': max(durations),
+                           'release_distance': self._release_distance[axis]}
+        return stats
 
     def zero_stage(self):
         logging.info('stage axis zeroed')
-        self._stage.zero_axis()
+        self._stage.zero_axes()
 
     def home_stage(self):
+        """
+        Stop the stage and home it on the control loop.  See homing.Homing.
+        :return: concurrent.futures.Future of the switch edges, or a HomingError
+        """
         logging.info('homing stage')
-        self._homing_mode = True
-        self._current_homing_axis = 0
         self._stage.stop_motion()
-        self.drive_axis_home(self._current_homing_axis)
+        return self.scheduler.once(self._home_stage)
+
+    def _home_stage(self):
+        try:
+            return (yield from self.homing.run())
+        finally:
+            # homing left every axis clear of its switch; let the limits task re-read them
+            self._limit_tripped = [False] * 3
+            self._limit_event.set()
 
     def move_to(self, coords):
-        self._stage.move_to(coords)
+        return self._stage.move_to(coords)
 
+    def plan_move(self, coords):
+        """
+        Predicted trajectory of a move from the current position, including its duration, without moving.
+        :param coords:
+        :return: trajectory.MotionPlan
+        """
+        return self._stage.plan_move(coords)
 
-   def temp_value(self, temp_meas):
-       logging.info('temperature')
-       self._daq.temp(temp_meas)
 
-   def encoder_movement(self):
-        logging.info('encoder motion')
-        encoder_position =
-        encoder_velocity =
-        encoder_acceleration =
+    def temp_value(self):
+        """
+        Most recent temperature sensor voltage.
+        :return: the voltage, or None before the first block is acquired or while analog input is stopped
+        """
+        try:
+            return self._daq.analog_in.read()[self.AI_TEMP]
+        except (IndexError, RuntimeError):
+            # the ring buffer is still empty, or the task is not streaming
+            return None
+
+    def _decode_encoder(self, block):
+        self._encoder.decode(block[:, self.AI_ENCODER_REF], block[:, self.AI_ENCODER_SIGNAL])
 
-        self._daq.encoder_ref()
-        self._daq.encoder_signal()
+    def encoder_movement(self):
+        """
+        Latest decimated encoder position (degrees), velocity (degrees / s) and acceleration (degrees / s^2).
+        :return: encoder.EncoderState
+        """
+        return self._encoder.state
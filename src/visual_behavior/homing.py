@@ -0,0 +1,177 @@
+"""
+Two-speed homing of the stage against its limit switches.
+
+Axes are homed in groups.  The axes of a group approach their switches together at full speed, back off one at a time,
+re-approach slowly for a precise edge and back off again.  The position at each edge is latched from the timestamp of
+the switch event, so it does not depend on how late the event was handled or how far the axis coasted.  Once every
+group is done the edges become the new origin.
+
+Homing runs as a scheduler job: every wait is yielded, so the control loop keeps polling limits and dispatching in
+between.
+"""
+import logging
+import time
+from concurrent.futures import Future
+
+from .exceptions import HomingError
+
+
+class Homing(object):
+    def __init__(self, stage, scheduler, read_limits, directions=(-1, -1, 1), groups=((2,), (0, 1)),
+                 fast_velocity=None, slow_velocity=None, back_off=5.0, travel=10000.0, brake=None,
+                 clock=time.perf_counter):
+        """
+        :param stage: PhidgetStage or SimulatedStage
+        :param scheduler: scheduler.Scheduler the homing job runs on
+        :param read_limits: called as read_limits() for whether each axis' switch is tripped
+        :param directions: direction of each axis' home switch, -1 or 1
+        :param groups: axes homed together, in order.  The default clears z before x and y sweep the rig.
+        :param fast_velocity: default None.  Velocity of the first approach.  If None, the stage's velocity_limit at the
+        time homing runs, so a live change of the limit carries over.
+        :param slow_velocity: default None.  Velocity of the second approach.  If None, a tenth of fast_velocity.
+        :param back_off: distance to back off a switch before re-approaching it
+        :param travel: farthest distance the first approach goes looking for a switch
+        :param brake: default None.  Called as brake(axis) before backing an axis off its switch and brake(None)
+        afterwards, e.g. to release the clamp that holds an axis at its limit.
+        :param clock: time source the homing duration is measured with
+        """
+        self._stage = stage
+        self._scheduler = scheduler
+        self._read_limits = read_limits
+        self.directions = list(directions)
+        self.groups = [tuple(group) for group in groups]
+        self._fast_velocity = fast_velocity
+        self._slow_velocity = slow_velocity
+        self.back_off = back_off
+        self.travel = travel
+        self._brake = brake
+        self._clock = clock
+        self._epoch = None
+        self._trips = {}
+        self._pending = []
+        self.active = False
+        self.edges = None
+        self.duration = None
+
+    @property
+    def fast_velocity(self):
+        return self._fast_velocity if self._fast_velocity is not None else self._stage.velocity_limit
+
+    @property
+    def slow_velocity(self):
+        return self._slow_velocity if self._slow_velocity is not None else self.fast_velocity / 10.0
+
+    @property
+    def axes(self):
+        """
+        :return: set of the axes a run homes, i.e. every axis in groups
+        """
+        return {axis for group in self.groups for axis in group}
+
+    def start(self):
+        """
+        Home the stage on the scheduler.
+        :return: concurrent.futures.Future of the switch edges in the coordinates before homing, or a HomingError
+        """
+        return self._scheduler.once(self.run, name='homing')
+
+    def limit_changed(self, axis, tripped, timestamp):
+        """
+        Feed a limit switch edge to the engine.  Safe to call from the thread that reports the edge.  An axis that is
+        approaching its switch is disengaged at once and its position at timestamp latched.
+        :param axis: axis index
+        :param tripped: True if the switch tripped, False if it released
+        :param timestamp: time of the edge on the stage clock
+        :return:
+        """
+        trip = self._trips.get(axis)
+        if tripped and trip is not None and not trip.done():
+            self._stage.disengage_now([axis])
+            trip.set_result(self._stage.position_at(axis, timestamp))
+
+    def _check_halt(self):
+        # motion listener: stop_motion aborts homing
+        if self._stage.halt_epoch != self._epoch:
+            for future in self._pending:
+                future.cancel()
+
+    def _wait(self, futures, timeout):
+        # give up on anything still pending after timeout seconds.  A stop before _pending was set is caught here.
+        self._pending = futures
+        self._scheduler.once(lambda: [future.cancel() for future in futures], delay=timeout, name='homing timeout')
+        self._check_stopped()
+        return futures
+
+    def _check_stopped(self):
+        if self._stage.halt_epoch != self._epoch:
+            raise HomingError('Stage stopped while homing.')
+
+    def _approach(self, axes, velocity, distance):
+        target = self._stage.position
+        for axis in axes:
+            target[axis] += self.directions[axis] * distance
+        at_limit = self._read_limits()
+        self._trips = {axis: Future() for axis in axes}
+        for axis in axes:
+            if at_limit[axis]:
+                # already at the switch, which only a fast approach can find
+                self._trips[axis].set_result(self._stage.position[axis])
+                target[axis] = self._stage.position[axis]
+        logging.info(f'homing axes {list(axes)} at {velocity} units/s')
+        timeout = self._stage.plan_move(target, velocity).duration + 1.0
+        self._stage.move_to(target, epoch=self._epoch, velocity=velocity)
+        trips = yield self._wait(list(self._trips.values()), timeout)
+        self._trips = {}
+        self._check_stopped()
+        for axis, trip in zip(axes, trips):
+            if trip.cancelled():
+                raise HomingError(f'Axis {axis} did not reach its limit switch.')
+        return {axis: trip.result() for axis, trip in zip(axes, trips)}
+
+    def _back_off_axis(self, axis):
+        target = self._stage.position
+        target[axis] -= self.directions[axis] * self.back_off
+        if self._brake:
+            self._brake(axis)
+        try:
+            arrival = Future()
+            timeout = self._stage.plan_move(target).duration + 1.0
+            self._stage.move_to(target, arrival=arrival, epoch=self._epoch)
+            yield self._wait([arrival], timeout)
+        finally:
+            if self._brake:
+                self._brake(None)
+        self._check_stopped()
+        if arrival.cancelled() or self._read_limits()[axis]:
+            raise HomingError(f'Axis {axis} did not clear its limit switch.')
+
+    def run(self):
+        """
+        The homing job.  See start().
+        :return: switch edge of each homed axis in the coordinates before homing, None for axes in no group
+        """
+        start = self._clock()
+        self._epoch = self._stage.halt_epoch
+        self.active = True
+        self._stage.add_motion_listener(self._check_halt)
+        try:
+            edges = [None] * len(self.directions)
+            for group in self.groups:
+                yield from self._approach(group, self.fast_velocity, self.travel)
+                for axis in group:
+                    yield from self._back_off_axis(axis)
+                latched = yield from self._approach(group, self.slow_velocity, 2 * self.back_off)
+                for axis in group:
+                    edges[axis] = latched[axis]
+                    yield from self._back_off_axis(axis)
+            self._stage.zero_axes(edges)
+        finally:
+            self._trips = {}
+            self._pending = []
+            self.active = False
+            self._stage.remove_motion_listener(self._check_halt)
+
+        self.edges = edges
+        self.duration = self._clock() - start
+        logging.info(f'stage homed in {self.duration:.2f} s.  switch edges: {edges}')
+        return edges
@@ -0,0 +1,140 @@
+"""
+Queue based logging front end.
+
+Logging handlers run on the thread that logs, so a slow file system or an unreachable log server stalls whatever called
+logging.info, e.g. the control loop in the middle of limit handling.  queue_handlers() moves a logger's handlers behind
+a bounded queue served by a listener thread: logging only formats the message and enqueues it.  When the queue is full
+records are dropped rather than waited for, counted per level, and reported by a warning once there is room again.
+"""
+import atexit
+import logging
+import queue
+import threading
+from collections import namedtuple
+from logging.handlers import QueueHandler, QueueListener
+
+# one queue.  queued and dropped count records since it was installed, dropped is broken down by level name.
+LogQueueStats = namedtuple('LogQueueStats', ['queued', 'dropped', 'dropped_by_level', 'pending', 'max_size'])
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+class BoundedQueueHandler(QueueHandler):
+    def __init__(self, max_size=10000):
+        """
+        :param max_size: records buffered before new ones are dropped
+        """
+        super(BoundedQueueHandler, self).__init__(queue.Queue(max_size))
+        self.max_size = max_size
+        self.queued = 0
+        self.dropped_by_level = {}
+        self._unreported = 0
+        self._count_lock = threading.Lock()
+
+    @property
+    def dropped(self):
+        return sum(self.dropped_by_level.values())
+
+    def enqueue(self, record):
+        if self._unreported:
+            with self._count_lock:
+                unreported, self._unreported = self._unreported, 0
+            if not self._put(self._dropped_record(unreported)):
+                with self._count_lock:
+                    self._unreported += unreported
+        if self._put(record):
+            with self._count_lock:
+                self.queued += 1
+        else:
+            with self._count_lock:
+                self.dropped_by_level[record.levelname] = self.dropped_by_level.get(record.levelname, 0) + 1
+                self._unreported += 1
+
+    def _put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            return False
+        return True
+
+    @staticmethod
+    def _dropped_record(count):
+        return logging.makeLogRecord({'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                                      'msg': f'log queue full: dropped {count} records'})
+
+    def stats(self):
+        with self._count_lock:
+            return LogQueueStats(self.queued, self.dropped, dict(self.dropped_by_level), self.queue.qsize(),
+                                 self.max_size)
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # wait for room instead of failing when the queue is full
+        self.queue.put(self._sentinel)
+
+
+def queue_handlers(logger=None, max_size=10000):
+    """
+    Move a logger's handlers to a listener thread behind a BoundedQueueHandler.  Levels set on the handlers are kept.
+    Installing again, e.g. after logging.config.dictConfig replaced the handlers, first stops the previous listener.
+    :param logger: default None.  Logger or logger name.  If None, the root logger.
+    :param max_size: records buffered before new ones are dropped
+    :return: the BoundedQueueHandler, or None if the logger has no handlers
+    """
+    if not isinstance(logger, logging.Logger):
+        logger = logging.getLogger(logger)
+    stop_queue_handlers(logger)
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, BoundedQueueHandler)]
+    if not handlers:
+        return None
+    handler = BoundedQueueHandler(max_size)
+    listener = _Listener(handler.queue, *handlers, respect_handler_level=True)
+    for old in handlers:
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+    listener.start()
+    with _listeners_lock:
+        _listeners[logger.name] = (handler, listener)
+    return handler
+
+
+def stop_queue_handlers(logger=None):
+    """
+    Flush a logger's queue and hand its handlers back to the logger.
+    :param logger: default None.  Logger or logger name.  If None, every logger queue_handlers() was called for.
+    :return:
+    """
+    with _listeners_lock:
+        if logger is None:
+            installed = list(_listeners.items())
+        else:
+            name = logger.name if isinstance(logger, logging.Logger) else logging.getLogger(logger).name
+            installed = [(name, _listeners[name])] if name in _listeners else []
+        for name, _ in installed:
+            del _listeners[name]
+    for name, (handler, listener) in installed:
+        target = logging.getLogger(name) if name != 'root' else logging.getLogger()
+        with handler._count_lock:
+            unreported, handler._unreported = handler._unreported, 0
+        if unreported:
+            handler.queue.put(handler._dropped_record(unreported))
+        # stop() processes everything still queued before it returns
+        listener.stop()
+        if handler in target.handlers:
+            # otherwise the handlers were replaced since, e.g. by dictConfig, which also closed them
+            target.removeHandler(handler)
+            for old in listener.handlers:
+                target.addHandler(old)
+
+
+def log_queue_stats():
+    """
+    :return: dict of logger name to LogQueueStats for every logger behind a queue
+    """
+    with _listeners_lock:
+        return {name: handler.stats() for name, (handler, _) in _listeners.items()}
+
+
+atexit.register(stop_queue_handlers)
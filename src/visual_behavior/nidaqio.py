@@ -1,26 +1,175 @@
-import PyDAQmx
 import ctypes
 import logging
+import os
+import threading
+import time
+from abc import ABCMeta, abstractmethod
 import numpy as np
 
+from .ring_buffer import RingBuffer
+
+# NIDAQ_BACKEND=simulated runs everything against the in-process device in simulated_daqmx.  It is never used as a
+# fallback: a rig whose NI driver fails to load must not carry on with simulated limit switches and an undriven clamp.
+if os.getenv('NIDAQ_BACKEND', 'pydaqmx').lower() == 'simulated':
+    from . import simulated_daqmx as PyDAQmx
+else:
+    try:
+        import PyDAQmx
+    except (ImportError, NotImplementedError, OSError) as err:
+        raise ImportError(f'Could not load PyDAQmx ({err}).  Set NIDAQ_BACKEND=simulated to run against the '
+                          f'simulated NIDAQ backend.') from err
+
+SIMULATED = PyDAQmx.__name__.endswith('simulated_daqmx')
+# the simulated backend has no change detection timing, 'change_detection' tasks poll instead
+CHANGE_DETECTION = hasattr(PyDAQmx.Task, 'CfgChangeDetectionTiming')
+
 
 class NIDAQNotFoundError(Exception):
     ...
 
 
-class NIDAQTask(PyDAQmx.Task):
+class NIDAQTask(PyDAQmx.Task, metaclass=ABCMeta):
     def __init__(self):
         super().__init__()
+        self.persistent = False
+        self.sample_mode = 'on_demand'
+        self._samples_read = PyDAQmx.int32()
+        self._ring = None
+        self._reader = None
+        self._streaming = False
+        self._block_callbacks = []
+
+    def commit(self):
+        """
+        Reserve and commit the task's resources once and leave it running.  Writes to a persistent task go straight
+        to the hardware buffer instead of paying for a start / stop transition every time.
+        :return:
+        """
+        self.TaskControl(PyDAQmx.DAQmx_Val_Task_Commit)
+        self.StartTask()
+        self.persistent = True
+
+    @property
+    def streaming(self):
+        return self._streaming
+
+    def timestamp(self):
+        """
+        :return: the current time of the clock change timestamps are taken from.  time.perf_counter() with the driver;
+        on the simulated backend the device's clock, which may be a simulated_phidget.VirtualClock shared with a
+        simulated stage.
+        """
+        return self._device.clock() if SIMULATED else time.perf_counter()
+
+    def start_streaming(self):
+        """
+        Start the sample clock and the background reader that copies acquired blocks into the ring buffer.
+        :return:
+        """
+        if self.sample_mode != 'continuous':
+            raise TypeError(f'{self.fq_channel} is not configured for continuous sampling.')
+        if self._streaming:
+            return
+        self._ring.clear()
+        self.StartTask()
+        self._streaming = True
+        self._reader = threading.Thread(target=self._stream, name=f'{self.fq_channel} reader', daemon=True)
+        self._reader.start()
+
+    def stop_streaming(self):
+        if not self._streaming:
+            return
+        self._streaming = False
+        if self._reader is not None and self._reader is not threading.current_thread():
+            self._reader.join()
+        self._reader = None
+
+    def StopTask(self):
+        self.stop_streaming()
+        super().StopTask()
+
+    @abstractmethod
+    def _read_block(self, timeout):
+        """
+        Read the next samples_per_read samples into self._read_buffer.
+        :param timeout:
+        :return:
+        """
+
+    def _stream(self):
+        timeout = 10.0 * self.samples_per_read / self.sample_rate
+        while self._streaming:
+            try:
+                self._read_block(timeout)
+            except PyDAQmx.DAQError as err:
+                if getattr(err, 'error', None) == PyDAQmx.DAQmxErrorSamplesNotYetAvailable:
+                    # the block was not acquired in time, e.g. while a simulation clock is paused; keep waiting
+                    continue
+                logging.error(f'Streaming read from {self.fq_channel} failed: {err}')
+                self._streaming = False
+                break
+            block = self._read_buffer[:self._samples_read.value]
+            self._ring.extend(block)
+            for callback in list(self._block_callbacks):
+                try:
+                    callback(block)
+                except Exception:
+                    logging.exception(f'Block callback for {self.fq_channel} failed.')
+
+    def add_block_callback(self, callback):
+        """
+        Register a function called with every block a streaming task reads, on the reader thread.  The block is a view
+        of the read buffer that is overwritten by the next read, so copy anything that has to be kept.
+        :param callback:
+        :return:
+        """
+        self._block_callbacks.append(callback)
+
+    def remove_block_callback(self, callback):
+        self._block_callbacks.remove(callback)
+
+    def window(self, n=None):
+        """
+        Zero-copy, read-only view of the last n streamed samples.
+        :param n: default None.  If None, the full ring buffer is returned.
+        :return:
+        """
+        if self.sample_mode != 'continuous':
+            raise TypeError(f'{self.fq_channel} is not configured for continuous sampling.')
+        return self._ring.window(n)
 
 
 class NIDAQDigitalTask(NIDAQTask):
-    def __init__(self, device_name, channel, mode='di'):
+    def __init__(self, device_name, channel, mode='di', sample_mode='on_demand', sample_rate=1000.0,
+                 buffer_size=10000, samples_per_read=10, persistent=False, poll_interval=.001):
+        """
+
+        :param device_name:
+        :param channel:
+        :param mode: 'di' or 'do'
+        :param sample_mode: default 'on_demand'.  'on_demand' reads go through the driver on every call.
+        'continuous' input tasks acquire on the sample clock into a ring buffer that is filled by a background
+        reader.  See start_streaming().  'change_detection' input tasks are interrupt driven: the driver signals every
+        edge and registered change callbacks are called with the new value.  See add_change_callback().
+        :param sample_rate: sample clock rate in Hz for continuous acquisition
+        :param buffer_size: number of samples kept in the driver and ring buffers for continuous acquisition
+        :param samples_per_read: block size handed from the driver to the ring buffer.  This bounds the staleness of
+        read() to samples_per_read / sample_rate seconds.
+        :param persistent: default False.  If True, a 'do' task is committed and started once instead of around every
+        write.  See NIDAQTask.commit().
+        :param poll_interval: seconds between reads when a 'change_detection' task has to fall back to polling,
+        e.g. on the simulated backend or on devices without change detection.
+        """
         super().__init__()
         self.device_name = device_name
         self.channel = channel
         self.mode = mode
+        self.sample_mode = sample_mode
 
-        self.fq_channel = f'{device_name}/{channel}'
+        if isinstance(channel, (list, tuple)):
+            self.fq_channel = ','.join(f'{device_name}/{c}' for c in channel)
+        else:
+            self.fq_channel = f'{device_name}/{channel}'
         logging.info(f'Creating task: {self.fq_channel}')
         #self.task = PyDAQmx.Task()
         if mode == 'di':
@@ -30,29 +179,214 @@ class NIDAQDigitalTask(NIDAQTask):
         else:
             raise ValueError(f'Unknown mode: {mode}.  Valid modes are \'di\' and \'do\'.')
 
+        self._read_buffer = np.zeros(1, dtype=np.uint32)
+        self._change_callbacks = []
+        self._latest = None
+        self._change_detection_configured = False
+        self._poll_lock = threading.Lock()
+        self.poll_interval = poll_interval
+
+        if sample_mode == 'change_detection':
+            if mode != 'di':
+                raise ValueError('Change detection is only supported for \'di\' tasks.')
+            self.buffer_size = buffer_size
+            self._read_buffer = np.zeros(64, dtype=np.uint32)
+        elif sample_mode == 'continuous':
+            if mode != 'di':
+                raise ValueError('Continuous sampling is only supported for \'di\' tasks.')
+            self.sample_rate = sample_rate
+            self.samples_per_read = samples_per_read
+            self._ring = RingBuffer(buffer_size, dtype=np.uint32)
+            self._read_buffer = np.zeros(samples_per_read, dtype=np.uint32)
+            self.CfgSampClkTiming(b'', sample_rate, PyDAQmx.DAQmx_Val_Rising, PyDAQmx.DAQmx_Val_ContSamps,
+                                  buffer_size)
+        elif sample_mode != 'on_demand':
+            raise ValueError(f'Unknown sample mode: {sample_mode}.  Valid modes are \'on_demand\', '
+                             f'\'continuous\' and \'change_detection\'.')
+
+        if persistent:
+            if mode != 'do':
+                raise ValueError('Persistent tasks are only supported for \'do\' tasks.')
+            self.commit()
+
+    def _read_block(self, timeout):
+        self.ReadDigitalU32(self.samples_per_read, timeout, PyDAQmx.DAQmx_Val_GroupByChannel, self._read_buffer,
+                            self.samples_per_read, ctypes.byref(self._samples_read), None)
+
+    def add_change_callback(self, callback):
+        """
+        Register a function called as callback(value, timestamp) on every change of a 'change_detection' task.
+        timestamp is timestamp() when the change was picked up.  With hardware change detection callbacks
+        run on the driver's event thread and should return quickly.
+        :param callback:
+        :return:
+        """
+        if self.sample_mode != 'change_detection':
+            raise TypeError(f'{self.fq_channel} is not configured for change detection.')
+        self._change_callbacks.append(callback)
+
+    def remove_change_callback(self, callback):
+        self._change_callbacks.remove(callback)
+
+    def _changed(self, value, timestamp):
+        self._latest = value
+        for callback in list(self._change_callbacks):
+            try:
+                callback(value, timestamp)
+            except Exception:
+                logging.exception(f'Change callback for {self.fq_channel} failed.')
+
+    def _read_now(self):
+        self.ReadDigitalU32(1, .1, PyDAQmx.DAQmx_Val_GroupByChannel, self._read_buffer, 1,
+                            ctypes.byref(self._samples_read), None)
+        return self._read_buffer[0]
+
+    def start_streaming(self):
+        if self.sample_mode != 'change_detection':
+            return super().start_streaming()
+        if self._streaming:
+            return
+
+        if CHANGE_DETECTION and not self._change_detection_configured:
+            # change detection only reports edges, so take the starting state with an on-demand read first
+            self._latest = self._read_now()
+            try:
+                self.CfgChangeDetectionTiming(self.fq_channel.encode(), self.fq_channel.encode(),
+                                              PyDAQmx.DAQmx_Val_ContSamps, self.buffer_size)
+                self.AutoRegisterSignalEvent(PyDAQmx.DAQmx_Val_ChangeDetectionEvent, 0)
+                self._change_detection_configured = True
+            except PyDAQmx.DAQError as err:
+                logging.warning(f'Change detection unavailable for {self.fq_channel} ({err}).  Polling instead.')
+
+        self._streaming = True
+        if self._change_detection_configured:
+            self.StartTask()
+        else:
+            self._latest = self._read_now()
+            self._reader = threading.Thread(target=self._poll_changes, name=f'{self.fq_channel} poller', daemon=True)
+            self._reader.start()
+
+    def SignalCallback(self):
+        """
+        Driver callback for the change detection event.
+        :return:
+        """
+        timestamp = self.timestamp()
+        self.ReadDigitalU32(PyDAQmx.DAQmx_Val_Auto, 0, PyDAQmx.DAQmx_Val_GroupByChannel, self._read_buffer,
+                            self._read_buffer.size, ctypes.byref(self._samples_read), None)
+        for value in self._read_buffer[:self._samples_read.value]:
+            self._changed(value, timestamp)
+        return 0
+
+    def poll(self):
+        """
+        Read a polled 'change_detection' task now and call the change callbacks if the value changed.  The poller
+        thread does this every poll_interval; calling it directly picks a change up at a known time, e.g. right after
+        advancing a virtual clock.
+        :return: the current value
+        """
+        with self._poll_lock:
+            value = self._read_now()
+            if value != self._latest:
+                self._changed(value, self.timestamp())
+            return value
+
+    def _poll_changes(self):
+        while self._streaming:
+            try:
+                self.poll()
+            except PyDAQmx.DAQError as err:
+                logging.error(f'Polling {self.fq_channel} failed: {err}')
+                self._streaming = False
+                break
+            time.sleep(self.poll_interval)
+
     def read(self):
         if self.mode != 'di':
             raise TypeError(f'{self.fq_channel} is not configured for read.')
-        read = PyDAQmx.int32()
-        data = np.zeros(1000, dtype=np.uint32)
-        self.ReadDigitalU32(-1, .1, PyDAQmx.DAQmx_Val_GroupByChannel, data, 1000, ctypes.byref(read), None)
-        return data[0]
+        if self.sample_mode == 'change_detection' and self._streaming:
+            return self._latest
+        if self.sample_mode == 'continuous':
+            if not self._streaming:
+                raise RuntimeError(f'{self.fq_channel} is not streaming.  Call start_streaming() first.')
+            return self._ring.latest()
+        self.ReadDigitalU32(1, .1, PyDAQmx.DAQmx_Val_GroupByChannel, self._read_buffer, 1,
+                            ctypes.byref(self._samples_read), None)
+        return self._read_buffer[0]
 
     def write(self, data):
         if self.mode != 'do':
             raise TypeError(f'{self.fq_channel} is not configured for write.')
+        if self.persistent:
+            self.WriteDigitalLines(1, 1, len(data), PyDAQmx.DAQmx_Val_GroupByChannel, data, None, None)
+            return
         self.StartTask()
         self.WriteDigitalLines(1, 1, len(data), PyDAQmx.DAQmx_Val_GroupByChannel, data, None, None)
         self.StopTask()
 
 
+class NIDAQDigitalGroupTask(NIDAQDigitalTask):
+    def __init__(self, device_name, lines, **kwargs):
+        """
+        A single digital input channel spanning several lines of one port.  All lines are sampled at the same instant
+        with one driver call and come back as one U32 word with each line at its bit position in the port.
+
+        :param device_name:
+        :param lines: list of lines, e.g. ['port0/line5', 'port0/line3', 'port0/line1'].  The order of the list is the
+        order of read_lines().
+        :param kwargs: sample_mode and timing arguments.  See NIDAQDigitalTask.
+        """
+        ports = set()
+        masks = []
+        for line in lines:
+            port, _, number = line.partition('/line')
+            if not number.isdigit():
+                raise ValueError(f'Invalid line: {line}.  Expected a single line like \'port0/line5\'.')
+            ports.add(port)
+            masks.append(1 << int(number))
+        if len(ports) != 1:
+            raise ValueError(f'Lines must share a single port: {lines}')
+
+        self.lines = list(lines)
+        self.masks = np.array(masks, dtype=np.uint32)
+        super().__init__(device_name, self.lines, mode='di', **kwargs)
+
+    def decode(self, value):
+        """
+        Split a port word, e.g. the value passed to a change callback, into per-line levels.
+        :param value:
+        :return: boolean numpy array with one entry per line, True where the line is high
+        """
+        return (value & self.masks) != 0
+
+    def read_lines(self):
+        """
+        Read all lines in one call.
+        :return: boolean numpy array with one entry per line, True where the line is high
+        """
+        return self.decode(self.read())
+
+
 class NIDAQAnalogTask(NIDAQTask):
-    def __init__(self, device_name, channel, mode='ao_volt'):
+    def __init__(self, device_name, channel, mode='ao_volt', persistent=False):
+        """
+
+        :param device_name:
+        :param channel: a channel, or a list of channels that are updated together by each write
+        :param mode: 'ao_volt'
+        :param persistent: default False.  If True, the task is committed and started once instead of around every
+        write.  See NIDAQTask.commit().
+        """
         super().__init__()
         self.device_name = device_name
         self.channel = channel
         self.mode = mode
-        self.fq_channel = f'{device_name}/{channel}'
+        if isinstance(channel, (list, tuple)):
+            self.channel_count = len(channel)
+            self.fq_channel = ','.join(f'{device_name}/{c}' for c in channel)
+        else:
+            self.channel_count = 1
+            self.fq_channel = f'{device_name}/{channel}'
         logging.info(f'Creating task: {self.fq_channel}')
         if mode == 'ao_volt':
             self.CreateAOVoltageChan(f'{self.fq_channel}'.encode(), b'', -10.0, 10.0, PyDAQmx.DAQmx_Val_Volts,
@@ -60,15 +394,113 @@ class NIDAQAnalogTask(NIDAQTask):
         else:
             raise ValueError(f'Unknown mode: {mode}.  Valid modes are \'ao_volt\'.')
 
+        if persistent:
+            self.commit()
+
     def write(self, data):
+        """
+
+        :param data: 1d array of samples for a single channel task.  Multi-channel tasks take a C-contiguous float64
+        array of shape (samples, channels) so every channel is updated by the same write; see pack_channels().
+        :return:
+        """
         if self.mode != 'ao_volt':
             raise TypeError(f'{self.fq_channel} is not configured for write.')
         logging.debug(f'Writing analog voltage to {self.fq_channel}')
+        if self.channel_count > 1:
+            if data.ndim != 2 or data.shape[1] != self.channel_count:
+                raise ValueError(f'Expected data of shape (samples, {self.channel_count}) for {self.fq_channel}.')
+            layout = PyDAQmx.DAQmx_Val_GroupByScanNumber
+        else:
+            layout = PyDAQmx.DAQmx_Val_GroupByChannel
+
+        if self.persistent:
+            self.WriteAnalogF64(len(data), False, -1, layout, data, PyDAQmx.int32(len(data)), None)
+            return
         self.StartTask()
-        self.WriteAnalogF64(len(data), False, -1, PyDAQmx.DAQmx_Val_GroupByChannel, data, PyDAQmx.int32(len(data)),
-                                None)
+        self.WriteAnalogF64(len(data), False, -1, layout, data, PyDAQmx.int32(len(data)), None)
         self.StopTask()
 
+    def _read_block(self, timeout):
+        raise TypeError(f'{self.fq_channel} is an output task and cannot be read.')
+
+    @staticmethod
+    def pack_channels(levels, samples):
+        """
+        Build an interleaved (scan-major) write buffer holding a constant level per channel.  Precompute these once for
+        patterns that are written repeatedly.
+        :param levels: one voltage per channel
+        :param samples: samples per channel
+        :return: C-contiguous float64 array of shape (samples, channels)
+        """
+        return np.ascontiguousarray(np.tile(np.asarray(levels, dtype=np.float64), (samples, 1)))
+
+
+class NIDAQAnalogInputTask(NIDAQTask):
+    def __init__(self, device_name, channel, sample_rate=1000.0, buffer_size=60000, samples_per_read=100,
+                 filename=None, min_val=-10.0, max_val=10.0):
+        """
+        Continuous, hardware clocked voltage acquisition on one or more channels.  A background reader moves fixed size
+        blocks of scans from the driver into a RingBuffer.  With a filename the ring buffer is a memory-mapped file, so
+        long sessions are recorded at kHz rates with constant memory use.
+
+        :param device_name:
+        :param channel: a channel, or a list of channels that are sampled together.  Columns follow the list order.
+        :param sample_rate: sample clock rate in Hz
+        :param buffer_size: scans kept in the ring buffer
+        :param samples_per_read: scans per block.  This bounds the staleness of read() to
+        samples_per_read / sample_rate seconds.
+        :param filename: default None.  If given, the ring buffer is backed by this file.
+        :param min_val: minimum expected voltage
+        :param max_val: maximum expected voltage
+        """
+        super().__init__()
+        self.device_name = device_name
+        self.channels = list(channel) if isinstance(channel, (list, tuple)) else [channel]
+        self.mode = 'ai_volt'
+        self.sample_mode = 'continuous'
+        self.sample_rate = sample_rate
+        self.samples_per_read = samples_per_read
+        self.fq_channel = ','.join(f'{device_name}/{c}' for c in self.channels)
+        logging.info(f'Creating task: {self.fq_channel}')
+
+        self.CreateAIVoltageChan(self.fq_channel.encode(), b'', PyDAQmx.DAQmx_Val_Cfg_Default, min_val, max_val,
+                                 PyDAQmx.DAQmx_Val_Volts, None)
+        # the driver only has to absorb jitter of the reader thread, the ring buffer holds the history
+        self.CfgSampClkTiming(b'', sample_rate, PyDAQmx.DAQmx_Val_Rising, PyDAQmx.DAQmx_Val_ContSamps,
+                              max(10 * samples_per_read, int(sample_rate)))
+
+        if filename and os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self._ring = RingBuffer(buffer_size, dtype=np.float64, channels=len(self.channels), filename=filename)
+        self._read_buffer = np.zeros((samples_per_read, len(self.channels)), dtype=np.float64)
+
+    def _read_block(self, timeout):
+        self.ReadAnalogF64(self.samples_per_read, timeout, PyDAQmx.DAQmx_Val_GroupByScanNumber, self._read_buffer,
+                           self._read_buffer.size, ctypes.byref(self._samples_read), None)
+
+    def read(self):
+        """
+        Most recent scan, one voltage per channel.
+        :return:
+        """
+        if not self._streaming:
+            raise RuntimeError(f'{self.fq_channel} is not streaming.  Call start_streaming() first.')
+        return self._ring.latest()
+
+    def channel_window(self, channel, n=None):
+        """
+        View of the last n samples of a single channel.
+        :param channel: channel name as passed to __init__, e.g. 'ai6'
+        :param n: default None.  If None, the full ring buffer is returned.
+        :return:
+        """
+        return self.window(n)[:, self.channels.index(channel)]
+
+    def StopTask(self):
+        super().StopTask()
+        self._ring.flush()
+
 
 class NIDAQio(object):
     def __init__(self):
@@ -101,38 +533,90 @@ class NIDAQio(object):
             return task
         return None
 
-    def create_digital_out_task(self, name, channel, overwrite=False):
+    def _clear_task(self, name, overwrite):
         """
-
+        Make room for a new task called name.  An existing task is stopped and cleared: a committed task keeps its
+        lines reserved after StopTask, so only clearing it lets the new task use them.
         :param name:
-        :param channel:
+        :param overwrite:
         :return:
         """
         old_task = self._can_add_task(name, overwrite)
         if old_task:
             old_task.StopTask()
+            old_task.ClearTask()
+            # never leave a cleared task behind if creating its replacement fails
+            delattr(self, name)
+
+    def create_digital_out_task(self, name, channel, overwrite=False, persistent=False):
+        """
+
+        :param name:
+        :param channel:
+        :param persistent: default False.  If True, the task is committed and kept running between writes.
+        :return:
+        """
+        self._clear_task(name, overwrite)
 
-        task = NIDAQDigitalTask(self.device_name.decode(), channel, mode='do')
+        task = NIDAQDigitalTask(self.device_name.decode(), channel, mode='do', persistent=persistent)
         setattr(self, name, task)
 
-    def create_digital_in_task(self, name, channel, overwrite=False):
+    def create_digital_in_task(self, name, channel, overwrite=False, sample_mode='on_demand', **timing):
         """
 
         :param name:
         :param channel:
+        :param sample_mode: default 'on_demand'.  'continuous' and 'change_detection' tasks are started immediately.
+        See NIDAQDigitalTask.
+        :param timing: sample_rate, buffer_size, samples_per_read and poll_interval.
         :return:
         """
-        old_task = self._can_add_task(name, overwrite)
-        if old_task:
-            old_task.StopTask()
+        self._clear_task(name, overwrite)
 
-        task = NIDAQDigitalTask(self.device_name.decode(), channel, mode='di')
+        task = NIDAQDigitalTask(self.device_name.decode(), channel, mode='di', sample_mode=sample_mode, **timing)
+        if sample_mode != 'on_demand':
+            task.start_streaming()
         setattr(self, name, task)
 
-    def create_analog_out_voltage_task(self, name, channel, overwrite=False):
-        old_task = self._can_add_task(name, overwrite)
-        if old_task:
-            old_task.StopTask()
+    def create_digital_in_group(self, name, lines, overwrite=False, sample_mode='on_demand', **timing):
+        """
+        Create one digital input task that reads several lines of a port in a single call.  See NIDAQDigitalGroupTask.
+        :param name:
+        :param lines: list of lines on the same port
+        :param sample_mode: default 'on_demand'.  'continuous' and 'change_detection' tasks are started immediately.
+        :param timing: sample_rate, buffer_size, samples_per_read and poll_interval.
+        :return:
+        """
+        self._clear_task(name, overwrite)
+
+        task = NIDAQDigitalGroupTask(self.device_name.decode(), lines, sample_mode=sample_mode, **timing)
+        if sample_mode != 'on_demand':
+            task.start_streaming()
+        setattr(self, name, task)
+
+    def create_analog_in_voltage_task(self, name, channel, overwrite=False, **kwargs):
+        """
+        Create and start a continuous analog input task.  See NIDAQAnalogInputTask.
+        :param name:
+        :param channel: a channel, or a list of channels that are sampled together
+        :param kwargs: sample_rate, buffer_size, samples_per_read, filename, min_val and max_val
+        :return:
+        """
+        self._clear_task(name, overwrite)
+
+        task = NIDAQAnalogInputTask(self.device_name.decode(), channel, **kwargs)
+        task.start_streaming()
+        setattr(self, name, task)
+
+    def create_analog_out_voltage_task(self, name, channel, overwrite=False, persistent=False):
+        """
+
+        :param name:
+        :param channel: a channel, or a list of channels that are written simultaneously
+        :param persistent: default False.  If True, the task is committed and kept running between writes.
+        :return:
+        """
+        self._clear_task(name, overwrite)
 
-        task = NIDAQAnalogTask(self.device_name.decode(), channel, mode='ao_volt')
+        task = NIDAQAnalogTask(self.device_name.decode(), channel, mode='ao_volt', persistent=persistent)
         setattr(self, name, task)
@@ -0,0 +1,163 @@
+import numpy as np
+
+# ring file layout: this header, padded to RING_FILE_HEADER_SIZE bytes, followed by the 2 * capacity samples.  count is
+# updated after every write, so the file can be read back with RingBuffer.load after the writer died.
+RING_FILE_MAGIC = b'VBRING01'
+RING_FILE_HEADER = np.dtype([('magic', 'S8'), ('capacity', '<i8'), ('channels', '<i8'), ('dtype', 'S8'),
+                             ('count', '<i8')])
+RING_FILE_HEADER_SIZE = 64
+
+
+class RingBuffer(object):
+    def __init__(self, capacity, dtype=np.float64, channels=None, filename=None, resume=False):
+        """
+        Fixed capacity sample buffer for streaming acquisition.
+
+        Every sample is stored twice, at index i and i + capacity, so the most recent n samples are always contiguous
+        and can be handed out as a view without copying.
+
+        :param capacity: number of samples retained
+        :param dtype: numpy dtype of the samples
+        :param channels: default None.  If None, samples are scalars.  Otherwise each sample is a row of this many
+        channels.
+        :param filename: default None.  If given, the buffer is a memory-mapped ring file of 2 * capacity samples
+        instead of RAM, so long recordings have a fixed memory footprint.  The file starts with a header holding the
+        layout and the sample count.  The file is overwritten unless resume is set.
+        :param resume: default False.  If True and filename is a ring file with the same capacity, channels and dtype,
+        its samples are kept and writing continues after them.
+        """
+        if capacity <= 0:
+            raise ValueError(f'Invalid capacity: {capacity}.  Capacity must be positive.')
+        self.capacity = int(capacity)
+        self.channels = channels
+        shape = (2 * self.capacity,) if channels is None else (2 * self.capacity, channels)
+        self.filename = filename
+        self._header = None
+        self._count = 0
+        if filename is None:
+            self._data = np.zeros(shape, dtype=dtype)
+            return
+
+        layout = (RING_FILE_MAGIC, self.capacity, channels or 0, np.dtype(dtype).str.encode())
+        header = self.read_header(filename) if resume else None
+        if header is not None and tuple(header[name] for name in ('magic', 'capacity', 'channels', 'dtype')) == layout:
+            self._header = np.memmap(filename, dtype=RING_FILE_HEADER, mode='r+', shape=(1,))
+            self._count = int(header['count'])
+        else:
+            self._header = np.memmap(filename, dtype=RING_FILE_HEADER, mode='w+', shape=(1,))
+            self._header['magic'], self._header['capacity'], self._header['channels'], self._header['dtype'] = layout
+            self._header['count'] = 0
+        self._data = np.memmap(filename, dtype=dtype, mode='r+', offset=RING_FILE_HEADER_SIZE, shape=shape)
+
+    @staticmethod
+    def read_header(filename):
+        """
+        Header of a ring file.
+        :param filename:
+        :return: numpy record with magic, capacity, channels, dtype and count, or None if filename is not a ring file
+        """
+        try:
+            header = np.fromfile(filename, dtype=RING_FILE_HEADER, count=1)
+        except (OSError, ValueError):
+            return None
+        if len(header) != 1 or header[0]['magic'] != RING_FILE_MAGIC:
+            return None
+        return header[0]
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Reopen a ring file, e.g. to read back a recording after a crash.  Further writes continue after its samples.
+        :param filename:
+        :return: RingBuffer
+        """
+        header = cls.read_header(filename)
+        if header is None:
+            raise ValueError(f'{filename} is not a ring file.')
+        return cls(int(header['capacity']), dtype=np.dtype(header['dtype'].decode()),
+                   channels=int(header['channels']) or None, filename=filename, resume=True)
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def count(self):
+        """
+        Total number of samples written since creation.
+        :return:
+        """
+        return self._count
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def extend(self, samples):
+        """
+        Append a block of samples.  If the block is longer than the buffer only the tail is kept.
+        :param samples: array-like of shape (n,) or (n, channels)
+        :return:
+        """
+        samples = np.asarray(samples, dtype=self._data.dtype)
+        count = len(samples)
+        if count == 0:
+            return
+
+        written = self._count
+        if count > self.capacity:
+            written += count - self.capacity
+            samples = samples[-self.capacity:]
+
+        start = written % self.capacity
+        first = min(len(samples), self.capacity - start)
+        self._data[start:start + first] = samples[:first]
+        self._data[start + self.capacity:start + self.capacity + first] = samples[:first]
+        remainder = len(samples) - first
+        if remainder:
+            self._data[:remainder] = samples[first:]
+            self._data[self.capacity:self.capacity + remainder] = samples[first:]
+
+        # publish only after the data is in place so readers never see unwritten samples
+        self._count += count
+        if self._header is not None:
+            self._header['count'] = self._count
+
+    def latest(self):
+        """
+        Most recently written sample.
+        :return:
+        """
+        if not self._count:
+            raise IndexError('RingBuffer is empty.')
+        return self._data[(self._count - 1) % self.capacity]
+
+    def window(self, n=None):
+        """
+        Read-only view of the last n samples, oldest first.  The view aliases the buffer, so copy it if it has to
+        outlive the next capacity - n writes.
+        :param n: default None.  Number of samples.  If None, every retained sample is returned.
+        :return:
+        """
+        available = len(self)
+        if n is None:
+            n = available
+        if n > available:
+            raise ValueError(f'Requested {n} samples but only {available} are available.')
+        end = self._count % self.capacity + self.capacity
+        view = self._data[end - n:end]
+        view.flags.writeable = False
+        return view
+
+    def clear(self):
+        self._count = 0
+        if self._header is not None:
+            self._header['count'] = 0
+
+    def flush(self):
+        """
+        Write pending changes of a memory-mapped buffer to disk.
+        :return:
+        """
+        if self.filename is not None:
+            self._data.flush()
+            self._header.flush()
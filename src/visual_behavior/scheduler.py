@@ -0,0 +1,280 @@
+"""
+Cooperative control loop: fixed-rate tasks and one-shot jobs run in turn on a single worker.
+
+Nothing here preempts a running task, so tasks must return quickly.  A job that has to wait, e.g. for a move to arrive,
+is written as a generator: yielding a number suspends it for that many seconds, and yielding a
+concurrent.futures.Future suspends it until the future is done, which is then sent back into the generator.  Yielding a
+list of futures waits for all of them and sends back the list.  Every task and job runs on the worker thread, so state
+they share needs no locks.
+"""
+import heapq
+import inspect
+import itertools
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+TaskStats = namedtuple('TaskStats', ['runs', 'mean_duration', 'max_duration', 'mean_jitter', 'max_jitter', 'overruns'])
+
+
+def _gather(futures):
+    # Future done once every future in the list is done
+    gathered = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            gathered.set_result(futures)
+
+    if not futures:
+        gathered.set_result(futures)
+    for future in futures:
+        future.add_done_callback(done)
+    return gathered
+
+
+def first_done(futures):
+    """
+    Future resolved with the first of futures to be done, e.g. to let a job wait for an event or a move arrival,
+    whichever comes first.
+    :param futures: list of concurrent.futures.Future
+    :return: concurrent.futures.Future
+    """
+    first = Future()
+    lock = threading.Lock()
+
+    def done(future):
+        with lock:
+            if first.done():
+                return
+            first.set_result(future)
+
+    for future in futures:
+        future.add_done_callback(done)
+    return first
+
+
+class _Entry(object):
+    __slots__ = ('name', 'function', 'period', 'due', 'future', 'generator', 'value', 'cancelled')
+
+    def __init__(self, name, function, period=None, future=None):
+        self.name = name
+        self.function = function
+        self.period = period
+        self.due = None
+        self.future = future
+        self.generator = None
+        self.value = None
+        self.cancelled = False
+
+
+class Scheduler(object):
+    def __init__(self, clock=time.perf_counter, name='control-loop'):
+        """
+        :param clock: monotonic time source in seconds.  With a simulated_phidget.VirtualClock, drive the scheduler
+        with run_pending() instead of start().
+        :param name: worker thread name
+        """
+        self._clock = clock
+        self.name = name
+        self._condition = threading.Condition()
+        self._heap = []
+        self._tasks = {}
+        self._stats = {}
+        self._sequence = itertools.count()
+        self._running = False
+        self._thread = None
+
+    def _push(self, entry, due):
+        # call with _condition held.  Superseded heap items are skipped when popped.
+        entry.due = due
+        heapq.heappush(self._heap, (due, next(self._sequence), entry))
+        self._condition.notify()
+
+    def every(self, period, function, name=None):
+        """
+        Run function() every period seconds.  Periods are counted from the first due time, not from when each run
+        finished, so the rate does not drift.  Missed periods are skipped and counted as overruns.
+        :param period: seconds
+        :param function:
+        :param name: default None.  Task name, which has to be unique.  If None, the function's name.
+        :return: the task name
+        """
+        name = name or function.__name__
+        with self._condition:
+            if name in self._tasks:
+                raise ValueError(f'Task {name} already exists.')
+            entry = _Entry(name, function, period=period)
+            self._tasks[name] = entry
+            self._push(entry, self._clock())
+        return name
+
+    def once(self, function, *args, delay=0.0, name=None):
+        """
+        Run function(*args) once after delay seconds.  If it returns a generator, the generator runs as a job; see the
+        module docstring.
+        :param function:
+        :param args:
+        :param delay: seconds
+        :param name: default None.  Name the job's statistics are kept under.  If None, the function's name.
+        :return: concurrent.futures.Future of the function's or generator's return value
+        """
+        future = Future()
+        entry = _Entry(name or getattr(function, '__name__', 'job'), lambda: function(*args), future=future)
+        with self._condition:
+            self._push(entry, self._clock() + delay)
+        return future
+
+    def call(self, function, *args, timeout=None):
+        """
+        Run function(*args) on the worker and wait for it, so another thread can change state the tasks share without
+        locks.  Runs on the calling thread if that is the worker or if no worker is running.
+        :param function:
+        :param args:
+        :param timeout: default None.  Seconds to wait.  If None, wait as long as it takes.
+        :return: the function's return value.  Its exception is raised here.
+        """
+        if not self._running or threading.current_thread() is self._thread:
+            return function(*args)
+        return self.once(function, *args).result(timeout)
+
+    def wake(self, name):
+        """
+        Run a fixed-rate task as soon as possible instead of waiting for its next period, which then restarts from the
+        wake up.  Safe to call from any thread, e.g. a hardware event handler.
+        :param name: task name
+        :return:
+        """
+        with self._condition:
+            entry = self._tasks.get(name)
+            now = self._clock()
+            if entry is not None and entry.due > now:
+                self._push(entry, now)
+
+    def cancel(self, name):
+        with self._condition:
+            entry = self._tasks.pop(name, None)
+            if entry is not None:
+                entry.cancelled = True
+
+    def stats(self):
+        """
+        Timing statistics of every task and job that has run.  Jitter is how late a run started after it was due.
+        :return: dict of name to TaskStats, durations in seconds
+        """
+        with self._condition:
+            return {name: TaskStats(runs, duration / runs, max_duration, jitter / runs, max_jitter, overruns)
+                    for name, (runs, duration, max_duration, jitter, max_jitter, overruns) in self._stats.items()
+                    if runs}
+
+    def _record(self, name, jitter, duration, overruns=0):
+        runs, total, max_duration, total_jitter, max_jitter, total_overruns = \
+            self._stats.get(name, (0, 0.0, 0.0, 0.0, 0.0, 0))
+        self._stats[name] = (runs + 1, total + duration, max(max_duration, duration), total_jitter + jitter,
+                             max(max_jitter, jitter), total_overruns + overruns)
+
+    def _resume(self, entry, value):
+        with self._condition:
+            entry.value = value
+            self._push(entry, self._clock())
+
+    def _run_job(self, entry):
+        try:
+            if entry.generator is None:
+                result = entry.function()
+                if not inspect.isgenerator(result):
+                    entry.future.set_result(result)
+                    return
+                entry.generator = result
+                request = next(entry.generator)
+            else:
+                value, entry.value = entry.value, None
+                request = entry.generator.send(value)
+        except StopIteration as stop:
+            entry.future.set_result(stop.value)
+            return
+        except Exception as e:
+            logging.exception(f'Job {entry.name} failed.')
+            entry.future.set_exception(e)
+            return
+
+        if isinstance(request, list):
+            _gather(request).add_done_callback(lambda gathered: self._resume(entry, gathered.result()))
+        elif hasattr(request, 'add_done_callback'):
+            request.add_done_callback(lambda future: self._resume(entry, future))
+        else:
+            with self._condition:
+                self._push(entry, self._clock() + (request or 0.0))
+
+    def run_pending(self):
+        """
+        Run everything that is due.
+        :return: seconds until the next item is due, or None if nothing is scheduled
+        """
+        while True:
+            with self._condition:
+                now = self._clock()
+                while self._heap and (self._heap[0][2].cancelled or self._heap[0][0] != self._heap[0][2].due):
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    return None
+                due, _, entry = self._heap[0]
+                if due > now:
+                    return due - now
+                heapq.heappop(self._heap)
+                overruns = 0
+                if entry.period is not None:
+                    # next slot on the original grid that is still in the future
+                    missed = int((now - due) // entry.period)
+                    overruns = missed
+                    self._push(entry, due + (missed + 1) * entry.period)
+
+            start = self._clock()
+            if entry.period is not None:
+                try:
+                    entry.function()
+                except Exception:
+                    logging.exception(f'Task {entry.name} failed.')
+            else:
+                self._run_job(entry)
+            with self._condition:
+                self._record(entry.name, start - due, self._clock() - start, overruns)
+
+    def run(self):
+        """
+        Run tasks on the calling thread until stop() is called.
+        :return:
+        """
+        self._running = True
+        while self._running:
+            self.run_pending()
+            with self._condition:
+                if not self._running:
+                    break
+                # anything scheduled since run_pending returned is on the heap, so this never oversleeps
+                wait = self._heap[0][0] - self._clock() if self._heap else None
+                if wait is None or wait > 0:
+                    self._condition.wait(wait)
+
+    def start(self):
+        """
+        Run tasks on a worker thread.
+        :return:
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+            self._thread = None
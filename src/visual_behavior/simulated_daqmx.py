@@ -0,0 +1,343 @@
+"""
+In-process stand-in for the subset of PyDAQmx used by visual_behavior.nidaqio.
+
+The module mirrors PyDAQmx's names (Task, int32, DAQError, DAQmxGetSysDevNames and the DAQmx_Val_* constants) so
+nidaqio can bind it in place of the real driver.  Every task talks to the module level SimulatedDevice, which holds
+virtual DI/DO/AO/AI lines, a per-call latency model and scriptable input waveforms.  Set NIDAQ_BACKEND=simulated
+before nidaqio is first imported to use it:
+
+    from visual_behavior import SimulatedStage, simulated_daqmx
+    stage = SimulatedStage()
+    device = simulated_daqmx.reset(clock=stage.clock)
+    device.set_latency(2e-4, 'StartTask')
+    device.set_input('port0/line5', simulated_daqmx.position_switch(lambda: stage.physical_position, 0, -5000, -1))
+"""
+import collections
+import ctypes
+import threading
+import time
+
+import numpy as np
+
+DAQmx_Val_ChanPerLine = 0
+DAQmx_Val_ChanForAllLines = 1
+DAQmx_Val_GroupByChannel = 0
+DAQmx_Val_GroupByScanNumber = 1
+DAQmx_Val_Volts = 10348
+DAQmx_Val_Rising = 10280
+DAQmx_Val_Falling = 10171
+DAQmx_Val_FiniteSamps = 10178
+DAQmx_Val_ContSamps = 10123
+DAQmx_Val_Task_Start = 0
+DAQmx_Val_Task_Stop = 1
+DAQmx_Val_Task_Verify = 2
+DAQmx_Val_Task_Commit = 3
+DAQmx_Val_Task_Reserve = 4
+DAQmx_Val_Task_Unreserve = 5
+DAQmx_Val_Task_Abort = 6
+DAQmx_Val_Auto = -1
+DAQmx_Val_Cfg_Default = -1
+DAQmx_Val_RSE = 10083
+DAQmx_Val_Diff = 10106
+
+DAQmxErrorSamplesNotYetAvailable = -200284
+DAQmxErrorSamplesNoLongerAvailable = -200279
+DAQmxErrorInvalidAttributeValue = -200077
+DAQmxErrorResourceReserved = -50103
+
+int32 = ctypes.c_int32
+
+# Rough per-call costs of a USB device, useful as a starting point for benchmarks.  They are not measurements.
+USB_LATENCY = {'StartTask': 1e-3,
+               'StopTask': 5e-4,
+               'TaskControl': 2e-3,
+               'ReadDigitalU32': 2e-4,
+               'WriteDigitalLines': 2e-4,
+               'WriteAnalogF64': 3e-4,
+               'ReadAnalogF64': 3e-4}
+
+
+class DAQError(Exception):
+    def __init__(self, error, mess='', fname=''):
+        super().__init__(f'{mess}\n in function {fname}' if fname else mess)
+        self.error = error
+        self.mess = mess
+        self.fname = fname
+
+
+def position_switch(position, axis, limit, direction, hysteresis=0.0):
+    """
+    Input source for a normally high switch that is pulled low once an axis reaches a position.
+    :param position: callable returning the current coordinates, e.g. lambda: stage.physical_position
+    :param axis: index into the coordinates
+    :param limit: position at which the switch trips
+    :param direction: -1 if the switch trips at or below limit, 1 if it trips at or above limit
+    :param hysteresis: default 0.0.  How far back past limit a tripped switch has to be moved to release.
+    :return: a source for SimulatedDevice.set_input
+    """
+    tripped = [False]
+
+    def source(t):
+        travel = (position()[axis] - limit) * direction
+        tripped[0] = travel >= 0 or (tripped[0] and travel > -hysteresis)
+        return 0 if tripped[0] else 1
+    return source
+
+
+class SimulatedDevice(object):
+    def __init__(self, name='SimDev1', latency=None, clock=time.perf_counter, default_input=1):
+        """
+        Virtual NIDAQ device shared by all simulated tasks.
+
+        Input sources are constants or callables taking a numpy array of device times (seconds since the device was
+        created) and returning a value or an array of the same shape.
+
+        :param name: device name reported by DAQmxGetSysDevNames
+        :param latency: dict of function name to seconds added to each call.  The 'default' key applies to every
+        other call.
+        :param clock: monotonic time source in seconds
+        :param default_input: level of digital inputs without a source.  Defaults high like a pulled-up switch.
+        """
+        self.name = name
+        self.latency = dict(latency or {})
+        self.clock = clock
+        self.default_input = default_input
+        self.epoch = clock()
+        self.inputs = {}
+        self.outputs = {}
+        self.writes = collections.deque(maxlen=10000)
+        self.calls = collections.Counter()
+        # line or channel to the task that has it reserved.  Starting or committing a task reserves its lines until it
+        # is stopped, or for a committed task until it is cleared or unreserved, like the driver does.
+        self.reservations = {}
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self.clock() - self.epoch
+
+    def set_latency(self, seconds, call='default'):
+        self.latency[call] = seconds
+
+    def set_input(self, channel, source):
+        """
+        Script an input line or analog input channel.
+        :param channel: physical channel without the device name, e.g. 'port0/line5' or 'ai6'
+        :param source: constant or callable of device time
+        :return:
+        """
+        self.inputs[channel] = source
+
+    def sample(self, channel, times):
+        source = self.inputs.get(channel, self.default_input if '/line' in channel else 0.0)
+        if callable(source):
+            source = source(times)
+        return np.broadcast_to(np.asarray(source), np.shape(times))
+
+    def output(self, channel, value):
+        with self._lock:
+            self.outputs[channel] = value
+            self.writes.append((self.time(), channel, value))
+
+    def call(self, name):
+        self.calls[name] += 1
+        delay = self.latency.get(name, self.latency.get('default', 0))
+        if delay:
+            time.sleep(delay)
+
+
+device = SimulatedDevice()
+
+
+def reset(**kwargs):
+    """
+    Replace the shared device with a fresh one.  Tasks created afterwards use the new device.
+    :param kwargs: see SimulatedDevice
+    :return: the new device
+    """
+    global device
+    device = SimulatedDevice(**kwargs)
+    return device
+
+
+def DAQmxGetSysDevNames(buffer, buffer_size):
+    device.call('DAQmxGetSysDevNames')
+    buffer.value = device.name.encode()[:buffer_size - 1]
+    return 0
+
+
+def _expand_lines(channel):
+    port, _, line = channel.partition('/line')
+    if line:
+        return [channel]
+    return [f'{port}/line{i}' for i in range(8)]
+
+
+class Task(object):
+    def __init__(self, TaskName=''):
+        self._device = device
+        self._name = TaskName
+        self._kind = None
+        self._channels = []
+        self._running = False
+        self._committed = False
+        self._rate = None
+        self._buffer_size = None
+        self._start_time = None
+        self._samples_consumed = 0
+
+    def _add_channels(self, kind, physical_channel):
+        if self._kind not in (None, kind):
+            raise DAQError(DAQmxErrorInvalidAttributeValue, f'Cannot add {kind} channels to a {self._kind} task.',
+                           'DAQmxCreateChan')
+        self._kind = kind
+        for channel in physical_channel.decode().split(','):
+            device_name, _, name = channel.strip().partition('/')
+            if device_name != self._device.name:
+                raise DAQError(DAQmxErrorInvalidAttributeValue, f'Device {device_name} not found.', 'DAQmxCreateChan')
+            self._channels.append(name)
+
+    def CreateDIChan(self, lines, nameToAssignToLines, lineGrouping):
+        self._device.call('CreateDIChan')
+        self._add_channels('di', lines)
+
+    def CreateDOChan(self, lines, nameToAssignToLines, lineGrouping):
+        self._device.call('CreateDOChan')
+        self._add_channels('do', lines)
+
+    def CreateAOVoltageChan(self, physicalChannel, nameToAssignToChannel, minVal, maxVal, units, customScaleName):
+        self._device.call('CreateAOVoltageChan')
+        self._add_channels('ao', physicalChannel)
+
+    def CreateAIVoltageChan(self, physicalChannel, nameToAssignToChannel, terminalConfig, minVal, maxVal, units,
+                            customScaleName):
+        self._device.call('CreateAIVoltageChan')
+        self._add_channels('ai', physicalChannel)
+
+    def CfgSampClkTiming(self, source, rate, activeEdge, sampleMode, sampsPerChan):
+        self._device.call('CfgSampClkTiming')
+        self._rate = float(rate)
+        self._buffer_size = int(sampsPerChan)
+
+    def _lines(self):
+        return [line for channel in self._channels for line in _expand_lines(channel)]
+
+    def _reserve(self, fname):
+        with self._device._lock:
+            for line in self._lines():
+                owner = self._device.reservations.get(line)
+                if owner is not None and owner is not self:
+                    raise DAQError(DAQmxErrorResourceReserved, f'Resource {line} is reserved by another task.', fname)
+            for line in self._lines():
+                self._device.reservations[line] = self
+
+    def _unreserve(self):
+        with self._device._lock:
+            for line in self._lines():
+                if self._device.reservations.get(line) is self:
+                    del self._device.reservations[line]
+
+    def TaskControl(self, action):
+        self._device.call('TaskControl')
+        if action == DAQmx_Val_Task_Commit:
+            self._reserve('DAQmxTaskControl')
+            self._committed = True
+        elif action in (DAQmx_Val_Task_Unreserve, DAQmx_Val_Task_Abort):
+            self._committed = False
+            self._running = False
+            self._unreserve()
+
+    def StartTask(self):
+        self._device.call('StartTask')
+        self._reserve('DAQmxStartTask')
+        self._running = True
+        self._start_time = self._device.time()
+        self._samples_consumed = 0
+
+    def StopTask(self):
+        self._device.call('StopTask')
+        self._running = False
+        if not self._committed:
+            self._unreserve()
+
+    def ClearTask(self):
+        self._device.call('ClearTask')
+        self._running = False
+        self._committed = False
+        self._unreserve()
+        self._channels = []
+
+    def _sample_times(self, num_samps, timeout):
+        """
+        Device times of the next num_samps samples.  Continuous tasks wait for the sample clock like the driver does.
+        """
+        if self._rate is None or not self._running:
+            return np.full(num_samps, self._device.time())
+
+        if self._buffer_size and (self._device.time() - self._start_time) * self._rate - \
+                self._samples_consumed > self._buffer_size:
+            raise DAQError(DAQmxErrorSamplesNoLongerAvailable, 'Samples are no longer available.', 'DAQmxRead')
+        ready = self._start_time + (self._samples_consumed + num_samps) / self._rate
+        wait = ready - self._device.time()
+        if wait > 0:
+            if timeout >= 0 and wait > timeout:
+                time.sleep(timeout)
+                raise DAQError(DAQmxErrorSamplesNotYetAvailable, 'Samples are not yet available.', 'DAQmxRead')
+            time.sleep(wait)
+        times = self._start_time + (self._samples_consumed + np.arange(num_samps)) / self._rate
+        self._samples_consumed += num_samps
+        return times
+
+    def ReadDigitalU32(self, numSampsPerChan, timeout, fillMode, readArray, arraySizeInSamps, sampsPerChanRead,
+                       reserved):
+        self._device.call('ReadDigitalU32')
+        num_samps = 1 if numSampsPerChan == DAQmx_Val_Auto and self._rate is None else numSampsPerChan
+        num_samps = min(num_samps, arraySizeInSamps)
+        times = self._sample_times(num_samps, timeout)
+        value = np.zeros(num_samps, dtype=np.uint32)
+        for channel in self._channels:
+            for line in _expand_lines(channel):
+                level = self._device.sample(line, times).astype(np.uint32) & 1
+                value |= level << np.uint32(int(line.rsplit('line', 1)[1]))
+        readArray[:num_samps] = value
+        sampsPerChanRead._obj.value = num_samps
+        return 0
+
+    def ReadAnalogF64(self, numSampsPerChan, timeout, fillMode, readArray, arraySizeInSamps, sampsPerChanRead,
+                      reserved):
+        self._device.call('ReadAnalogF64')
+        count = len(self._channels)
+        num_samps = 1 if numSampsPerChan == DAQmx_Val_Auto and self._rate is None else numSampsPerChan
+        num_samps = min(num_samps, arraySizeInSamps // count)
+        times = self._sample_times(num_samps, timeout)
+        values = np.stack([self._device.sample(channel, times).astype(np.float64) for channel in self._channels])
+        if fillMode == DAQmx_Val_GroupByScanNumber:
+            values = values.T
+        readArray.reshape(-1)[:values.size] = values.ravel()
+        sampsPerChanRead._obj.value = num_samps
+        return 0
+
+    def WriteDigitalLines(self, numSampsPerChan, autoStart, timeout, dataLayout, writeArray, sampsPerChanWritten,
+                          reserved):
+        self._device.call('WriteDigitalLines')
+        lines = [line for channel in self._channels for line in _expand_lines(channel)]
+        data = np.asarray(writeArray)
+        for index, line in enumerate(lines):
+            if dataLayout == DAQmx_Val_GroupByScanNumber:
+                value = data[(numSampsPerChan - 1) * len(lines) + index]
+            else:
+                value = data[index * numSampsPerChan + numSampsPerChan - 1]
+            self._device.output(line, int(value))
+        return 0
+
+    def WriteAnalogF64(self, numSampsPerChan, autoStart, timeout, dataLayout, writeArray, sampsPerChanWritten,
+                       reserved):
+        self._device.call('WriteAnalogF64')
+        data = np.asarray(writeArray).ravel()
+        count = len(self._channels)
+        for index, channel in enumerate(self._channels):
+            if dataLayout == DAQmx_Val_GroupByScanNumber:
+                value = data[(numSampsPerChan - 1) * count + index]
+            else:
+                value = data[index * numSampsPerChan + numSampsPerChan - 1]
+            self._device.output(channel, float(value))
+        return 0
@@ -0,0 +1,288 @@
+"""
+Stand-in for the parts of Phidget22.Devices.Stepper used by stage.PhidgetStage.
+
+Steppers are integrated on a VirtualClock instead of moving in real time: nothing happens until step() is called, so
+a simulation can run as fast as the integration allows.  Events are fired from step(), on the caller's thread, in the
+order the Phidget library fires them: position change, velocity change, stopped.
+"""
+import logging
+import math
+import threading
+import time
+
+from Phidget22.ErrorCode import ErrorCode
+from Phidget22.PhidgetException import PhidgetException
+
+
+class VirtualClock(object):
+    def __init__(self, start=0.0):
+        """
+        Manually advanced time source.  Instances are callable like time.perf_counter, so they can be handed to
+        anything that takes a clock, e.g. simulated_daqmx.SimulatedDevice.
+        :param start: initial time in seconds
+        """
+        self._time = float(start)
+
+    def __call__(self):
+        return self._time
+
+    def advance(self, seconds):
+        if seconds < 0:
+            raise ValueError(f'Invalid time step: {seconds}.  Virtual time cannot run backwards.')
+        self._time += seconds
+        return self._time
+
+
+class SimulatedPhidgetException(PhidgetException):
+    def __init__(self, code, details=''):
+        """
+        PhidgetException raised by the simulated devices, so callers handle their errors like the library's.  The base
+        constructor looks the description up in the Phidget library, which a simulation may not have.
+        :param code: Phidget22.ErrorCode value
+        :param details:
+        """
+        Exception.__init__(self, code)
+        self.code = code
+        self.description = ''
+        self.details = details
+
+
+class SimulatedStepper(object):
+    def __init__(self, clock, serial=12345, velocity_limit=(0.0, 10000.0), acceleration=(1.0, 100000.0),
+                 data_interval=0.008, latency=0.0, attach_delay=0.0):
+        """
+        Position controlled stepper with a trapezoidal velocity profile.
+
+        Each step accelerates toward the fastest velocity from which the motor can still stop at its target, limited by
+        the velocity limit.  The motor only moves while engaged; disengaging stops it at once, like a free shaft.
+
+        :param clock: VirtualClock
+        :param serial: device serial number reported by getDeviceSerialNumber
+        :param velocity_limit: (min, max) velocity limit the device accepts
+        :param acceleration: (min, max) acceleration the device accepts
+        :param data_interval: seconds between position and velocity change events while moving
+        :param latency: wall clock seconds every set call blocks for, to model USB round trips
+        :param attach_delay: wall clock seconds from open until the device attaches.  None never attaches.
+        """
+        self._clock = clock
+        self.latency = latency
+        self.attach_delay = attach_delay
+        self._serial = serial
+        self._channel = 0
+        self._velocity_range = velocity_limit
+        self._acceleration_range = acceleration
+        self._data_interval = data_interval
+        self._attached = False
+        self._engaged = False
+        self._position = 0.0
+        self._offset = 0.0
+        self._target = 0.0
+        self._velocity = 0.0
+        self._velocity_limit = velocity_limit[1]
+        self._acceleration = acceleration[1]
+        self._moving = False
+        self._last_event = None
+        self._reported_position = 0.0
+        self._reported_velocity = 0.0
+        self._handlers = {}
+
+    # Phidget22 Stepper interface
+
+    def setChannel(self, channel):
+        self._channel = channel
+
+    def getChannel(self):
+        return self._channel
+
+    def setDeviceSerialNumber(self, serial):
+        self._serial = serial
+
+    def getDeviceSerialNumber(self):
+        return self._serial
+
+    def setOnAttachHandler(self, handler):
+        self._handlers['attach'] = handler
+
+    def setOnDetachHandler(self, handler):
+        self._handlers['detach'] = handler
+
+    def setOnErrorHandler(self, handler):
+        self._handlers['error'] = handler
+
+    def setOnStoppedHandler(self, handler):
+        self._handlers['stopped'] = handler
+
+    def setOnVelocityChangeHandler(self, handler):
+        self._handlers['velocity'] = handler
+
+    def setOnPositionChangeHandler(self, handler):
+        self._handlers['position'] = handler
+
+    def _attach(self):
+        self._attached = True
+        self._fire('attach')
+
+    def open(self):
+        if self.attach_delay is None:
+            return
+        if self.attach_delay:
+            threading.Timer(self.attach_delay, self._attach).start()
+        else:
+            self._attach()
+
+    def openWaitForAttachment(self, timeout):
+        if self.attach_delay is None or self.attach_delay * 1000.0 > timeout:
+            time.sleep(timeout / 1000.0)
+            raise SimulatedPhidgetException(ErrorCode.EPHIDGET_TIMEOUT,
+                                            f'Channel {self._channel} did not attach within {timeout} ms.')
+        time.sleep(self.attach_delay)
+        self._attach()
+
+    def getAttached(self):
+        return self._attached
+
+    def close(self):
+        self._engaged = False
+        self._velocity = 0.0
+        self._moving = False
+        if self._attached:
+            self._attached = False
+            self._fire('detach')
+
+    def setDataInterval(self, interval):
+        self._data_interval = interval / 1000.0
+
+    def getDataInterval(self):
+        return self._data_interval * 1000.0
+
+    def setEngaged(self, engaged):
+        self._delay()
+        self._engaged = bool(engaged)
+        if not self._engaged and self._velocity:
+            self._velocity = 0.0
+            self._report(force=True)
+        self._update_moving()
+
+    def getEngaged(self):
+        return self._engaged
+
+    def setVelocityLimit(self, velocity):
+        self._delay()
+        self._velocity_limit = min(max(velocity, self._velocity_range[0]), self._velocity_range[1])
+
+    def getVelocityLimit(self):
+        return self._velocity_limit
+
+    def getMinVelocityLimit(self):
+        return self._velocity_range[0]
+
+    def getMaxVelocityLimit(self):
+        return self._velocity_range[1]
+
+    def setAcceleration(self, acceleration):
+        self._delay()
+        self._acceleration = min(max(acceleration, self._acceleration_range[0]), self._acceleration_range[1])
+
+    def getAcceleration(self):
+        return self._acceleration
+
+    def getMinAcceleration(self):
+        return self._acceleration_range[0]
+
+    def getMaxAcceleration(self):
+        return self._acceleration_range[1]
+
+    def setTargetPosition(self, position):
+        self._delay()
+        self._target = position - self._offset
+
+    def getTargetPosition(self):
+        return self._target + self._offset
+
+    def getPosition(self):
+        return self._position + self._offset
+
+    def getVelocity(self):
+        return self._velocity
+
+    def getIsMoving(self):
+        return self._moving
+
+    def addPositionOffset(self, offset):
+        self._offset += offset
+        self._reported_position += offset
+
+    # simulation
+
+    @property
+    def physical_position(self):
+        """
+        Position without the offsets added by addPositionOffset, i.e. where the axis actually is.
+        :return:
+        """
+        return self._position
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _fire(self, event, *args):
+        handler = self._handlers.get(event)
+        if handler is not None:
+            # like the Phidget library, an exception in a handler is reported but never reaches the caller
+            try:
+                handler(self, *args)
+            except Exception:
+                logging.exception(f'{event} handler of channel {self._channel} failed.')
+
+    def _update_moving(self):
+        moving = self._velocity != 0.0 or \
+            (self._engaged and self._velocity_limit > 0 and self._position != self._target)
+        if self._moving and not moving:
+            self._moving = False
+            self._fire('stopped')
+        self._moving = moving
+
+    def _report(self, force=False):
+        now = self._clock()
+        if not force and self._last_event is not None and now - self._last_event < self._data_interval:
+            return
+        self._last_event = now
+        position = self.getPosition()
+        if position != self._reported_position:
+            self._reported_position = position
+            self._fire('position', position)
+        if self._velocity != self._reported_velocity:
+            self._reported_velocity = self._velocity
+            self._fire('velocity', self._velocity)
+
+    def step(self, dt):
+        """
+        Integrate the motor over dt seconds ending at the current clock time and fire any events that fall due.
+        :param dt: seconds
+        :return:
+        """
+        if not self._attached or not self._engaged:
+            return
+        distance = self._target - self._position
+        if distance == 0.0 and self._velocity == 0.0:
+            return
+
+        acceleration = self._acceleration
+        dv = acceleration * dt
+        # fastest velocity from which the motor can still stop at the target one step from now
+        reachable = math.sqrt(dv * dv + 2.0 * acceleration * abs(distance)) - dv
+        desired = math.copysign(min(self._velocity_limit, reachable), distance)
+        velocity = self._velocity + max(-dv, min(dv, desired - self._velocity))
+        position = self._position + 0.5 * (self._velocity + velocity) * dt
+
+        if (self._target - position) * distance <= 0 and abs(velocity) <= 2.0 * dv:
+            # reached the target slowly enough to stop within a step
+            self._position = self._target
+            self._velocity = 0.0
+            self._report(force=True)
+        else:
+            self._position = position
+            self._velocity = velocity
+            self._report()
+        self._update_moving()
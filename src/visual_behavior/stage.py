@@ -2,14 +2,36 @@ import os.path
 import platform
 import threading
 import logging
+import math
 from Phidget22.Devices.Stepper import *
 from Phidget22.Net import *
 from abc import abstractmethod
 from .exceptions import *
+from . import trajectory
+from .simulated_phidget import VirtualClock, SimulatedStepper
 import asyncio
-from queue import Queue
+from collections import namedtuple, deque
+from concurrent.futures import Future
+from queue import Queue, Empty
 import time
 
+StageState = namedtuple('StageState', ['position', 'velocity', 'is_moving', 'is_engaged', 'timestamp'])
+_QueuedMove = namedtuple('_QueuedMove', ['coordinates', 'arrival', 'epoch'])
+
+
+class _Jog(object):
+    """
+    Relative move of one axis waiting in the motion queue.  Jogs of the same axis queued before it is dispatched are
+    added to delta instead of queueing behind it.
+    """
+    __slots__ = ('axis', 'delta', 'epoch')
+
+    def __init__(self, axis, delta, epoch):
+        self.axis = axis
+        self.delta = delta
+        self.epoch = epoch
+
+
 class Stage(object):
     def __init__(self):
         pass
@@ -70,61 +92,62 @@ class Stage(object):
         """
 
 
-class MockStage(Stage):
-    def __init__(self, serial=12345):
-        super().__init__()
-        logging.info(f'Initializing {self.__name__}')
-        self._serial = serial
-        self._queue = Queue()
-        self._position = [0, 0, 0]
-        self._axes = [None, None, None]
-
-    @property
-    def initialized(self):
-        return True
-
-    def append_move(self, coordinates):
-        if not self._validate_coordinates(coordinates):
-            return
-        self._queue.put(coordinates)
-
-    def move_to(self, coordinates):
-        if not self._validate_coordinates(coordinates):
-            return
-        self._position = list(coordinates)
-
-    @property
-    def position(self):
-        if not self._queue.empty():
-            self._position = self._queue.get()
-        return tuple(self._position())
-
-    @property
-    def serial(self):
-        return self._serial
-
-    @staticmethod
-    def _validate_coordinates(coordinates):
-        if not isinstance(coordinates, (list, tuple)) or len(coordinates) != 3:
-            logging.error(f'Expected coordinates to be list-like of length 3')
-            return False
-
-        return True
-
-
-
-
 class PhidgetStage(Stage):
-    def __init__(self, serial=0, x_channel=0, y_channel=1, z_channel=3):
+    def __init__(self, serial=0, x_channel=0, y_channel=1, z_channel=3, velocity_limit=200.0, acceleration=2500.0,
+                 clock=time.perf_counter, data_interval=0.008):
         """
 
         :param serial:
         :param x_channel:
         :param y_channel:
         :param z_channel:
+        :param velocity_limit: velocity limit of every axis in stage units per second
+        :param acceleration: acceleration limit of every axis in stage units per second squared
+        :param clock: time source for state timestamps
+        :param data_interval: seconds between the position and velocity change events of a moving axis, set on every
+        axis when it attaches.  The cached state is up to this old.
         """
         super().__init__()
+        self._load_drivers()
+
+        self._connected = False
+        self._serial = serial
+        self._clock = clock
+        self.data_interval = data_interval
+        self._channels = [x_channel, y_channel, z_channel]
+        self._axes = [self._create_stepper(index) for index in range(len(self._channels))]
+        self._initialized = [False] * 3
+        self._position_changed_callback = None
+        self.velocity_limit = velocity_limit
+        self.acceleration_limit = acceleration
+        self._min_velocity = [0.0] * 3
+        self._min_acceleration = [0.0] * 3
+        self.last_plan = None
+        self._queue_active = False
+        self._queue = Queue()
+
+        # _state is an immutable snapshot kept current by the steppers' position, velocity and stopped events.  Readers
+        # take it without locking; writers replace it while holding _motion_condition.  The condition is notified
+        # whenever an axis settles or a move is queued so process_queue never has to poll.
+        self._motion_condition = threading.Condition()
+        self._state = StageState((0.0,) * 3, (0.0,) * 3, (False,) * 3, (False,) * 3, self._clock())
+        self._idle_engaged = False
+        # jog coalescing: the queued, not yet dispatched jog of each axis and the target of each axis' running jog
+        self._pending_jogs = [None] * 3
+        self._jog_target = [None] * 3
+        # Future of the move in progress, resolved with the state snapshot once every axis has settled
+        self._arrival = None
+        self._motion_listeners = []
+        # priority lane: stop_motion bumps the epoch without waiting for _motion_condition, and moves requested under an
+        # older epoch are dropped at dispatch or abandoned mid-dispatch
+        self._halt_epoch = 0
+        self.stop_latencies = deque(maxlen=1000)
+        # recent (timestamp, position) of each axis from the position events, see position_at()
+        self._position_history = [deque(maxlen=256) for _ in self._channels]
+
 
+    @staticmethod
+    def _load_drivers():
         # Load drivers dependent on system architecture
         __arch = platform.architecture()
         if __arch[0] == '64bit':
@@ -133,15 +156,16 @@ class PhidgetStage(Stage):
             __drivers = os.path.abspath('drivers/x86')
         os.environ['PATH'] = __drivers + ";" + os.environ['PATH']
 
-        self._connected = False
-        self._serial = serial
-        self._channels = [x_channel, y_channel, z_channel]
-        self._axes = [Stepper(), Stepper(), Stepper()]
-        self._initialized = [False] * 3
-        self._position_changed_callback = None
-        self._queue_active = False
-        self._queue = Queue()
+    def _create_stepper(self, index):
+        return Stepper()
 
+    @property
+    def clock(self):
+        """
+        Time source of state timestamps and position_at().
+        :return:
+        """
+        return self._clock
 
     @property
     def serial(self):
@@ -184,10 +208,7 @@ class PhidgetStage(Stage):
 
     @property
     def velocity(self):
-        velocity = []
-        for axis in self._axes:
-            velocity.append(axis.getVelocity())
-        return velocity
+        return list(self._state.velocity)
 
     @property
     def acceleration(self):
@@ -213,13 +234,42 @@ class PhidgetStage(Stage):
     @property
     def position(self):
         """
+        Cached position of each axis.  See state().
+        :return:
+        """
+        return list(self._state.position)
 
+    def state(self, refresh=False):
+        """
+        Snapshot of position, velocity, motion and engagement of every axis as kept current by the stepper events.
+        :param refresh: default False.  If True, read every axis from the hardware first.
+        :return: StageState.  timestamp is the clock time of the last update.
+        """
+        if refresh:
+            try:
+                with self._motion_condition:
+                    self._state = StageState(tuple(axis.getPosition() for axis in self._axes),
+                                             tuple(axis.getVelocity() for axis in self._axes),
+                                             tuple(axis.getIsMoving() for axis in self._axes),
+                                             tuple(axis.getEngaged() for axis in self._axes),
+                                             self._clock())
+            except PhidgetException as e:
+                self._phidget_error_event(e)
+                raise StageNotConnectedError
+        return self._state
+
+    def _update_axis(self, index, **fields):
+        """
+        Replace one axis' entries in the state snapshot.
+        :param index: axis index
+        :param fields: StageState field names and new values for the axis
         :return:
         """
-        coords = []
-        for axis in self._axes:
-            coords.append(axis.getPosition())
-        return coords
+        with self._motion_condition:
+            state = self._state
+            updates = {name: tuple(value if i == index else old for i, old in enumerate(getattr(state, name)))
+                       for name, value in fields.items()}
+            self._state = state._replace(timestamp=self._clock(), **updates)
 
     @property
     def position_changed_callback(self):
@@ -231,34 +281,185 @@ class PhidgetStage(Stage):
 
     @position_changed_callback.setter
     def position_changed_callback(self, callback):
-        for axis in self._axes:
-            axis.setOnPositionChangeHandler(callback)
+        """
+        Called as callback(stepper, position) on every position change of any axis.
+        :param callback:
+        :return:
+        """
+        self._position_changed_callback = callback
 
-    def initialize_axis(self, axis):
+    def position_at(self, axis, timestamp):
+        """
+        Position of an axis at a past time, interpolated between its position events.  Used to latch where an axis was
+        when an event such as a limit switch edge happened, regardless of how late the event is handled.
+        :param axis: axis index
+        :param timestamp: time on the stage clock
+        :return: interpolated position.  Before the recorded span, the oldest recorded position; after it, the newest
+        one extrapolated with the current velocity.  A moving axis reports every data_interval, so while events are
+        handled promptly the extrapolation spans at most about one data interval.
         """
+        history = list(self._position_history[axis])
+        if not history:
+            return self._state.position[axis]
+        previous = history[0]
+        if timestamp <= previous[0]:
+            return previous[1]
+        for current in history[1:]:
+            if timestamp <= current[0]:
+                fraction = (timestamp - previous[0]) / (current[0] - previous[0])
+                return previous[1] + fraction * (current[1] - previous[1])
+            previous = current
+        # the event may be handled before the next position event arrives
+        return previous[1] + self._state.velocity[axis] * (timestamp - previous[0])
+
+    def _axis_position_changed(self, index, stepper, position):
+        self._position_history[index].append((self._clock(), position))
+        self._update_axis(index, position=position)
+        if self._position_changed_callback:
+            self._position_changed_callback(stepper, position)
+
+    def _axis_stopped(self, index):
+        with self._motion_condition:
+            self._update_axis(index, is_moving=False, velocity=0.0)
+            self._jog_target[index] = None
+            self._settled()
+            self._notify()
+
+    def _settled(self):
+        # resolve the arrival of the current move once nothing is moving any more
+        if self._arrival is not None and not any(self._state.is_moving):
+            arrival, self._arrival = self._arrival, None
+            if not arrival.done():
+                arrival.set_result(self._state)
+
+    def _cancel_arrival(self):
+        arrival, self._arrival = self._arrival, None
+        if arrival is not None:
+            arrival.cancel()
+
+    def _notify(self):
+        # call with _motion_condition held
+        self._motion_condition.notify_all()
+        for listener in self._motion_listeners:
+            listener()
+
+    def add_motion_listener(self, listener):
+        """
+        Called as listener() with no arguments whenever an axis settles or the queue changes, i.e. whenever
+        process_queue would wake up.  Listeners run on the thread that caused the change, typically a Phidget event
+        thread, and must not block.
+        :param listener:
+        :return:
+        """
+        with self._motion_condition:
+            self._motion_listeners.append(listener)
 
-        :param axis:
+    def remove_motion_listener(self, listener):
+        with self._motion_condition:
+            self._motion_listeners.remove(listener)
+
+    def set_engaged(self, axis, engaged):
+        """
+        Engage or disengage one axis and keep the cached state in step.
+        :param axis: axis index
+        :param engaged:
         :return:
         """
-        print(f'initializing axis {axis}')
-        index = axis
+        self._axes[axis].setEngaged(engaged)
+        self._update_axis(axis, is_engaged=bool(engaged))
+
+    def _prepare_axis(self, index, on_attach=None):
         axis = self._axes[index]
         #axis.setDeviceSerialNumber(self._serial)
         axis.setChannel(self._channels[index])
-        axis.setOnAttachHandler(self._phidget_stepper_attached)
+        axis.setOnAttachHandler(on_attach or self._phidget_stepper_attached)
         axis.setOnDetachHandler(self._phidget_stepper_detached)
         axis.setOnErrorHandler(self._phidget_error_event)
+        axis.setOnStoppedHandler(lambda stepper, index=index: self._axis_stopped(index))
+        axis.setOnVelocityChangeHandler(
+            lambda stepper, velocity, index=index: self._update_axis(index, velocity=velocity))
+        axis.setOnPositionChangeHandler(
+            lambda stepper, position, index=index: self._axis_position_changed(index, stepper, position))
+
+    def _configure_axis(self, index):
+        axis = self._axes[index]
+        axis.setDataInterval(int(round(self.data_interval * 1000)))
+        axis.setVelocityLimit(self.velocity_limit)
+        axis.setAcceleration(self.acceleration_limit)
+        self._min_velocity[index] = axis.getMinVelocityLimit()
+        self._min_acceleration[index] = axis.getMinAcceleration()
+        self._update_axis(index, position=axis.getPosition(), is_engaged=axis.getEngaged())
+        self._initialized[index] = True
+
+    def initialize_axis(self, axis):
+        """
+
+        :param axis:
+        :return:
+        """
+        print(f'initializing axis {axis}')
+        index = axis
+        axis = self._axes[index]
+        self._prepare_axis(index)
         axis_label = chr(ord('x') + index)
         try:
             axis.openWaitForAttachment(1000)
             logging.info(f'Axis "{axis_label}" connected')
         except PhidgetException as e:
             self._phidget_error_event(e)
-            raise InitializationError
+            raise InitializationError({axis_label: e.details})
+
+        self._configure_axis(index)
+
+    def initialize_axes(self, timeout=1000):
+        """
+        Open every axis at once and wait for all of them to attach within one timeout, so start up takes about one
+        attach time instead of one per axis.  The stage serial is taken from the attached board.
+        :param timeout: milliseconds to wait for all axes together
+        :return:
+        """
+        attached = [threading.Event() for _ in self._axes]
+
+        def on_attach(stepper, event):
+            self._phidget_stepper_attached(stepper)
+            event.set()
+
+        failures = {}
+        for index, axis in enumerate(self._axes):
+            self._prepare_axis(index, on_attach=lambda stepper, event=attached[index]: on_attach(stepper, event))
+            try:
+                axis.open()
+            except PhidgetException as e:
+                failures[chr(ord('x') + index)] = e.details
+
+        deadline = time.perf_counter() + timeout / 1000.0
+        for index, event in enumerate(attached):
+            axis_label = chr(ord('x') + index)
+            if axis_label in failures:
+                continue
+            if not event.wait(max(0.0, deadline - time.perf_counter())):
+                failures[axis_label] = f'channel {self._channels[index]} did not attach within {timeout} ms'
+                continue
+            try:
+                self._configure_axis(index)
+                logging.info(f'Axis "{axis_label}" connected')
+            except PhidgetException as e:
+                failures[axis_label] = e.details
 
+        if failures:
+            for axis in self._axes:
+                try:
+                    axis.close()
+                except PhidgetException:
+                    pass
+            error = InitializationError(failures)
+            logging.error(error.message)
+            raise error
 
-        axis.setVelocityLimit(200.0)
-        axis.setAcceleration(2500.0)
+        serials = {axis.getDeviceSerialNumber() for axis in self._axes}
+        if len(serials) > 1:
+            logging.warning(f'Stage axes are attached to different boards: {sorted(serials)}')
+        self._serial = self._axes[0].getDeviceSerialNumber()
 
     def _initialize_motion_queue(self):
         """
@@ -266,59 +467,182 @@ class PhidgetStage(Stage):
         :return:
         """
         self._queue_active = True
-        self._queue_thread = threading.Thread(target=self._motion_queue)
+        self._queue_thread = threading.Thread(target=self.process_queue)
         self._queue_thread.start()
 
-    def zero_axes(self):
+    def zero_axes(self, origin=None):
         """
-
+        Disengage every axis and shift the coordinates so origin becomes zero.
+        :param origin: default None.  Current coordinates of the new origin, one per axis.  None, or a None entry, uses
+        the axis' current position.
         :return:
         """
+        origin = origin or [None] * len(self._axes)
         try:
-            for a in self._axes:
-                a.setEngaged(0)
-                a.addPositionOffset(-a.getPosition())
+            for index, a in enumerate(self._axes):
+                self.set_engaged(index, False)
+                a.addPositionOffset(-(a.getPosition() if origin[index] is None else origin[index]))
+                self._position_history[index].clear()
+                self._update_axis(index, position=a.getPosition())
         except PhidgetException as e:
             self._phidget_error_event(e)
             raise StageNotConnectedError
 
-    def move_to(self, coordinates):
+    def plan_move(self, coordinates, velocity=None):
         """
-
+        Plan a synchronized straight line move from the cached position.  See trajectory.plan_move.
         :param coordinates:
-        :return:
+        :param velocity: default None.  Velocity limit of this move in place of velocity_limit.
+        :return: trajectory.MotionPlan.  duration is the predicted move time in seconds.
         """
         if not isinstance(coordinates, (list, tuple)) or len(coordinates) != len(self._axes):
             logging.error(f'Expected coordinates to be list-like of length {len(self._axes)}')
             raise InvalidCoordinatesError
-       # ax = [self._axes[0], self._axes[2]]
+        return trajectory.plan_move(self._state.position, coordinates,
+                                    self.velocity_limit if velocity is None else velocity, self.acceleration_limit,
+                                    self._min_velocity, self._min_acceleration)
+
+    def move_to(self, coordinates, arrival=None, epoch=None, velocity=None):
+        """
+        Move every axis to coordinates along a straight line so all axes arrive together.
+        :param coordinates:
+        :param arrival: default None.  concurrent.futures.Future resolved with the state snapshot once every axis has
+        settled, or cancelled if the move is stopped or superseded.
+        :param epoch: default None.  halt_epoch the move was requested under.  If the stage has been stopped since, the
+        move is dropped.
+        :param velocity: default None.  Velocity limit of this move in place of velocity_limit.
+        :return: the trajectory.MotionPlan used for the move
+        """
+        plan = self.plan_move(coordinates, velocity)
         try:
-            print('moving to', coordinates)
-            for index, axis in enumerate(self._axes):
-                axis.setEngaged(True)
-                axis.setTargetPosition(coordinates[index])
+            logging.debug(f'moving to {coordinates}')
+            with self._motion_condition:
+                if epoch is None:
+                    epoch = self._halt_epoch
+                self._cancel_arrival()
+                for index, axis in enumerate(self._axes):
+                    if epoch != self._halt_epoch:
+                        break
+                    axis.setVelocityLimit(plan.velocity[index])
+                    axis.setAcceleration(plan.acceleration[index])
+                    self.set_engaged(index, True)
+                    if self._state.position[index] != coordinates[index]:
+                        # cleared by the stopped event; an axis already at its target never fires one
+                        self._update_axis(index, is_moving=True)
+                    axis.setTargetPosition(coordinates[index])
+                # installed only now, so a stopped event fired while the first axes are engaged cannot resolve it
+                # before the later axes are marked moving
+                self._arrival = arrival
+                if epoch != self._halt_epoch:
+                    # stopped while dispatching; undo anything engaged after the stop went out
+                    self._abandon_move()
+                    return plan
+                self._idle_engaged = True
+                self.last_plan = plan
+                self._settled()
 
         except PhidgetException as e:
             print('dafuq')
             logging.error(e)
+            with self._motion_condition:
+                if arrival is not None and not arrival.done():
+                    arrival.set_exception(e)
+                if self._arrival is arrival:
+                    self._arrival = None
+        return plan
 
     def append_move(self, coordinates):
         """
 
         :param coordinates:
-        :return:
+        :return: concurrent.futures.Future resolved with the state snapshot once the move has arrived, or cancelled if
+        the queue is stopped first
         """
         if not isinstance(coordinates, (list, tuple)) or len(coordinates) != len(self._axes):
             logging.error(f'Expected coordinates to be list-like of length {len(self._axes)}')
             raise InvalidCoordinatesError
+        arrival = Future()
         try:
-            self._queue.put(coordinates)
+            with self._motion_condition:
+                self._queue.put(_QueuedMove(coordinates, arrival, self._halt_epoch))
+                self._notify()
         except Exception:
             raise StageNotConnectedError
+        return arrival
+
+    def jog(self, axis, delta):
+        """
+        Move one axis by delta relative to where it is headed.  While the axis is running a jog, the delta is added to
+        that jog's target on the fly, so a held key is one continuous move rather than a backlog of steps.  Otherwise
+        the jog is queued like append_move, merging with a jog of the same axis that is still waiting in the queue.
+        :param axis: axis index
+        :param delta: relative distance
+        :return:
+        """
+        try:
+            with self._motion_condition:
+                if self._jog_target[axis] is not None and self._state.is_moving[axis]:
+                    self._jog_target[axis] += delta
+                    self._axes[axis].setTargetPosition(self._jog_target[axis])
+                elif self._pending_jogs[axis] is not None:
+                    self._pending_jogs[axis].delta += delta
+                else:
+                    self._pending_jogs[axis] = _Jog(axis, delta, self._halt_epoch)
+                    self._queue.put(self._pending_jogs[axis])
+                    self._notify()
+        except PhidgetException as e:
+            self._phidget_error_event(e)
+            raise StageNotConnectedError
+
+    def stop_jog(self, axis):
+        """
+        End a jog of one axis.  A running jog is retargeted to the nearest point it can decelerate to, so the axis
+        starts braking immediately without reversing.  A jog still waiting in the queue is cancelled.
+        :param axis: axis index
+        :return:
+        """
+        try:
+            with self._motion_condition:
+                if self._pending_jogs[axis] is not None:
+                    self._pending_jogs[axis].delta = 0
+                if self._jog_target[axis] is None or not self._state.is_moving[axis]:
+                    return
+                # the cached state is up to a data interval old; a braking point worked out from it can lie behind the
+                # axis and send it back, so read where the axis is now
+                position = self._axes[axis].getPosition()
+                velocity = self._axes[axis].getVelocity()
+                remaining = self._jog_target[axis] - position
+                braking = velocity * velocity / (2.0 * self.acceleration_limit)
+                # brake in the direction the jog is headed, and never extend the jog past what was asked for
+                if braking < abs(remaining):
+                    self._jog_target[axis] = position + math.copysign(braking, remaining)
+                    self._axes[axis].setTargetPosition(self._jog_target[axis])
+        except PhidgetException as e:
+            self._phidget_error_event(e)
+            raise StageNotConnectedError
+
+    def _start_jog(self, jog):
+        axis = self._axes[jog.axis]
+        target = self._state.position[jog.axis] + jog.delta
+        try:
+            axis.setVelocityLimit(self.velocity_limit)
+            axis.setAcceleration(self.acceleration_limit)
+            self.set_engaged(jog.axis, True)
+            self._jog_target[jog.axis] = target
+            self._update_axis(jog.axis, is_moving=True)
+            axis.setTargetPosition(target)
+            self._idle_engaged = True
+            if jog.epoch != self._halt_epoch:
+                self._jog_target[jog.axis] = None
+                self._abandon_move()
+        except PhidgetException as e:
+            self._jog_target[jog.axis] = None
+            self._update_axis(jog.axis, is_moving=False)
+            logging.error(e)
 
     @property
     def axes_engaged(self):
-        return [axis.getEngaged() for axis in self._axes]
+        return list(self._state.is_engaged)
 
     def cycle_axes(self, cycles, delta):
         """
@@ -335,22 +659,92 @@ class PhidgetStage(Stage):
         except Exception:
             raise StageNotConnectedError
 
-    def stop_motion(self):
+    @property
+    def halt_epoch(self):
         """
-
+        Number of stop_motion calls so far.  Pass it to move_to to have a move dropped if the stage is stopped first.
         :return:
         """
+        return self._halt_epoch
+
+    def disengage_now(self, axes=None):
+        """
+        Priority lane.  Disengage axes from any thread in bounded time: the hardware is commanded before any lock is
+        taken, so neither a dispatch in progress nor a caller holding a lock can delay it.  The cached state follows
+        afterwards.  The queue is left alone.
+        :param axes: default None.  Axis indices.  If None, every axis.
+        :return: seconds from the call until the last axis was disengaged.  Also appended to stop_latencies.
+        """
+        start = time.perf_counter()
+        axes = range(len(self._axes)) if axes is None else axes
+        # a disengaged axis never arrives.  Cancel first: disengaging fires stopped events, which would otherwise
+        # resolve the arrival as if the move had completed.
+        self._cancel_arrival()
+        for index in axes:
+            try:
+                self._axes[index].setEngaged(False)
+            except PhidgetException as e:
+                self._phidget_error_event(e)
+        latency = time.perf_counter() - start
+        self.stop_latencies.append(latency)
+
+        with self._motion_condition:
+            for index in axes:
+                self._update_axis(index, is_engaged=False, is_moving=False)
+                self._jog_target[index] = None
+            self._notify()
+        return latency
+
+    def _abandon_move(self):
+        # call with _motion_condition held
+        for index, axis in enumerate(self._axes):
+            axis.setEngaged(False)
+            self._update_axis(index, is_engaged=False, is_moving=False)
+        self._cancel_arrival()
+
+    def _drop_queued(self):
+        # call with _motion_condition held
+        dropped = 0
+        while not self._queue.empty():
+            move = self._queue.get()
+            if isinstance(move, _QueuedMove):
+                move.arrival.cancel()
+            self._queue.task_done()
+            dropped += 1
+        self._pending_jogs = [None] * len(self._axes)
+        return dropped
+
+    def clear_queue(self):
+        """
+        Drop every queued move and jog without stopping the axes, e.g. when a limit switch trips and the moves queued
+        behind it would drive the axis back into the switch.  Their arrivals are cancelled.
+        :return: number of moves and jogs dropped
+        """
+        with self._motion_condition:
+            dropped = self._drop_queued()
+            self._notify()
+        return dropped
+
+    def stop_motion(self):
+        """
+        Priority lane.  Disengage every axis at once, then drop every queued move and jog.  A move being dispatched
+        when the stop arrives is abandoned, so nothing queued before the call can start moving after it.
+        :return: seconds from the call until every axis was disengaged
+        """
+        self._halt_epoch += 1
+        latency = self.disengage_now()
         try:
-            while not self._queue.empty():
-                self._queue.get()
-                self._queue.task_done()
-
-            for a in self._axes:
-                a.setEngaged(False)
-        except asyncio.QueueEmpty:
-            pass
+            with self._motion_condition:
+                self._drop_queued()
+                for index in range(len(self._axes)):
+                    self._jog_target[index] = None
+                self._cancel_arrival()
+                self._idle_engaged = False
+                self._notify()
         except Exception:
             raise StageNotConnectedError
+        logging.info(f'stage stopped, axes disengaged {latency * 1000:.2f} ms after the call')
+        return latency
 
     def close(self):
         """
@@ -368,32 +762,11 @@ class PhidgetStage(Stage):
 
     @property
     def is_moving(self):
-        try:
-            return [axis.getIsMoving() for axis in self._axes]
-        except PhidgetException:
-            return [False] * 3
+        return list(self._state.is_moving)
 
     @property
     def is_engaged(self):
-        try:
-            return [axis.getEngaged() for axis in self._axes]
-        except PhidgetException:
-            return [False] * 3
-
-    def _motion_queue(self):
-        """
-
-        :return:
-        """
-        while self._queue_active:
-            for a in self._axes:
-                if not a.getIsMoving():
-                    a.setEngaged(False)
-
-            position = self._queue.get()
-            for idx, axis in enumerate(self._axes):
-                axis.setEngaged(True)
-                axis.setTargetPosition(position[idx])
+        return list(self._state.is_engaged)
 
     @staticmethod
     def _phidget_stepper_attached(e):
@@ -417,30 +790,259 @@ class PhidgetStage(Stage):
         details = e.details
         print("Phidget Error %i : %s" % (code, details))
 
+    def _dispatch_pending(self):
+        return not any(self._state.is_moving) and (not self._queue.empty() or self._idle_engaged)
+
+    def _dispatch_ready(self):
+        return not self._queue_active or self._dispatch_pending()
+
+    def _resync_moving(self):
+        # safety net for a lost stopped event
+        for index, axis in enumerate(self._axes):
+            if self._state.is_moving[index] and not axis.getIsMoving():
+                self._update_axis(index, is_moving=False)
+        self._settled()
+
     def process_queue(self):
         """
-
+        Dispatch queued moves.  The loop blocks on _motion_condition, which is notified by append_move and by the
+        steppers' stopped events, so the next target goes out as soon as every axis has settled.  Axes are disengaged
+        once the queue runs dry.
         :return:
         """
         while self._queue_active:
-            for axis in self._axes:
-                if not axis.getIsMoving():
-                    axis.setEngaged(False)
-
-            if not any(self.is_moving) and not self._queue.empty():
-                try:
-                    pos = self._queue.get_nowait()
-                    self.move_to(pos)
-                except asyncio.QueueEmpty:
-                    pass
+            with self._motion_condition:
+                if not self._motion_condition.wait_for(self._dispatch_ready, timeout=1.0):
+                    self._resync_moving()
+                    continue
+                if not self._queue_active:
+                    break
+                self._dispatch()
+
+    def _dispatch(self):
+        """
+        Send the next queued move, or disengage every axis if the queue is empty.  Called with _motion_condition held
+        once every axis has settled.
+        :return:
+        """
+        try:
+            position = self._queue.get_nowait()
+        except Empty:
+            for index in range(len(self._axes)):
+                self.set_engaged(index, False)
+            self._idle_engaged = False
+            return
+        if isinstance(position, _Jog):
+            self._pending_jogs[position.axis] = None
+            if position.delta and position.epoch == self._halt_epoch:
+                self._start_jog(position)
+        elif position.epoch != self._halt_epoch:
+            position.arrival.cancel()
+        elif not position.arrival.cancelled():
+            self.move_to(position.coordinates, arrival=position.arrival, epoch=position.epoch)
+
+    def dispatch_step(self, resync=False):
+        """
+        One non-blocking pass of process_queue, for callers that drive the queue from their own control loop.  Call it
+        from a motion listener for prompt dispatch and periodically as a fallback.
+        :param resync: default False.  If True, first re-read is_moving from the hardware for axes the cache still
+        considers moving, in case a stopped event was lost.
+        :return:
+        """
+        with self._motion_condition:
+            if not self._queue_active:
+                return
+            if resync:
+                self._resync_moving()
+            if self._dispatch_pending():
+                self._dispatch()
+
+    async def run_queue(self):
+        """
+        process_queue as a coroutine.  Motion listeners wake it through the event loop, so the queue is dispatched
+        from the loop's thread without a thread of its own.
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
 
-            time.sleep(.1)
+        def listener():
+            loop.call_soon_threadsafe(wake.set)
 
-    def start_queue(self, loop=None, executor=None):
+        self.add_motion_listener(listener)
+        try:
+            while self._queue_active:
+                with self._motion_condition:
+                    if self._dispatch_pending():
+                        self._dispatch()
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    with self._motion_condition:
+                        self._resync_moving()
+                wake.clear()
+        finally:
+            self.remove_motion_listener(listener)
+
+    def start_queue(self, loop=None):
+        """
+        Schedule run_queue on an event loop.
+        :param loop: default None.  If None, the current event loop.
+        :return: asyncio.Task
+        """
         if loop is None:
             loop = asyncio.get_event_loop()
         self._queue_active = True
-        return loop.run_in_executor(executor, self.process_queue)
+        return loop.create_task(self.run_queue())
 
     def stop_queue(self):
-        self._queue_active = False
+        with self._motion_condition:
+            self._queue_active = False
+            self._notify()
+
+
+class SimulatedStage(PhidgetStage):
+    def __init__(self, serial=12345, x_channel=0, y_channel=1, z_channel=2, velocity_limit=200.0, acceleration=2500.0,
+                 limits=None, limit_hysteresis=0.0, clock=None, time_step=0.001, data_interval=0.008, speed=1.0,
+                 latency=0.0, attach_delay=0.0, attach_timeout=1000):
+        """
+        PhidgetStage driving simulated_phidget steppers on a virtual clock, so queueing, jogging, homing and limit
+        handling run through the same code as on the rig without hardware.
+
+        Virtual time only passes in advance() and run_until_idle(), which integrate the steppers, fire their events and
+        dispatch the motion queue inline.  process_queue instead paces the simulation against the wall clock.
+
+        :param serial:
+        :param x_channel:
+        :param y_channel:
+        :param z_channel:
+        :param velocity_limit: velocity limit of every axis in stage units per second
+        :param acceleration: acceleration limit of every axis in stage units per second squared
+        :param limits: default None.  Limit switch positions, one (low, high) pair per axis.  Either side may be None
+        for no switch.  A switch trips once the axis reaches it.
+        :param limit_hysteresis: distance an axis has to travel back past a switch before it releases
+        :param clock: default None.  VirtualClock to run on, e.g. one shared with simulated_daqmx.  If None, a new one
+        starting at 0 is used.
+        :param time_step: integration step in seconds
+        :param data_interval: seconds between position and velocity change events while moving
+        :param speed: multiple of real time process_queue runs at
+        :param latency: wall clock seconds each stepper set call blocks for, to model USB round trips
+        :param attach_delay: wall clock seconds from open until a stepper attaches, a scalar or one per axis.  None
+        never attaches.
+        :param attach_timeout: milliseconds initialize_axes waits for every axis
+        """
+        self._latency = latency
+        self._attach_delay = list(attach_delay) if isinstance(attach_delay, (list, tuple)) else [attach_delay] * 3
+        super().__init__(serial=serial, x_channel=x_channel, y_channel=y_channel, z_channel=z_channel,
+                         velocity_limit=velocity_limit, acceleration=acceleration,
+                         clock=clock if clock is not None else VirtualClock(), data_interval=data_interval)
+        self.time_step = time_step
+        self.speed = speed
+        self.limit_switches = list(limits) if limits is not None else [(None, None)] * len(self._axes)
+        self.limit_hysteresis = limit_hysteresis
+        self._limit_tripped = [False] * len(self._axes)
+        self._limit_changed_callback = None
+        self.initialize_axes(attach_timeout)
+        self._check_limits()
+
+    @staticmethod
+    def _load_drivers():
+        pass
+
+    def _create_stepper(self, index):
+        return SimulatedStepper(self._clock, serial=self._serial, data_interval=self.data_interval,
+                                latency=self._latency, attach_delay=self._attach_delay[index])
+
+    @property
+    def physical_position(self):
+        """
+        Actual position of each axis, which the cached position only follows at the data interval.  Use it as the
+        position source of simulated_daqmx.position_switch.
+        :return:
+        """
+        return [axis.physical_position for axis in self._axes]
+
+    @property
+    def limits(self):
+        """
+        Whether each axis' limit switch is tripped.
+        :return:
+        """
+        return list(self._limit_tripped)
+
+    @property
+    def limit_changed_callback(self):
+        return self._limit_changed_callback
+
+    @limit_changed_callback.setter
+    def limit_changed_callback(self, callback):
+        """
+        Called as callback(axis, tripped, timestamp) whenever a limit switch trips or releases.
+        :param callback:
+        :return:
+        """
+        self._limit_changed_callback = callback
+
+    def _check_limits(self):
+        # switches are fixed to the frame, so they ignore position offsets from zero_axes
+        for index, axis in enumerate(self._axes):
+            position = axis.physical_position
+            low, high = self.limit_switches[index]
+            margin = self.limit_hysteresis if self._limit_tripped[index] else 0.0
+            tripped = (low is not None and position <= low + margin) or \
+                (high is not None and position >= high - margin)
+            if tripped != self._limit_tripped[index]:
+                self._limit_tripped[index] = tripped
+                if self._limit_changed_callback:
+                    self._limit_changed_callback(index, tripped, self._clock())
+
+    def advance(self, seconds):
+        """
+        Run the simulation for seconds of virtual time.
+        :param seconds:
+        :return: virtual time after the advance
+        """
+        remaining = seconds
+        while remaining > 1e-12:
+            dt = min(self.time_step, remaining)
+            remaining -= dt
+            with self._motion_condition:
+                if self._dispatch_pending():
+                    self._dispatch()
+                self._clock.advance(dt)
+                for axis in self._axes:
+                    axis.step(dt)
+                self._check_limits()
+        return self._clock()
+
+    def idle(self):
+        """
+        True once every queued move has finished and the axes have been released.
+        :return:
+        """
+        return not any(self._state.is_moving) and self._queue.empty() and not self._idle_engaged
+
+    def run_until_idle(self, timeout=60.0):
+        """
+        Advance until idle().
+        :param timeout: virtual seconds to give up after
+        :return: virtual seconds elapsed
+        """
+        start = self._clock()
+        while not self.idle():
+            if self._clock() - start > timeout:
+                raise TimeoutError(f'Stage still busy after {timeout} s of virtual time.')
+            self.advance(self.time_step)
+        return self._clock() - start
+
+    def process_queue(self):
+        """
+        Run the simulation against the wall clock, speed times faster than real time, until stop_queue is called.
+        :return:
+        """
+        last = time.perf_counter()
+        while self._queue_active:
+            time.sleep(self.time_step / self.speed)
+            now = time.perf_counter()
+            self.advance((now - last) * self.speed)
+            last = now
@@ -0,0 +1,100 @@
+import math
+from collections import namedtuple
+
+MotionPlan = namedtuple('MotionPlan', ['start', 'target', 'velocity', 'acceleration', 'duration'])
+
+
+def trapezoid_duration(distance, velocity, acceleration):
+    """
+    Time-optimal rest to rest move time under a velocity and acceleration limit.  Short moves never reach the
+    velocity limit and follow a triangular profile.
+    :param distance:
+    :param velocity: velocity limit
+    :param acceleration: acceleration limit
+    :return: duration in the time unit of velocity and acceleration
+    """
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0
+    if distance >= velocity * velocity / acceleration:
+        return distance / velocity + velocity / acceleration
+    return 2.0 * math.sqrt(distance / acceleration)
+
+
+def trapezoid_position(t, distance, velocity, acceleration):
+    """
+    Position along a time-optimal rest to rest move, t seconds after it started.
+    :param t:
+    :param distance: signed move distance
+    :param velocity: velocity limit
+    :param acceleration: acceleration limit
+    :return: signed distance travelled
+    """
+    sign = math.copysign(1.0, distance)
+    distance = abs(distance)
+    duration = trapezoid_duration(distance, velocity, acceleration)
+    if t >= duration:
+        return sign * distance
+    if t <= 0:
+        return 0.0
+    peak = min(velocity, math.sqrt(distance * acceleration))
+    ramp = peak / acceleration
+    if t < ramp:
+        return sign * 0.5 * acceleration * t * t
+    if t <= duration - ramp:
+        return sign * (0.5 * peak * ramp + peak * (t - ramp))
+    remaining = duration - t
+    return sign * (distance - 0.5 * acceleration * remaining * remaining)
+
+
+def plan_move(start, target, velocity, acceleration, min_velocity=0.0, min_acceleration=0.0):
+    """
+    Per-axis velocity and acceleration limits that move every axis along a straight line so all of them arrive at the
+    same time, as fast as the most constrained axis allows.
+
+    Every axis follows a scaled copy of one trapezoidal profile: if d_i is an axis' distance the move runs at
+    min(v_i / d_i) and min(a_i / d_i) in path fraction per second, and axis i gets d_i times those limits.
+
+    :param start: coordinates at the start of the move
+    :param target: coordinates at the end of the move
+    :param velocity: velocity limit, a scalar or one per axis
+    :param acceleration: acceleration limit, a scalar or one per axis
+    :param min_velocity: smallest velocity limit the hardware accepts, a scalar or one per axis.  Axes clamped to it
+    arrive slightly early.
+    :param min_acceleration: smallest acceleration the hardware accepts, a scalar or one per axis
+    :return: MotionPlan with per-axis velocity and acceleration limits and the predicted duration
+    """
+    count = len(start)
+    if len(target) != count:
+        raise ValueError(f'Expected target of length {count}.')
+
+    def per_axis(value):
+        return list(value) if isinstance(value, (list, tuple)) else [value] * count
+
+    velocity = per_axis(velocity)
+    acceleration = per_axis(acceleration)
+    min_velocity = per_axis(min_velocity)
+    min_acceleration = per_axis(min_acceleration)
+    distance = [abs(t - s) for s, t in zip(start, target)]
+
+    moving = [i for i in range(count) if distance[i] > 0]
+    if not moving:
+        return MotionPlan(tuple(start), tuple(target), tuple(velocity), tuple(acceleration), 0.0)
+
+    path_velocity = min(velocity[i] / distance[i] for i in moving)
+    path_acceleration = min(acceleration[i] / distance[i] for i in moving)
+    duration = trapezoid_duration(1.0, path_velocity, path_acceleration)
+    # a triangular profile never reaches path_velocity, so only its peak has to be allowed
+    path_peak = min(path_velocity, math.sqrt(path_acceleration))
+
+    axis_velocity = []
+    axis_acceleration = []
+    for i in range(count):
+        if i in moving:
+            axis_velocity.append(max(distance[i] * path_peak, min_velocity[i]))
+            axis_acceleration.append(max(distance[i] * path_acceleration, min_acceleration[i]))
+        else:
+            axis_velocity.append(velocity[i])
+            axis_acceleration.append(acceleration[i])
+
+    return MotionPlan(tuple(start), tuple(target), tuple(axis_velocity), tuple(axis_acceleration), duration)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import gc
+import os
+
+import pytest
+
+
+def pytest_configure(config):
+    # nidaqio picks its backend when it is first imported, so pick it before any test module is collected
+    os.environ.setdefault('NIDAQ_BACKEND', 'simulated')
+
+
+@pytest.fixture
+def simulated_rig(tmp_path, monkeypatch):
+    """
+    Factory for a RemoteStageController on a SimulatedStage and the simulated NIDAQ backend, both on the stage's virtual
+    clock.  The configuration is the packaged one with the analog input ring file moved to tmp_path.
+    """
+    import yaml
+    import visual_behavior
+    from visual_behavior import nidaqio, simulated_daqmx
+    if not nidaqio.SIMULATED:
+        pytest.skip('requires the simulated NIDAQ backend')
+
+    config = visual_behavior.parse_config(visual_behavior._local_path('visual_behavior_v1.yml'))
+    config['nidaq']['analog_in_ring_file'] = str(tmp_path / 'analog_in.ring')
+    config['nidaq']['analog_in_buffer_seconds'] = 1
+    (tmp_path / 'visual_behavior_v1.yml').write_text(yaml.safe_dump(config))
+    monkeypatch.setattr(visual_behavior, 'LOCAL_CONFIG_DIR', str(tmp_path))
+    monkeypatch.setattr(visual_behavior, 'CONFIG_CACHE_DIR', str(tmp_path / 'cache'))
+    controllers = []
+
+    def make(switches=(None, None, None), **stage_kwargs):
+        """
+        :param switches: physical position of each axis' limit switch, None for none.  Switches are wired to the
+        configured limit lines and pull them low like the rig's.
+        :param stage_kwargs: SimulatedStage arguments
+        :return: (controller, stage)
+        """
+        from visual_behavior import SimulatedStage, hardware_proxy
+        stage = SimulatedStage(**stage_kwargs)
+        device = simulated_daqmx.reset(clock=stage.clock)
+        lines = ('limit_switch_x', 'limit_switch_y', 'limit_switch_z')
+        for axis, (line, position, direction) in enumerate(zip(lines, switches, (-1, -1, 1))):
+            if position is not None:
+                device.set_input(config['nidaq'][line], simulated_daqmx.position_switch(
+                    lambda: stage.physical_position, axis, position, direction))
+        controller = hardware_proxy.RemoteStageController(stage=stage)
+        controllers.append(controller)
+        return controller, stage
+
+    yield make
+    for controller in controllers:
+        controller.stop_hardware()
+        for name in controller.DAQ_TASKS:
+            getattr(controller.daq, name).StopTask()
+    controllers.clear()
+    # controllers, tasks and stages reference each other; collect them here rather than at an arbitrary later point
+    gc.collect()
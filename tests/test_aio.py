@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+
+async def drive(stage, until):
+    # advance virtual time while the awaited moves are pending
+    while not until.done():
+        stage.advance(0.01)
+        await asyncio.sleep(0)
+
+
+def test_async_moves_resolve_on_arrival():
+    from visual_behavior import SimulatedStage, aio
+
+    async def main():
+        stage = SimulatedStage()
+        astage = aio.AsyncStage(stage)
+        first = asyncio.ensure_future(astage.append_move([100, 0, 0]))
+        second = asyncio.ensure_future(astage.append_move([100, 40, 0]))
+        await drive(stage, second)
+        assert first.result().position == (100, 0, 0)
+        assert second.result().position == (100, 40, 0)
+        assert not any(second.result().is_moving)
+
+        # a direct move supersedes one in flight
+        superseded = asyncio.ensure_future(astage.move_to([0, 0, 0]))
+        stage.advance(0.05)
+        await asyncio.sleep(0)
+        final = asyncio.ensure_future(astage.move_to([10, 10, 10]))
+        await drive(stage, final)
+        assert superseded.cancelled()
+        assert final.result().position == (10, 10, 10)
+
+    asyncio.run(main())
+
+
+def test_async_queue_runs_on_event_loop():
+    from visual_behavior import SimulatedStage
+
+    async def main():
+        stage = SimulatedStage()
+        stage._queue_active = True
+        queue = asyncio.ensure_future(stage.run_queue())
+        arrival = asyncio.wrap_future(stage.append_move([5, 5, 5]))
+        # the simulated steppers are not advanced here, so only the coroutine can have dispatched the move
+        await asyncio.sleep(0.01)
+        assert stage._axes[0].getTargetPosition() == 5
+        stage.stop_motion()
+        with pytest.raises(asyncio.CancelledError):
+            await arrival
+        stage.stop_queue()
+        await asyncio.wait_for(queue, 1.0)
+
+    asyncio.run(main())
+
+
+def test_async_daq_change_stream():
+    from visual_behavior import nidaqio, simulated_daqmx, aio
+    if not nidaqio.SIMULATED:
+        pytest.skip('requires the simulated NIDAQ backend')
+    simulated_daqmx.reset()
+    daq = nidaqio.NIDAQio()
+    daq.create_digital_in_group('limits', ['port0/line5', 'port0/line3', 'port0/line1'],
+                                sample_mode='change_detection')
+    adaq = aio.AsyncDAQ(daq)
+
+    async def main():
+        edges = adaq.changes('limits')
+        first = asyncio.ensure_future(edges.__anext__())
+        await asyncio.sleep(0)
+        simulated_daqmx.device.set_input('port0/line3', 0)
+        value, timestamp = await asyncio.wait_for(first, 1.0)
+        await edges.aclose()
+        assert daq.limits.decode(value).tolist() == [True, False, True]
+        assert (await adaq.read_lines('limits')).tolist() == [True, False, True]
+
+    try:
+        asyncio.run(main())
+    finally:
+        daq.limits.StopTask()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+
+def test_parse_config_is_cached_by_mtime_and_size(tmp_path, monkeypatch):
+    import yaml
+    import visual_behavior
+    monkeypatch.setattr(visual_behavior, 'CONFIG_CACHE_DIR', str(tmp_path / 'cache'))
+    visual_behavior.clear_config_cache()
+    parses = []
+    safe_load = yaml.safe_load
+    monkeypatch.setattr(yaml, 'safe_load', lambda f: parses.append(f.name) or safe_load(f))
+
+    path = tmp_path / 'rig.yml'
+    path.write_text('phidget:\n    port: 6001\n')
+    config = visual_behavior.parse_config(str(path))
+    config['phidget']['port'] = 0
+    assert visual_behavior.parse_config(str(path)) == {'phidget': {'port': 6001}}
+    assert len(parses) == 1
+
+    # a new process starts from the compiled cache
+    visual_behavior.clear_config_cache()
+    assert visual_behavior.parse_config(str(path)) == {'phidget': {'port': 6001}}
+    assert len(parses) == 1
+
+    path.write_text('phidget:\n    port: 6002\n')
+    os.utime(str(path), ns=(1, 1))
+    assert visual_behavior.parse_config(str(path)) == {'phidget': {'port': 6002}}
+    assert len(parses) == 2
+    assert visual_behavior.parse_config(str(tmp_path / 'missing.yml')) is None
+
+
+def test_frozen_config_shares_types_and_sections(caplog):
+    import visual_behavior
+    source = {'phidget': {'port': 6001, 'channels': {'x': 0, 'y': 1}}, 'class': 'rig', 'rigs': ['D1', 'D2']}
+    config = visual_behavior.dict_to_namedtuple(source)
+    assert isinstance(source['phidget'], dict)
+    assert config.phidget.channels.y == 1 and config.rigs == ('D1', 'D2')
+    assert config.get('class') == 'rig' and config.get('missing', 3) == 3
+    assert config.as_dict() == source and config.as_dict() is not config.as_dict()
+    assert type(visual_behavior.dict_to_namedtuple(source).phidget) is type(config.phidget)
+
+    # keys named like the helper methods stay out of the attributes
+    clashing = visual_behavior.freeze_config({'get': 1, 'as_dict': 2, 'port': 3})
+    assert clashing._fields == ('_0', '_1', 'port') and 'shadow' in caplog.text
+    assert clashing.get('get') == 1 and clashing.get('as_dict') == 2 and clashing.port == 3
+    assert clashing.as_dict() == {'get': 1, 'as_dict': 2, 'port': 3}
+
+    # a reload shares every section that did not change
+    changed = dict(source, rigs=['D1'])
+    reloaded = visual_behavior.freeze_config(changed, visual_behavior._shared_nodes(config))
+    assert reloaded.phidget is config.phidget and reloaded.rigs == ('D1',)
+
+
+def test_source_project_configuration_reuses_config(tmp_path, monkeypatch):
+    import visual_behavior
+    monkeypatch.setattr(visual_behavior, 'CONFIG_CACHE_DIR', str(tmp_path / 'cache'))
+    first = visual_behavior.source_project_configuration('visual_behavior_v1.yml', override_local=False)
+    assert visual_behavior.source_project_configuration('visual_behavior_v1.yml', override_local=False) is first
+    as_dict = visual_behavior.source_project_configuration('visual_behavior_v1.yml', override_local=False,
+                                                           as_dict=True)
+    as_dict['phidget']['port'] = 0
+    assert first.phidget.port == 6001
+
+
+def test_remote_configuration_refreshes_in_background(tmp_path, monkeypatch):
+    import threading
+    import time
+    import visual_behavior
+    local_dir, remote_dir = tmp_path / 'local', tmp_path / 'remote'
+    local_dir.mkdir()
+    remote_dir.mkdir()
+    monkeypatch.setattr(visual_behavior, 'CONFIG_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(visual_behavior, 'LOCAL_CONFIG_DIR', str(local_dir))
+    monkeypatch.setenv('MPE_CONFIGURATION_PATH', str(remote_dir))
+    (local_dir / 'rig.yml').write_text('port: 1\n')
+    os.utime(str(local_dir / 'rig.yml'), (1, 1))
+    (remote_dir / 'rig.yml').write_text('port: 2\n')
+
+    # a slow file share
+    file_stamp = visual_behavior._file_stamp
+    monkeypatch.setattr(visual_behavior, '_file_stamp',
+                        lambda path: (time.sleep(0.3) if str(remote_dir) in path else None) or file_stamp(path))
+    updates = []
+    updated = threading.Event()
+    callback = lambda name, config: updates.append((name, config.port)) or updated.set()
+    visual_behavior.subscribe_config(callback)
+    try:
+        t0 = time.perf_counter()
+        assert visual_behavior.source_project_configuration('rig.yml').port == 1
+        assert time.perf_counter() - t0 < 0.2
+        assert updated.wait(5.0)
+        assert updates == [('rig.yml', 2)]
+        assert visual_behavior.source_project_configuration('rig.yml', override_local=False).port == 2
+
+        # without a local copy the share is waited for, but only until the deadline
+        (local_dir / 'rig.yml').unlink()
+        with pytest.raises(FileNotFoundError):
+            visual_behavior.source_project_configuration('missing.yml', timeout=0.05)
+        assert visual_behavior.source_project_configuration('rig.yml', timeout=5.0).port == 2
+    finally:
+        visual_behavior.unsubscribe_config(callback)
+
+
+def test_hung_remote_refresh_is_replaced_after_the_deadline(tmp_path, monkeypatch):
+    import threading
+    import time
+    import visual_behavior
+    from concurrent.futures import TimeoutError as FuturesTimeoutError
+    local_dir, remote_dir = tmp_path / 'local', tmp_path / 'remote'
+    local_dir.mkdir()
+    remote_dir.mkdir()
+    monkeypatch.setattr(visual_behavior, 'CONFIG_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(visual_behavior, 'LOCAL_CONFIG_DIR', str(local_dir))
+    monkeypatch.setattr(visual_behavior, 'REMOTE_CONFIG_TIMEOUT', 0.2)
+    monkeypatch.setenv('MPE_CONFIGURATION_PATH', str(remote_dir))
+    (local_dir / 'hung.yml').write_text('port: 1\n')
+    os.utime(str(local_dir / 'hung.yml'), (1, 1))
+    (remote_dir / 'hung.yml').write_text('port: 2\n')
+
+    # the first visit to the share never returns until the test lets it go
+    hung, visits = threading.Event(), []
+    file_stamp = visual_behavior._file_stamp
+
+    def stamp(path):
+        if str(remote_dir) in path:
+            visits.append(path)
+            if len(visits) == 1:
+                hung.wait()
+        return file_stamp(path)
+
+    monkeypatch.setattr(visual_behavior, '_file_stamp', stamp)
+    try:
+        assert visual_behavior.source_project_configuration('hung.yml').port == 1
+        first = visual_behavior._refreshes['hung.yml'][1]
+        # loading again shares the refresh in progress instead of starting another thread
+        visual_behavior.source_project_configuration('hung.yml')
+        assert visual_behavior.refresh_remote_config('hung.yml') is first
+
+        # past the deadline the stuck refresh is given up on and the next request tries again
+        time.sleep(0.25)
+        assert not first.done()
+        second = visual_behavior.refresh_remote_config('hung.yml')
+        assert second is not first
+        assert isinstance(first.exception(0), FuturesTimeoutError)
+        assert second.result(5.0) is True
+        assert visual_behavior.source_project_configuration('hung.yml', override_local=False).port == 2
+    finally:
+        hung.set()
+
+
+def test_config_watcher_applies_claimed_sections(tmp_path, monkeypatch):
+    import visual_behavior
+    from visual_behavior import config_watcher
+    monkeypatch.setattr(visual_behavior, 'CONFIG_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(visual_behavior, 'LOCAL_CONFIG_DIR', str(tmp_path))
+    path = tmp_path / 'rig.yml'
+    path.write_text('phidget:\n    step_size: 1.0\n    port: 6001\nnidaq:\n    temp: ai0\n')
+    os.utime(str(path), ns=(1, 1))
+
+    watcher = config_watcher.ConfigWatcher('rig.yml', remote_interval=None)
+    applied = []
+    watcher.register('phidget.step_size', lambda old, new: applied.append((old, new)),
+                     lambda old, new: None if new > 0 else 'step_size must be positive')
+    old = watcher.config
+
+    path.write_text('phidget:\n    step_size: 2.0\n    port: 6001\nnidaq:\n    temp: ai0\n')
+    os.utime(str(path), ns=(2, 2))
+    assert watcher.reload() == [config_watcher.ConfigChange(('phidget', 'step_size'), 1.0, 2.0)]
+    assert applied == [(1.0, 2.0)] and watcher.config.phidget.step_size == 2.0
+    # the unchanged section is the same object, so it was never compared
+    assert watcher.config.nidaq is old.nidaq
+    assert watcher.reload() == []
+
+    # an unclaimed section, or a change a validator refuses, rejects the whole reload
+    path.write_text('phidget:\n    step_size: 3.0\n    port: 6002\nnidaq:\n    temp: ai0\n')
+    os.utime(str(path), ns=(3, 3))
+    assert watcher.reload() == []
+    assert watcher.rejected[1] == ['phidget.port cannot be changed while running']
+    path.write_text('phidget:\n    step_size: -1.0\n    port: 6001\nnidaq:\n    temp: ai0\n')
+    os.utime(str(path), ns=(4, 4))
+    assert watcher.reload() == []
+    assert watcher.rejected[1] == ['step_size must be positive']
+    assert applied == [(1.0, 2.0)] and watcher.config.phidget.step_size == 2.0
+
+
+def test_config_watcher_rolls_back_a_failed_apply(tmp_path, monkeypatch):
+    import visual_behavior
+    from visual_behavior import config_watcher
+    monkeypatch.setattr(visual_behavior, 'CONFIG_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(visual_behavior, 'LOCAL_CONFIG_DIR', str(tmp_path))
+    path = tmp_path / 'rig.yml'
+    path.write_text('phidget:\n    step_size: 1.0\nnidaq:\n    temp: ai0\n')
+    os.utime(str(path), ns=(1, 1))
+
+    watcher = config_watcher.ConfigWatcher('rig.yml', remote_interval=None)
+    applied = []
+
+    def fail(old, new):
+        if new == 'ai9':
+            raise ValueError('no such channel')
+
+    watcher.register('phidget.step_size', lambda old, new: applied.append((old, new)))
+    watcher.register('nidaq.temp', fail)
+    old = watcher.config
+
+    path.write_text('phidget:\n    step_size: 2.0\nnidaq:\n    temp: ai9\n')
+    os.utime(str(path), ns=(2, 2))
+    assert watcher.reload() == []
+    # step_size was applied before nidaq.temp failed, and is put back
+    assert applied == [(1.0, 2.0), (2.0, 1.0)]
+    assert watcher.config is old
+    assert watcher.rejected[1] == ['nidaq.temp: no such channel']
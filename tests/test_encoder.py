@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+def test_encoder_decoder_unwraps_across_blocks():
+    from visual_behavior.encoder import EncoderDecoder
+    sample_rate = 5000.0
+    decoder = EncoderDecoder(sample_rate, smoothing=0.002, decimation=50)
+    t = np.arange(int(sample_rate)) / sample_rate
+    # 2.5 revolutions per second, signal is the fraction of the reference per revolution
+    reference = np.full(t.shape, 5.0)
+    signal = 5.0 * ((2.5 * t) % 1.0)
+
+    positions = []
+    velocities = []
+    for start in range(0, len(t), 333):
+        position, velocity, _ = decoder.decode(reference[start:start + 333], signal[start:start + 333])
+        positions.append(position)
+        velocities.append(velocity)
+    position = np.concatenate(positions)
+    velocity = np.concatenate(velocities)
+
+    np.testing.assert_allclose(position, 900.0 * t, atol=1e-6)
+    np.testing.assert_allclose(velocity[100:], 900.0, rtol=1e-6)
+    assert decoder.history.count == len(t) // 50
+    assert abs(decoder.state.velocity - 900.0) < 1e-6
+    assert abs(decoder.state.acceleration) < 1e-3
+
+
+def test_moving_average_is_continuous_across_blocks():
+    from visual_behavior.encoder import MovingAverage
+    data = np.random.default_rng(0).normal(size=1000)
+    whole = MovingAverage(7)(data)
+    filter_ = MovingAverage(7)
+    pieces = np.concatenate([filter_(data[i:i + 91]) for i in range(0, 1000, 91)])
+    np.testing.assert_allclose(pieces, whole)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+
+def test_controller_runs_against_simulated_rig(simulated_rig):
+    from visual_behavior import simulated_daqmx
+    controller, stage = simulated_rig()
+    assert controller.phidget_stage is stage and controller.stage_serial == 12345
+
+    controller.extend_lickspout()
+    controller.signal_water_sol_2()
+    assert simulated_daqmx.device.outputs == {'port1/line3': 1, 'port1/line1': 1}
+
+    controller.append_move([10, -20, 5])
+    stage.run_until_idle()
+    assert controller.position == [10, -20, 5]
+    assert controller.limits == [False, False, False]
+
+
+def _start(controller):
+    # run the control loop from the test instead of on threads: the scheduler, limit polling and the stage all step
+    # on the stage's virtual clock, so edges are timestamped exactly when the switch crosses
+    controller.start_hardware()
+    controller.scheduler.stop()
+    controller.watch_config(False)
+    controller.daq.limits.stop_streaming()
+
+
+def _run(controller, stage, seconds):
+    end = stage.clock() + seconds
+    while stage.clock() < end:
+        controller.daq.limits.poll()
+        controller.scheduler.run_pending()
+        stage.advance(stage.time_step)
+
+
+def test_limit_recovery_latches_trip_at_the_switch(simulated_rig):
+    controller, stage = simulated_rig(switches=(-37.3, None, None))
+    _start(controller)
+    controller.append_move([-60, 0, 0])
+    _run(controller, stage, 2.0)
+
+    recovery, = controller.limit_recoveries
+    assert recovery.released and recovery.attempts == 1
+    # the trip and release are timestamped on the device clock, so both land on the switch
+    assert abs(controller._trip_positions[0] + 37.3) < 1.0
+    assert recovery.distance < 1.0
+    assert abs(stage.physical_position[0] - (-37.3 + controller.limit_margin)) < 1.0
+    assert controller.limits == [False, False, False]
+
+
+def test_home_stage_through_the_controller(simulated_rig):
+    controller, stage = simulated_rig(switches=(-37.3, -52.1, 18.4))
+    _start(controller)
+    stage.move_to([-20, -30, 0])
+    _run(controller, stage, 1.0)
+
+    future = controller.home_stage()
+    end = stage.clock() + 120.0
+    while not future.done() and stage.clock() < end:
+        _run(controller, stage, .1)
+    edges = future.result()
+
+    # the limits task leaves the homed axes to homing instead of disengaging them and backing them off itself
+    for edge, switch in zip(edges, (-37.3, -52.1, 18.4)):
+        assert abs(edge - switch) < 1.0
+    _run(controller, stage, .1)
+    assert controller.limits == [False, False, False]
+    assert not controller.limit_recoveries
+
+
+def test_limit_recovery_ignores_an_extrapolated_trip(simulated_rig, monkeypatch):
+    controller, stage = simulated_rig(switches=(-37.3, None, None))
+    _start(controller)
+    # a stale position event extrapolated far past the switch
+    monkeypatch.setattr(stage, 'position_at', lambda axis, timestamp: -599278.0)
+    controller.append_move([-60, 0, 0])
+    _run(controller, stage, 2.0)
+
+    recovery, = controller.limit_recoveries
+    assert recovery.released and recovery.attempts == 1
+    # backed off the switch from where the axis stopped instead of driving on towards the bogus trip
+    assert -37.3 < stage.physical_position[0] < -37.3 + 5.0
+    assert recovery.distance < 5.0
+
+
+def test_limit_recovery_widens_search_and_remembers_release_distance(simulated_rig):
+    from visual_behavior import simulated_daqmx
+    controller, stage = simulated_rig()
+    simulated_daqmx.device.set_input(controller.config.nidaq.limit_switch_x, simulated_daqmx.position_switch(
+        lambda: stage.physical_position, 0, -37.3, -1, hysteresis=120.0))
+    # wider than the latching error at full speed, about a step's travel at each edge
+    controller.limit_margin = 5.0
+    _start(controller)
+    controller.append_move([-60, 0, 0])
+    _run(controller, stage, 10.0)
+
+    # LIMIT_SEARCH_DISTANCE is not enough to clear the switch; the second attempt goes twice as far
+    first, = controller.limit_recoveries
+    assert first.released and first.attempts == 2
+    assert abs(first.distance - 120.0) < 2.0
+    assert abs(stage.physical_position[0] - (-37.3 + 120.0 + controller.limit_margin)) < 2.0
+
+    controller.append_move([-60, 0, 0])
+    _run(controller, stage, 10.0)
+    # the next recovery goes straight past the remembered release
+    second = controller.limit_recoveries[-1]
+    assert second.released and second.attempts == 1
+    assert abs(second.distance - 120.0) < 2.0
+
+
+def test_controller_rejects_config_it_cannot_apply_live(simulated_rig):
+    controller, stage = simulated_rig()
+    assert controller._validate_positive(1.0, 0) == '0 is not a positive number'
+    assert controller._validate_positive(1.0, 2.5) is None
+    nidaq = controller.config.nidaq
+    assert controller._validate_daq_remap(nidaq, nidaq._replace(analog_in_sample_rate=1000)) == \
+        'nidaq.analog_in_sample_rate only take effect on restart'
+
+    # lines in use while the stage moves stay put until it stops; the solenoids can move at any time
+    controller.append_move([50, 0, 0])
+    stage.advance(0.05)
+    assert controller._validate_daq_remap(nidaq, nidaq._replace(clamp_0='ao2')) == \
+        'clamp lines cannot be remapped while the stage is moving'
+    assert controller._validate_daq_remap(nidaq, nidaq._replace(temp='ai7')) == \
+        'analog_in lines cannot be remapped while the stage is moving'
+    assert controller._validate_daq_remap(nidaq, nidaq._replace(water_solenoid_1='port0/line6')) is None
+    stage.run_until_idle()
+    assert controller._validate_daq_remap(nidaq, nidaq._replace(clamp_0='ao2')) is None
+
+
+def test_status_before_the_first_analog_block(simulated_rig):
+    controller, stage = simulated_rig()
+    # nothing has been acquired on the paused virtual clock yet
+    status = controller.status()
+    assert status.version == 1 and status.temperature is None
+    controller.daq.analog_in.StopTask()
+    assert controller.update_telemetry().temperature is None
+
+
+def test_clamp_patterns_write_both_channels_at_once(simulated_rig):
+    from visual_behavior import simulated_daqmx
+    controller, stage = simulated_rig()
+    device = simulated_daqmx.device
+    for axis, levels in ((0, (5.0, 5.0)), (1, (5.0, 0.0)), (2, (0.0, 5.0)), ('reset', (0.0, 0.0))):
+        calls = device.calls['WriteAnalogF64']
+        controller.clamp_signal(axis)
+        assert device.calls['WriteAnalogF64'] == calls + 1
+        assert (device.outputs['ao0'], device.outputs['ao1']) == levels
+
+    # a limit recovery sets the brake pattern once and resets it once
+    controller, stage = simulated_rig(switches=(-37.3, None, None))
+    device = simulated_daqmx.device
+    _start(controller)
+    controller.append_move([-60, 0, 0])
+    _run(controller, stage, 2.0)
+    assert controller.limit_recoveries[0].released
+    assert [(channel, value) for _, channel, value in device.writes if channel in ('ao0', 'ao1')] == \
+        [('ao0', 5.0), ('ao1', 5.0), ('ao0', 0.0), ('ao1', 0.0)]
+    assert device.calls['WriteAnalogF64'] == 2
+
+
+def test_config_changes_are_applied_on_the_control_loop(simulated_rig, tmp_path):
+    import os
+    controller, stage = simulated_rig()
+    controller.start_hardware()
+    controller.watch_config(False)
+    path = tmp_path / 'visual_behavior_v1.yml'
+    path.write_text(path.read_text().replace('limit_back_off_margin: 1.0', 'limit_back_off_margin: 2.5'))
+    os.utime(str(path), ns=(10 ** 9, 10 ** 9))
+
+    assert [change.path for change in controller.config_watcher.reload()] == \
+        [('phidget', 'limit_back_off_margin')]
+    assert controller.limit_margin == 2.5
+    # it ran as a job on the scheduler's worker, not on the reloading thread
+    assert controller.scheduler.stats()['_set_limit_margin'].runs == 1
+
+
+def test_limit_trip_drops_queued_moves(simulated_rig):
+    controller, stage = simulated_rig(switches=(-37.3, None, None))
+    _start(controller)
+    targets = []
+    set_target = stage._axes[0].setTargetPosition
+    stage._axes[0].setTargetPosition = lambda position: targets.append(position) or set_target(position)
+    stage.append_move([-60, 0, 0])
+    queued = stage.append_move([-80, 0, 0])
+    _run(controller, stage, 2.0)
+
+    # the move queued behind the trip never went out, so it could not drive the axis further into the switch
+    assert queued.cancelled()
+    assert -80 not in targets
+    recovery, = controller.limit_recoveries
+    assert recovery.released
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+
+def _homing_rig(**kwargs):
+    from visual_behavior import SimulatedStage
+    from visual_behavior.homing import Homing
+    from visual_behavior.scheduler import Scheduler
+    stage = SimulatedStage(limits=[(-37.3, None), (-52.1, None), (None, 18.4)], limit_hysteresis=0.5)
+    scheduler = Scheduler(clock=stage.clock)
+    homing = Homing(stage, scheduler, lambda: stage.limits, clock=stage.clock, **kwargs)
+    stage.limit_changed_callback = homing.limit_changed
+    return stage, scheduler, homing
+
+
+def _run(stage, scheduler, future, timeout=120.0):
+    start = stage.clock()
+    while not future.done() and stage.clock() - start < timeout:
+        scheduler.run_pending()
+        stage.advance(stage.time_step)
+    return future
+
+
+def test_homing_finds_switch_edges():
+    stage, scheduler, homing = _homing_rig()
+    edges = _run(stage, scheduler, homing.start()).result()
+    assert edges == pytest.approx([-37.3, -52.1, 18.4], abs=0.05)
+    # the edges are the new origin and every axis is left clear of its switch
+    assert stage.position == pytest.approx([5.0, 5.0, -5.0], abs=0.05)
+    assert stage.limits == [False, False, False]
+
+    # homing again from elsewhere lands on the same edges
+    stage.move_to([40.0, 10.0, -30.0])
+    stage.run_until_idle()
+    _run(stage, scheduler, homing.start()).result()
+    assert stage.physical_position == pytest.approx([-32.3, -47.1, 13.4], abs=0.05)
+
+
+def test_homing_follows_the_stage_velocity_limit():
+    stage, scheduler, homing = _homing_rig()
+    assert (homing.fast_velocity, homing.slow_velocity) == (200.0, 20.0)
+    # e.g. a live configuration change
+    stage.velocity_limit = 100.0
+    assert (homing.fast_velocity, homing.slow_velocity) == (100.0, 10.0)
+    _run(stage, scheduler, homing.start()).result()
+    assert stage.limits == [False, False, False]
+
+
+def test_stop_aborts_homing():
+    from visual_behavior.exceptions import HomingError
+    stage, scheduler, homing = _homing_rig()
+    future = homing.start()
+    for _ in range(50):
+        scheduler.run_pending()
+        stage.advance(stage.time_step)
+    assert any(stage.is_moving)
+    stage.stop_motion()
+    _run(stage, scheduler, future, timeout=1.0)
+    with pytest.raises(HomingError):
+        future.result(timeout=0)
+    assert not homing.active
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+
+
+class _SlowHandler(logging.Handler):
+    def __init__(self, release):
+        super(_SlowHandler, self).__init__(logging.INFO)
+        self.released = release
+        self.messages = []
+
+    def emit(self, record):
+        self.released.wait(5.0)
+        self.messages.append(record.getMessage())
+
+
+def test_queue_handlers_never_block_and_count_drops():
+    from visual_behavior import log_queue
+    logger = logging.getLogger('test_log_queue')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    release = threading.Event()
+    slow = _SlowHandler(release)
+    logger.addHandler(slow)
+    try:
+        handler = log_queue.queue_handlers(logger, max_size=4)
+        assert logger.handlers == [handler]
+
+        t0 = time.perf_counter()
+        for i in range(20):
+            logger.info(f'message {i}')
+        logger.debug('below the handler level')
+        assert time.perf_counter() - t0 < 1.0
+        stats = log_queue.log_queue_stats()['test_log_queue']
+        assert stats.dropped > 0 and stats.queued + stats.dropped == 21
+        assert stats.dropped_by_level['INFO'] + stats.dropped_by_level.get('DEBUG', 0) == stats.dropped
+
+        release.set()
+        while log_queue.log_queue_stats()['test_log_queue'].pending:
+            time.sleep(0.01)
+        logger.warning('after the drops')
+        log_queue.stop_queue_handlers(logger)
+        assert logger.handlers == [slow]
+        assert slow.messages[0] == 'message 0'
+        assert slow.messages[-2:] == [f'log queue full: dropped {stats.dropped} records', 'after the drops']
+        assert 'below the handler level' not in slow.messages
+    finally:
+        release.set()
+        log_queue.stop_queue_handlers(logger)
+        logger.removeHandler(slow)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import time
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def daq():
+    from visual_behavior import nidaqio, simulated_daqmx
+    if not nidaqio.SIMULATED:
+        pytest.skip('requires the simulated NIDAQ backend')
+    simulated_daqmx.reset()
+    return nidaqio.NIDAQio()
+
+
+def test_digital_in_group_reads_lines_in_one_call(daq):
+    from visual_behavior import simulated_daqmx
+    daq.create_digital_in_group('limits', ['port0/line5', 'port0/line3', 'port0/line1'])
+    simulated_daqmx.device.set_input('port0/line3', 0)
+
+    reads = simulated_daqmx.device.calls['ReadDigitalU32']
+    assert daq.limits.read_lines().tolist() == [True, False, True]
+    assert simulated_daqmx.device.calls['ReadDigitalU32'] == reads + 1
+
+
+def test_continuous_digital_in_streams_into_ring_buffer(daq):
+    from visual_behavior import simulated_daqmx
+    simulated_daqmx.device.set_input('port0/line5', lambda t: (t * 100).astype(int) % 2)
+    daq.create_digital_in_task('x_limit', 'port0/line5', sample_mode='continuous', sample_rate=2000.0,
+                               buffer_size=500)
+    time.sleep(.1)
+    try:
+        window = daq.x_limit.window(100)
+        assert len(window) == 100
+        assert set(np.unique(window)) <= {0, 32}
+        assert daq.x_limit.read() in (0, 32)
+    finally:
+        daq.x_limit.StopTask()
+    assert not daq.x_limit.streaming
+
+
+def test_persistent_output_task_starts_once(daq):
+    from visual_behavior import simulated_daqmx
+    daq.create_digital_out_task('air_sol_1', 'port1/line3', persistent=True)
+    for _ in range(5):
+        daq.air_sol_1.write(np.ones(10, dtype=np.uint8))
+
+    assert simulated_daqmx.device.calls['StartTask'] == 1
+    assert simulated_daqmx.device.calls['StopTask'] == 0
+    assert simulated_daqmx.device.outputs['port1/line3'] == 1
+
+
+def test_two_channel_analog_write_updates_both_channels(daq):
+    from visual_behavior import nidaqio, simulated_daqmx
+    daq.create_analog_out_voltage_task('clamp', ['ao0', 'ao1'], persistent=True)
+    daq.clamp.write(nidaqio.NIDAQAnalogTask.pack_channels((5, 0), 1000))
+
+    assert simulated_daqmx.device.calls['WriteAnalogF64'] == 1
+    assert simulated_daqmx.device.outputs == {'ao0': 5.0, 'ao1': 0.0}
+    with pytest.raises(ValueError):
+        daq.clamp.write(np.zeros(1000))
+
+
+def test_analog_in_streams_to_ring_file(daq, tmp_path):
+    from visual_behavior import ring_buffer, simulated_daqmx
+    simulated_daqmx.device.set_input('ai6', 1.5)
+    simulated_daqmx.device.set_input('ai3', lambda t: np.sin(t))
+    ring_file = tmp_path / 'analog_in.ring'
+    daq.create_analog_in_voltage_task('analog_in', ['ai6', 'ai3'], sample_rate=5000.0, buffer_size=200,
+                                      samples_per_read=50, filename=str(ring_file))
+    time.sleep(.1)
+    try:
+        assert daq.analog_in.window(150).shape == (150, 2)
+        assert np.all(daq.analog_in.channel_window('ai6', 150) == 1.5)
+        assert daq.analog_in.read()[0] == 1.5
+    finally:
+        daq.analog_in.StopTask()
+    assert ring_file.stat().st_size == ring_buffer.RING_FILE_HEADER_SIZE + 2 * 200 * 2 * 8
+
+
+def test_change_detection_calls_back_on_edges(daq):
+    from visual_behavior import simulated_daqmx
+    daq.create_digital_in_group('limits', ['port0/line5', 'port0/line3', 'port0/line1'],
+                                sample_mode='change_detection')
+    changes = []
+    daq.limits.add_change_callback(lambda value, timestamp: changes.append(daq.limits.decode(value).tolist()))
+    try:
+        simulated_daqmx.device.set_input('port0/line1', 0)
+        deadline = time.perf_counter() + 1.0
+        while not changes and time.perf_counter() < deadline:
+            time.sleep(.001)
+        assert changes == [[True, True, False]]
+        assert daq.limits.read_lines().tolist() == [True, True, False]
+    finally:
+        daq.limits.StopTask()
+
+
+def test_digital_in_group_decodes_lines_in_list_order(daq):
+    from visual_behavior import simulated_daqmx
+    daq.create_digital_in_group('limits', ['port0/line1', 'port0/line5', 'port0/line3'])
+    simulated_daqmx.device.set_input('port0/line5', 0)
+
+    assert daq.limits.read_lines().tolist() == [True, False, True]
+    assert daq.limits.decode((1 << 5) | (1 << 3)).tolist() == [False, True, True]
+    with pytest.raises(ValueError):
+        daq.create_digital_in_group('mixed', ['port0/line1', 'port1/line1'])
+    with pytest.raises(ValueError):
+        daq.create_digital_in_group('whole_port', ['port0'])
+
+
+def test_output_task_starts_around_every_write_unless_persistent(daq):
+    from visual_behavior import simulated_daqmx
+    daq.create_digital_out_task('water_sol_1', 'port0/line7')
+    daq.create_analog_out_voltage_task('clamp_0', 'ao0', persistent=True)
+    for _ in range(3):
+        daq.water_sol_1.write(np.ones(10, dtype=np.uint8))
+        daq.clamp_0.write(np.full(1000, 5.0))
+
+    # three start / stop pairs for the digital task, one start for the committed analog task
+    assert simulated_daqmx.device.calls['StartTask'] == 4
+    assert simulated_daqmx.device.calls['StopTask'] == 3
+    assert simulated_daqmx.device.outputs == {'port0/line7': 1, 'ao0': 5.0}
+    with pytest.raises(ValueError):
+        daq.create_digital_in_task('persistent_in', 'port0/line5', persistent=True)
+
+
+def test_overwriting_persistent_task_releases_its_lines(daq):
+    from visual_behavior import nidaqio, simulated_daqmx
+    daq.create_digital_out_task('air_sol_1', 'port1/line3', persistent=True)
+    # committed lines stay reserved while the task exists
+    with pytest.raises(nidaqio.PyDAQmx.DAQError):
+        daq.create_digital_out_task('other', 'port1/line3', persistent=True)
+
+    old = daq.air_sol_1
+    daq.create_digital_out_task('air_sol_1', 'port1/line3', overwrite=True, persistent=True)
+    assert daq.air_sol_1 is not old and daq.air_sol_1.persistent
+    assert simulated_daqmx.device.calls['ClearTask'] == 1
+    daq.air_sol_1.write(np.ones(10, dtype=np.uint8))
+    assert simulated_daqmx.device.outputs['port1/line3'] == 1
+    with pytest.raises(NameError):
+        daq.create_digital_out_task('air_sol_1', 'port1/line3')
+
+
+def test_task_without_read_block_cannot_be_created(daq):
+    from visual_behavior import nidaqio
+
+    class Incomplete(nidaqio.NIDAQTask):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
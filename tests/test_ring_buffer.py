@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+
+def test_ring_buffer_window_is_contiguous_view():
+    from visual_behavior.ring_buffer import RingBuffer
+    ring = RingBuffer(5, dtype=np.uint32)
+    ring.extend(np.arange(3))
+    ring.extend(np.arange(3, 8))
+
+    window = ring.window(4)
+    assert list(window) == [4, 5, 6, 7]
+    assert np.shares_memory(window, ring._data)
+    assert not window.flags.writeable
+    assert ring.latest() == 7
+    assert ring.count == 8
+
+
+def test_ring_buffer_keeps_tail_of_oversized_block():
+    from visual_behavior.ring_buffer import RingBuffer
+    ring = RingBuffer(4, channels=2)
+    ring.extend(np.arange(20).reshape(10, 2))
+
+    assert ring.window().tolist() == [[12, 13], [14, 15], [16, 17], [18, 19]]
+    with pytest.raises(ValueError):
+        ring.window(5)
+
+
+def test_ring_file_can_be_read_back(tmp_path):
+    from visual_behavior.ring_buffer import RingBuffer
+    filename = str(tmp_path / 'analog_in.ring')
+    ring = RingBuffer(4, channels=2, filename=filename)
+    ring.extend(np.arange(12).reshape(6, 2))
+    ring.flush()
+    del ring
+
+    # the header records the layout and how far the writer got
+    loaded = RingBuffer.load(filename)
+    assert (loaded.capacity, loaded.channels, loaded.dtype, loaded.count) == (4, 2, np.float64, 6)
+    assert loaded.window().tolist() == [[4, 5], [6, 7], [8, 9], [10, 11]]
+    loaded.extend([[12, 13]])
+    assert loaded.window(2).tolist() == [[10, 11], [12, 13]]
+
+    # a new buffer on the same file starts over
+    assert RingBuffer(4, channels=2, filename=filename).count == 0
+    assert RingBuffer.load(filename).count == 0
+    with pytest.raises(ValueError):
+        RingBuffer.load(str(tmp_path / 'missing.ring'))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import Future
+
+
+def test_fixed_rate_tasks_keep_their_grid():
+    from visual_behavior.scheduler import Scheduler
+    from visual_behavior.simulated_phidget import VirtualClock
+    clock = VirtualClock()
+    scheduler = Scheduler(clock=clock)
+    runs = []
+    scheduler.every(0.01, lambda: runs.append(clock()), name='fast')
+
+    for _ in range(100):
+        scheduler.run_pending()
+        clock.advance(0.001)
+    assert len(runs) == 10
+
+    # a stall skips the missed periods instead of running them back to back
+    clock.advance(0.05)
+    scheduler.run_pending()
+    stats = scheduler.stats()['fast']
+    assert stats.runs == 11 and stats.overruns == 5
+    assert scheduler.run_pending() > 0
+
+
+def test_job_waits_on_future():
+    from visual_behavior.scheduler import Scheduler
+    from visual_behavior.simulated_phidget import VirtualClock
+    clock = VirtualClock()
+    scheduler = Scheduler(clock=clock)
+    arrival = Future()
+    steps = []
+
+    def job():
+        steps.append('start')
+        done = yield arrival
+        steps.append(done.result())
+        yield 0.5
+        steps.append('end')
+        return len(steps)
+
+    result = scheduler.once(job)
+    scheduler.run_pending()
+    scheduler.run_pending()
+    assert steps == ['start']
+
+    arrival.set_result('arrived')
+    scheduler.run_pending()
+    assert steps == ['start', 'arrived']
+    clock.advance(0.5)
+    scheduler.run_pending()
+    assert result.result(timeout=0) == 3
+
+
+def test_wake_runs_task_early():
+    from visual_behavior.scheduler import Scheduler
+    from visual_behavior.simulated_phidget import VirtualClock
+    clock = VirtualClock()
+    scheduler = Scheduler(clock=clock)
+    runs = []
+    scheduler.every(1.0, lambda: runs.append(clock()), name='limits')
+    scheduler.run_pending()
+    clock.advance(0.2)
+    scheduler.run_pending()
+    assert len(runs) == 1
+
+    scheduler.wake('limits')
+    scheduler.run_pending()
+    assert len(runs) == 2
+    scheduler.cancel('limits')
+    clock.advance(5.0)
+    assert scheduler.run_pending() is None and len(runs) == 2
+
+
+def test_call_runs_on_the_worker():
+    import threading
+    import pytest
+    from visual_behavior.scheduler import Scheduler
+    scheduler = Scheduler()
+    # without a worker the call runs right here
+    assert scheduler.call(threading.current_thread) is threading.current_thread()
+
+    scheduler.start()
+    try:
+        worker = scheduler.call(threading.current_thread)
+        assert worker.name == 'control-loop' and worker is not threading.current_thread()
+        # from the worker itself it runs inline instead of waiting on itself
+        assert scheduler.call(lambda: scheduler.call(threading.current_thread)) is worker
+        with pytest.raises(ZeroDivisionError):
+            scheduler.call(lambda: 1 / 0)
+    finally:
+        scheduler.stop()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+
+def test_simulated_queue_follows_plan():
+    from visual_behavior import SimulatedStage, trajectory
+    stage = SimulatedStage()
+    stage.append_move([100, 50, -20])
+    stage.append_move([0, 0, 0])
+
+    elapsed = stage.run_until_idle()
+
+    duration = trajectory.trapezoid_duration(100, 200.0, 2500.0)
+    assert elapsed == pytest.approx(2 * duration, abs=0.01)
+    assert stage.position == [0, 0, 0]
+    assert stage.is_engaged == [False, False, False]
+    assert stage.state().timestamp <= stage.clock()
+
+
+def test_simulated_jog_coalesces_and_stops():
+    from visual_behavior import SimulatedStage
+    stage = SimulatedStage()
+    for _ in range(5):
+        stage.jog(0, 10)
+    stage.advance(0.01)
+    # the five queued steps went out as one jog
+    assert stage._axes[0].getTargetPosition() == 50
+
+    for _ in range(100):
+        stage.jog(0, 10)
+        stage.advance(0.005)
+    assert stage.is_moving[0]
+    stage.stop_jog(0)
+    stage.run_until_idle()
+    # braked from full speed instead of running out the 1050 units asked for
+    assert 0 < stage.position[0] < 200
+
+
+def test_simulated_stop_jog_never_reverses_on_stale_position():
+    from visual_behavior import SimulatedStage
+    # position events every 100 ms lag the axis by far more than its braking distance
+    stage = SimulatedStage(data_interval=0.1)
+    stage.jog(0, 1000)
+    stage.advance(1.05)
+    stopped_at = stage.physical_position[0]
+    stage.stop_jog(0)
+    positions = []
+    while not stage.idle():
+        stage.advance(stage.time_step)
+        positions.append(stage.physical_position[0])
+    assert positions == sorted(positions)
+    assert stopped_at <= positions[-1] < stopped_at + 20
+
+
+def test_data_interval_bounds_state_age():
+    from visual_behavior import SimulatedStage
+    stage = SimulatedStage(data_interval=0.02)
+    assert [axis.getDataInterval() for axis in stage._axes] == [20, 20, 20]
+    stage.append_move([100, 0, 0])
+    stage.advance(0.1)
+    while stage.is_moving[0]:
+        assert stage.clock() - stage.state().timestamp <= 0.02 + 1e-9
+        stage.advance(stage.time_step)
+
+
+def test_simulated_limit_switch_hysteresis():
+    from visual_behavior import SimulatedStage
+    stage = SimulatedStage(limits=[(-10, None), (None, None), (None, 30)], limit_hysteresis=1.0)
+    events = []
+    stage.limit_changed_callback = lambda axis, tripped, timestamp: events.append((axis, tripped))
+
+    stage.append_move([-12, 0, 0])
+    stage.run_until_idle()
+    assert stage.limits == [True, False, False]
+    stage.append_move([-9.5, 0, 0])
+    stage.run_until_idle()
+    assert stage.limits == [True, False, False]
+    stage.append_move([-8.5, 0, 40])
+    stage.run_until_idle()
+    assert stage.limits == [False, False, True]
+    assert events == [(0, True), (0, False), (2, True)]
+
+
+def test_simulated_stop_preempts_queue():
+    from visual_behavior import SimulatedStage
+    stage = SimulatedStage()
+    first = stage.append_move([100, 0, 0])
+    queued = [stage.append_move([0, i, 0]) for i in range(5)]
+    stage.advance(0.1)
+    assert stage.is_moving[0]
+
+    epoch = stage.halt_epoch
+    latency = stage.stop_motion()
+    assert latency >= 0 and stage.stop_latencies[-1] == latency
+    assert stage.is_engaged == [False, False, False]
+    assert first.cancelled() and all(arrival.cancelled() for arrival in queued)
+
+    # a move requested before the stop is dropped even if it only reaches the stage afterwards
+    stage.move_to([50, 50, 50], epoch=epoch)
+    assert stage.is_engaged == [False, False, False]
+    stage.advance(1.0)
+    assert stage.position[0] < 100 and stage.position[1] == 0
+
+
+def test_axes_attach_in_parallel():
+    import time
+    from visual_behavior import SimulatedStage, InitializationError
+    t0 = time.perf_counter()
+    stage = SimulatedStage(attach_delay=0.2)
+    # one attach time, not three
+    assert time.perf_counter() - t0 < 0.5
+    assert stage.serial == 12345
+
+    with pytest.raises(InitializationError) as error:
+        SimulatedStage(attach_delay=[0.01, None, None], attach_timeout=100)
+    assert sorted(error.value.details) == ['y', 'z']
+
+    # an axis that never attaches fails like the Phidget library's timeout
+    stage = SimulatedStage()
+    stage._axes[0].attach_delay = None
+    with pytest.raises(InitializationError) as error:
+        stage.initialize_axis(0)
+    assert 'did not attach' in error.value.details['x']
+
+
+def test_process_queue_dispatches_on_stopped_events():
+    import threading
+    import time
+    from visual_behavior import PhidgetStage, SimulatedStage
+    stage = SimulatedStage()
+
+    def wait_until(predicate, timeout=1.0):
+        deadline = time.perf_counter() + timeout
+        while not predicate():
+            assert time.perf_counter() < deadline
+            time.sleep(0.001)
+
+    def step():
+        # integrate the steppers without SimulatedStage.advance, which would dispatch inline
+        with stage._motion_condition:
+            stage.clock.advance(stage.time_step)
+            for axis in stage._axes:
+                axis.step(stage.time_step)
+
+    # the rig's blocking queue loop on a thread, woken only by append_move and the steppers' events
+    stage._queue_active = True
+    worker = threading.Thread(target=PhidgetStage.process_queue, args=(stage,), daemon=True)
+    worker.start()
+    try:
+        stage.append_move([10, 0, 0])
+        stage.append_move([20, 0, 0])
+        wait_until(lambda: stage._axes[0].getTargetPosition() == 10)
+        while stage.is_moving[0]:
+            step()
+        # the stopped event dispatched the next move before any more virtual time passed
+        wait_until(lambda: stage._axes[0].getTargetPosition() == 20)
+        while stage.is_moving[0]:
+            step()
+        # and once the queue ran dry the axes were released
+        wait_until(lambda: stage.is_engaged == [False, False, False])
+        assert stage.position == [20, 0, 0]
+    finally:
+        stage.stop_queue()
+        worker.join(1.0)
+    assert not worker.is_alive()
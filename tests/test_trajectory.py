@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+
+def test_plan_move_synchronizes_axes():
+    from visual_behavior import trajectory
+    plan = trajectory.plan_move((0, 0, 0), (1000, 250, -500), 200.0, 2500.0)
+
+    # x is the limiting axis, so the move takes as long as x alone at full speed
+    assert plan.duration == pytest.approx(trajectory.trapezoid_duration(1000, 200.0, 2500.0))
+    for distance, velocity, acceleration in zip((1000, 250, 500), plan.velocity, plan.acceleration):
+        assert trajectory.trapezoid_duration(distance, velocity, acceleration) == pytest.approx(plan.duration)
+        assert velocity <= 200.0 and acceleration <= 2500.0
+
+    t = plan.duration / 3
+    fractions = [trajectory.trapezoid_position(t, d, v, a) / d
+                 for d, v, a in zip((1000, 250, -500), plan.velocity, plan.acceleration)]
+    assert fractions == pytest.approx([fractions[0]] * 3)
+
+
+def test_plan_move_short_move_is_triangular():
+    from visual_behavior import trajectory
+    plan = trajectory.plan_move((0, 0, 0), (4, 0, 2), 200.0, 2500.0)
+
+    assert plan.duration == pytest.approx(2 * (4 / 2500.0) ** 0.5)
+    assert plan.velocity[1] == 200.0
+    assert trajectory.trapezoid_duration(2, plan.velocity[2], plan.acceleration[2]) == pytest.approx(plan.duration)
+    assert trajectory.plan_move((1, 2, 3), (1, 2, 3), 200.0, 2500.0).duration == 0.0